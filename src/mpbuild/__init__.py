@@ -1,23 +1,56 @@
+from __future__ import annotations
+
+import sys
 from enum import StrEnum
 from functools import cache
-from importlib.metadata import PackageNotFoundError, version
-from pathlib import Path
+from importlib import import_module
+from types import ModuleType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pathlib import Path
 
-from .board_database import Database
-from .find_boards import find_mpy_root
+    from .board_database import Database
+    from .find_boards import find_mpy_root as find_mpy_root
 
 __app_name__ = "mpbuild"
 
-try:
-    __version__ = version(__app_name__)
-except PackageNotFoundError:
-    # Running from a source checkout without an installation (e.g. uv tool ran
-    # directly against the repo). Fall back to a sentinel rather than crashing.
-    __version__ = "0.0.0+local"
+# mpbuild is embedded as a library in other tooling, so `import mpbuild` must
+# stay cheap. These attributes are resolved on first access (PEP 562) instead
+# of at import time.
+_LAZY_ATTRIBUTES = {
+    "Database": ".board_database",
+    "find_mpy_root": ".find_boards",
+}
+
+
+def __getattr__(name: str):
+    if name == "__version__":
+        from importlib.metadata import PackageNotFoundError, version
+
+        try:
+            value = version(__app_name__)
+        except PackageNotFoundError:
+            # Running from a source checkout without an installation (e.g. uv tool ran
+            # directly against the repo). Fall back to a sentinel rather than crashing.
+            value = "0.0.0+local"
+    elif name in _LAZY_ATTRIBUTES:
+        value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), "__version__", *_LAZY_ATTRIBUTES})
 
 
 @cache
 def board_database(mpy_dir: Path | None = None, port: str | None = None) -> Database:
+    from .board_database import Database
+    from .find_boards import find_mpy_root
+
     mpy_dir, auto_port = find_mpy_root(mpy_dir)
     port = port or auto_port
     # assert port
@@ -27,3 +60,28 @@ def board_database(mpy_dir: Path | None = None, port: str | None = None) -> Data
 class OutputFormat(StrEnum):
     rich = "rich"
     text = "text"
+
+
+class Runtime(StrEnum):
+    """
+    How builds run: in a container (docker or podman), or directly on the
+    host with its own toolchain (native).
+    """
+
+    docker = "docker"
+    podman = "podman"
+    native = "native"
+
+
+class _Package(ModuleType):
+    def __setattr__(self, name: str, value: object) -> None:
+        # Importing the `board_database` submodule makes the import system set
+        # `mpbuild.board_database` to that module, which would replace the
+        # factory function above. Now that the submodule is imported lazily
+        # that can happen at any time, so keep the function.
+        if name == "board_database" and isinstance(value, ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
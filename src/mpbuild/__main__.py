@@ -1,7 +1,28 @@
-from . import __app_name__, cli
+import os
+import sys
+
+from . import __app_name__
 
 
 def main():
+    # TAB completion runs this entry point on every key press. Answer board,
+    # variant and port completions before the CLI (typer, rich) is imported.
+    if os.environ.get("_MPBUILD_COMPLETE"):
+        from .completions import fast_complete
+
+        status = fast_complete()
+        if status is not None:
+            sys.exit(status)
+
+    # Same output as the --version callback in cli.py, without loading typer.
+    if sys.argv[1:] in (["--version"], ["-v"]):
+        from . import __version__
+
+        print(f"{__app_name__} v{__version__}")
+        return
+
+    from . import cli
+
     cli.app(prog_name=__app_name__)
 
 
@@ -0,0 +1,815 @@
+"""
+Build many boards in one go.
+
+`build_many` runs up to ``jobs`` docker builds at the same time. They take
+their make jobs from the machine's jobserver (see jobserver.py), or without
+it divide the host's CPUs between them, so N concurrent builds run
+``make -j <cpus/N>`` rather than each claiming the whole machine. A build
+only starts while the memory it's estimated to need fits in the memory budget
+(see memory.py). Output from parallel builds would be unreadable interleaved
+on one terminal, so each build writes to its own log file and only a
+one-line result per target (and a summary table) is printed.
+
+A build that runs out of memory is tried again with half the make jobs,
+and from then on one build fewer runs at a time.
+
+Targets start longest expected build first, see history.py.
+"""
+
+from __future__ import annotations
+
+import itertools
+import subprocess
+import threading
+import time
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import IO
+
+from rich.console import Console
+from rich.table import Table
+
+from . import Runtime, board_database, find_mpy_root
+from .board_database import Board, Database
+from .build import (
+    BUILD_CONTAINERS,
+    CMAKE_PORTS,
+    OOM_RETRIES,
+    BuildContext,
+    CompileResult,
+    ContainerSpec,
+    PhaseResult,
+    ResourceUsage,
+    docker_build_spec,
+    firmware_artifacts,
+    mpy_cross_is_current,
+    nprocs,
+    oom_killed,
+)
+from .container_images import MpbuildImageException, ensure_images
+from .docker_engine import EngineProcess
+from .history import DurationHistory
+from .memory import (
+    MemoryBudget,
+    MemoryModel,
+    default_memory_budget,
+    format_size,
+    memory_limit,
+)
+from .results import cache_key, restore, source_state, store
+from .runtimes import spawn
+from .state import cache_dir
+from .submodules import record_submodules
+from .timings import (
+    BuildTimings,
+    compiles_file,
+    format_slowest,
+    format_timings,
+    format_usage,
+    host_phase,
+    phase_totals,
+    phases_file,
+    read_compiles,
+    read_phases,
+    slowest_compiles,
+    write_timings_json,
+)
+from .trace import write_trace
+
+DEFAULT_JOBS = 2
+
+
+class MpbuildBatchException(Exception):
+    pass
+
+
+@dataclass
+class BuildTarget:
+    board: Board
+    variant: str | None = None
+
+    @property
+    def key(self) -> tuple[str, str | None]:
+        return (self.board.name, self.variant)
+
+    @property
+    def slug(self) -> str:
+        """
+        Example: "stm32-PYBV11-DP"
+        """
+        return f"{self.board.port.name}-{self.board.name}" + (
+            f"-{self.variant}" if self.variant else ""
+        )
+
+    def __str__(self) -> str:
+        """
+        The form targets are given on the command line: BOARD or BOARD:VARIANT.
+        """
+        return self.board.name + (f":{self.variant}" if self.variant else "")
+
+
+@dataclass
+class BuildResult:
+    target: BuildTarget
+    returncode: int
+    duration: float
+    """
+    Wall-clock seconds.
+    """
+    log_path: Path
+    artifacts: list[Path] = field(default_factory=list)
+    """
+    Firmware files found after a successful build, most useful first.
+    """
+    cached: bool = False
+    """
+    The firmware was restored from an earlier build of the same inputs.
+    """
+    peak_memory: int | None = None
+    """
+    The build container's peak memory in bytes, if it reported it, in the
+    last attempt.
+    """
+    oom_kills: int = 0
+    """
+    How many times the build ran out of memory. Each time it was tried
+    again with fewer make jobs, up to ``build.OOM_RETRIES`` times.
+    """
+    phases: list[PhaseResult] = field(default_factory=list)
+    """
+    How long each step of the build took, see timings.py.
+    """
+    compiles: list[CompileResult] = field(default_factory=list)
+    """
+    Each compile of every attempt, when profiling compiles.
+    """
+    usage: ResourceUsage = field(default_factory=ResourceUsage)
+    """
+    What the build's container used over every attempt: CPU time, block
+    I/O and the highest peak memory.
+    """
+    slot: int | None = None
+    """
+    The worker (from 0 to ``jobs`` - 1) that ran the build.
+    """
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+@dataclass
+class _BuildReport:
+    """
+    What ``build_many`` learns about a build besides its exit status.
+    """
+
+    peak: int | None = None
+    oom_kills: int = 0
+    duration: float | None = None
+    """
+    Seconds the (last attempt at the) build itself took.
+    """
+    phases: list[PhaseResult] = field(default_factory=list)
+    compiles: list[CompileResult] = field(default_factory=list)
+    usage: ResourceUsage = field(default_factory=ResourceUsage)
+
+
+class _Slots:
+    """
+    How many builds may run at once, lowered when one runs out of memory.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def hold(self) -> Generator[None, None, None]:
+        with self._condition:
+            self._condition.wait_for(lambda: self.running < self.limit)
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.running -= 1
+                self._condition.notify_all()
+
+    def reduce(self) -> int:
+        with self._condition:
+            self.limit = max(1, self.limit - 1)
+            return self.limit
+
+
+def select_targets(
+    db: Database,
+    names: Iterable[str] = (),
+    port: str | None = None,
+    all_boards: bool = False,
+) -> list[BuildTarget]:
+    """
+    Expands a command line selection into build targets.
+
+    ``names`` are BOARD or BOARD:VARIANT. ``port`` adds every board of that
+    port and ``all_boards`` every board; both skip ports mpbuild can't build.
+    Duplicates are dropped, first occurrence wins.
+    """
+    targets: list[BuildTarget] = []
+
+    def add(target: BuildTarget) -> None:
+        if all(t.key != target.key for t in targets):
+            targets.append(target)
+
+    if port and port not in db.ports:
+        raise MpbuildBatchException(f"Invalid port '{port}'")
+    if all_boards or port:
+        for board in sorted(db.boards.values()):
+            if port and board.port.name != port:
+                continue
+            if board.port.name not in BUILD_CONTAINERS:
+                continue
+            add(BuildTarget(board))
+
+    for name in names:
+        board_name, _, variant = name.partition(":")
+        board = db.boards.get(board_name)
+        if board is None:
+            raise MpbuildBatchException(f"Invalid board '{board_name}'")
+        if variant and variant not in [v.name for v in board.variants]:
+            raise MpbuildBatchException(
+                f"Invalid variant '{variant}' for board '{board_name}': "
+                f"Valid variants are: {[v.name for v in board.variants]}"
+            )
+        if board.port.name not in BUILD_CONTAINERS:
+            raise MpbuildBatchException(
+                f"Sorry, builds are not supported for the {board.port.name} port at this time"
+            )
+        add(BuildTarget(board, variant or None))
+
+    return targets
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """
+    Parses ``I/N``, shard I (from 1) of N.
+
+    Raises:
+        ValueError: If ``text`` isn't a shard.
+    """
+    index, _, count = text.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"'{text}' is not a shard, like 1/4") from None
+    if not 1 <= shard[0] <= shard[1]:
+        raise ValueError(f"'{text}' is not a shard, like 1/4")
+    return shard
+
+
+def shard_targets(
+    targets: list[BuildTarget], index: int, count: int, history: DurationHistory
+) -> list[BuildTarget]:
+    """
+    Returns the targets of shard ``index`` (from 1) of ``count``, in their
+    order in ``targets``.
+
+    Targets are dealt out longest expected build first (see history.py),
+    each to the shard expected to finish first so far, which evens out the
+    shards' total build times. The split only depends on which targets there
+    are and on the durations, so CI machines given the same selection and
+    durations file each build their own part and together build all of it.
+    Targets expected to take as long as each other are dealt out by name.
+    """
+    totals = [0.0] * count
+    shard_of: dict[tuple[str, str | None], int] = {}
+    expected = {t.key: history.estimate(str(t), t.board.port.name) for t in targets}
+    for target in sorted(targets, key=lambda t: (-expected[t.key], str(t))):
+        shard = min(range(count), key=lambda i: (totals[i], i))
+        totals[shard] += expected[target.key]
+        shard_of[target.key] = shard
+    return [t for t in targets if shard_of[t.key] == index - 1]
+
+
+def build_many(
+    targets: list[BuildTarget],
+    jobs: int = DEFAULT_JOBS,
+    extra_args: list[str] | None = None,
+    build_container_override: str | None = None,
+    log_dir: Path | None = None,
+    on_done: Callable[[BuildResult], None] | None = None,
+    ccache: bool = False,
+    use_cached: bool = True,
+    context: BuildContext | None = None,
+    memory_budget: int | None = None,
+    profile_compiles: bool = False,
+) -> list[BuildResult]:
+    """
+    Builds ``targets``, running up to ``jobs`` of them concurrently.
+
+    With a ``memory_budget`` (bytes) a build waits to start until its
+    estimated peak memory fits next to that of the running builds, and its
+    container is limited to twice the estimate. The estimates are refined
+    from the peaks builds report (see memory.py).
+
+    A build that runs out of memory (OOM-killed, see ``build.oom_killed``, or
+    a compiler in it was) is tried again with half the make jobs, outside the
+    jobserver, and the number of builds running at once goes down by one.
+
+    Targets whose inputs match an earlier successful build are restored from
+    the result cache instead of built, unless ``use_cached`` is False.
+
+    ``make submodules`` runs for one target at a time, ahead of its build,
+    and is left out of the builds running concurrently.
+
+    Targets start in order of their expected build time, longest first (see
+    history.py), and successful builds record theirs. A failing target
+    doesn't stop the others. Results are returned in the order of
+    ``targets``; ``on_done`` is called (from a worker thread) as each one
+    finishes. Each build's output goes to ``<log_dir>/<slug>.log``.
+
+    With ``ccache`` builds share one compiler cache per build image, so the
+    hit/miss counts in each log also include the concurrent builds using the
+    same image.
+
+    Each result carries what its build's container used, see
+    ``build.ResourceUsage``.
+
+    With ``profile_compiles`` each build times its compiles (see
+    ``build.docker_build_spec``) and its log ends with the slowest.
+    """
+    if extra_args is None:
+        extra_args = []
+    if log_dir is None:
+        log_dir = cache_dir() / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = max(1, min(jobs, len(targets)))
+    make_jobs = max(1, nprocs // jobs)
+
+    running: set[subprocess.Popen[bytes] | EngineProcess] = set()
+    lock = threading.Lock()
+
+    if not targets:
+        return []
+    # One look at the source tree and host covers every target.
+    mpy_dir = targets[0].board.port.directory_repo
+    state = source_state(mpy_dir)
+    if context is None:
+        context = BuildContext.create(mpy_dir, jobserver=True)
+
+    memory = MemoryModel()
+    admission = MemoryBudget(memory_budget) if memory_budget else None
+    slots = _Slots(jobs)
+    history = DurationHistory()
+
+    # Held while building mpy-cross for an image, see prepare_mpy_cross().
+    image_locks: dict[str, threading.Lock] = {}
+    # Held while updating the submodules, see prepare_submodules().
+    submodules_lock = threading.Lock()
+
+    # Each worker thread numbers itself the first time it runs a build.
+    worker = threading.local()
+    workers = itertools.count()
+
+    def image_of(target: BuildTarget) -> str:
+        return context.image(target.board, target.variant, build_container_override)
+
+    def result_key(target: BuildTarget) -> str | None:
+        if state is None:
+            return None
+        return cache_key(state, target.board, target.variant, extra_args, image_of(target))
+
+    def run_logged(spec: ContainerSpec, log: IO[str]) -> tuple[int, bool]:
+        """
+        Returns the exit status, and whether the build was OOM-killed.
+        """
+        log.write(f"$ {spec}\n\n")
+        log.flush()
+        proc = spawn(spec, stdout=log)
+        with lock:
+            running.add(proc)
+        try:
+            returncode = proc.wait()
+            return returncode, oom_killed(proc, returncode)
+        finally:
+            with lock:
+                running.discard(proc)
+
+    def prepare_mpy_cross(target: BuildTarget, log: IO[str]) -> int:
+        """
+        Builds mpy-cross for the target's image unless that's been done
+        already. Targets sharing an image wait for the first one to finish,
+        so it's built once per image and then left out of every build.
+        """
+        if target.board.port.name in CMAKE_PORTS:
+            return 0
+        image = image_of(target)
+        with lock:
+            image_lock = image_locks.setdefault(image, threading.Lock())
+        with image_lock:
+            if mpy_cross_is_current(target.board.port.directory_repo, image):
+                return 0
+            spec = docker_build_spec(
+                board=target.board,
+                variant=target.variant,
+                build_container_override=build_container_override,
+                docker_interactive=False,
+                mpy_cross_only=True,
+                context=context,
+            )
+            return run_logged(spec, log)[0]
+
+    def prepare_submodules(target: BuildTarget, log: IO[str]) -> int:
+        """
+        Runs ``make submodules`` for the target unless its submodules are
+        current, and records them (see submodules.py). Concurrent updates of
+        the checkout would race on git's index locks under .git/modules, so
+        one target at a time does this and the builds leave the step out.
+        """
+        with submodules_lock:
+            if context.submodules_current(target.board, target.variant):
+                return 0
+            spec = docker_build_spec(
+                board=target.board,
+                variant=target.variant,
+                build_container_override=build_container_override,
+                docker_interactive=False,
+                submodules_only=True,
+                context=context,
+            )
+            returncode = run_logged(spec, log)[0]
+            if returncode == 0:
+                record_submodules(target.board, target.variant)
+            return returncode
+
+    def build(
+        target: BuildTarget, log: IO[str], timings_file: Path, profile_file: Path | None
+    ) -> tuple[int, _BuildReport]:
+        """
+        Builds the target, again with fewer make jobs while it runs out of
+        memory. Returns the exit status and the memory the last attempt
+        used, with ``oom_kills`` counting the attempts that ran out and
+        ``phases`` and ``compiles`` the steps and compiles of every attempt.
+        """
+        port = target.board.port.name
+        build_jobs = context.jobserver.tokens if context.jobserver else make_jobs
+        build_context = context
+        oom_kills = 0
+        phases: list[PhaseResult] = []
+        compiles: list[CompileResult] = []
+        usage = ResourceUsage()
+        while True:
+            estimate = memory.estimate(port)
+            limit = memory_limit(estimate, memory_budget) if admission else None
+            with slots.hold(), admission.reserve(estimate) if admission else nullcontext():
+                with host_phase(phases, "prepare-mpy-cross"):
+                    returncode = prepare_mpy_cross(target, log)
+                if returncode == 0:
+                    with host_phase(phases, "prepare-submodules"):
+                        returncode = prepare_submodules(target, log)
+                if returncode != 0:
+                    return returncode, _BuildReport(
+                        oom_kills=oom_kills, phases=phases, compiles=compiles, usage=usage
+                    )
+                spec = docker_build_spec(
+                    board=target.board,
+                    variant=target.variant,
+                    extra_args=extra_args,
+                    build_container_override=build_container_override,
+                    docker_interactive=False,
+                    make_jobs=build_jobs,
+                    ccache=ccache,
+                    context=build_context,
+                    submodules=False,
+                    memory_limit=limit,
+                    report_memory=True,
+                    timings_file=timings_file,
+                    compiles_file=profile_file,
+                )
+                started = time.monotonic()
+                spawned = time.time()
+                returncode, killed = run_logged(spec, log)
+            attempt = ResourceUsage()
+            phases += read_phases(timings_file, spawned, attempt)
+            usage.add(attempt)
+            if profile_file is not None:
+                compiles += read_compiles(profile_file, mpy_dir)
+            report = _BuildReport(
+                peak=attempt.peak_memory,
+                oom_kills=attempt.oom_kills,
+                duration=time.monotonic() - started,
+                phases=phases,
+                compiles=compiles,
+                usage=usage,
+            )
+            if report.peak is not None:
+                memory.record(port, report.peak)
+            elif killed and limit:
+                memory.record(port, limit)  # it needed at least that
+            if returncode == 0 or not (killed or report.oom_kills):
+                report.oom_kills = oom_kills
+                return returncode, report
+            oom_kills += 1
+            if oom_kills > OOM_RETRIES or build_jobs == 1:
+                report.oom_kills = oom_kills
+                return returncode, report
+            build_jobs = max(1, build_jobs // 2)
+            build_context = replace(context, jobserver=None)
+            at_once = slots.reduce()
+            log.write(
+                f"\nmpbuild: the build ran out of memory, retrying with make -j {build_jobs} "
+                f"and {at_once} build(s) at a time\n\n"
+            )
+
+    def run(target: BuildTarget) -> BuildResult:
+        if not hasattr(worker, "slot"):
+            with lock:
+                worker.slot = next(workers)
+        log_path = log_dir / f"{target.slug}.log"
+        start = time.monotonic()
+        key = None
+        restored = None
+        report = _BuildReport()
+        lookup: list[PhaseResult] = []
+        with (
+            log_path.open("w") as log,
+            phases_file() as timings_file,
+            compiles_file() if profile_compiles else nullcontext() as profile_file,
+        ):
+            try:
+                with host_phase(lookup, "cache"):
+                    key = result_key(target)
+                    if key and use_cached:
+                        restored = restore(key, target.board, target.variant)
+                if restored:
+                    log.write(f"Restored from the result cache ({key}):\n")
+                    log.writelines(f"  {p}\n" for p in restored)
+                    returncode = 0
+                else:
+                    returncode, report = build(target, log, timings_file, profile_file)
+            except Exception as e:  # unknown variant, toolchain missing, DockerEngineError, etc.
+                log.write(f"error: {e}\n")
+                returncode = 1
+            if report.compiles:
+                timings = BuildTimings(
+                    str(target), target.board.port.name, compiles=report.compiles
+                )
+                log.write("\nmpbuild: slowest compiles:\n")
+                log.writelines(
+                    f"{line}\n"
+                    for line in format_slowest(slowest_compiles([timings]), targets=False)
+                )
+
+        if returncode == 0 and not restored:
+            if report.duration is not None:
+                history.record(str(target), target.board.port.name, report.duration)
+            if key:
+                store(key, target.board, target.variant)
+        result = BuildResult(
+            target=target,
+            returncode=returncode,
+            duration=time.monotonic() - start,
+            log_path=log_path,
+            artifacts=firmware_artifacts(target.board, target.variant) if returncode == 0 else [],
+            cached=bool(restored),
+            peak_memory=report.peak,
+            oom_kills=report.oom_kills,
+            phases=lookup + report.phases,
+            compiles=report.compiles,
+            usage=report.usage,
+            slot=worker.slot,
+        )
+        if on_done is not None:
+            on_done(result)
+        return result
+
+    def expected_duration(i: int) -> float:
+        return history.estimate(str(targets[i]), targets[i].board.port.name)
+
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="mpbuild")
+    # Submitted longest first; the pool starts them in that order.
+    futures = {
+        i: executor.submit(run, targets[i])
+        for i in sorted(range(len(targets)), key=expected_duration, reverse=True)
+    }
+    try:
+        results = [futures[i].result() for i in range(len(targets))]
+    except KeyboardInterrupt:
+        # Don't leave docker containers building in the background.
+        executor.shutdown(wait=False, cancel_futures=True)
+        with lock:
+            for proc in running:
+                proc.terminate()
+        raise
+    executor.shutdown()
+    return results
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}m {seconds:04.1f}s" if minutes else f"{seconds:.1f}s"
+
+
+def _display_path(path: Path, mpy_dir: Path) -> str:
+    return str(path.relative_to(mpy_dir)) if path.is_relative_to(mpy_dir) else str(path)
+
+
+def print_summary(results: list[BuildResult], mpy_dir: Path, console: Console) -> None:
+    """
+    Prints one row per target: pass/fail (and how often it ran out of
+    memory), duration and the firmware file (or, for failures, the log to
+    look at).
+    """
+    table = Table(title="Build summary", title_justify="left")
+    table.add_column("Target")
+    table.add_column("Port")
+    table.add_column("Result")
+    table.add_column("Duration", justify="right")
+    table.add_column("Artifact / log")
+    for r in results:
+        if r.ok:
+            status = "[green]PASS[/]" + (" (cached)" if r.cached else "")
+            where = _display_path(r.artifacts[0], mpy_dir) if r.artifacts else ""
+        else:
+            status = f"[red]FAIL ({r.returncode})[/]"
+            where = str(r.log_path)
+        if r.oom_kills:
+            status += f" [yellow]OOM x{r.oom_kills}[/]"
+        table.add_row(
+            str(r.target), r.target.board.port.name, status, _format_duration(r.duration), where
+        )
+    console.print(table)
+    passed = sum(r.ok for r in results)
+    console.print(f"{passed}/{len(results)} targets built successfully")
+
+
+def build_many_boards(
+    names: list[str] | None = None,
+    port: str | None = None,
+    all_boards: bool = False,
+    jobs: int = DEFAULT_JOBS,
+    extra_args: list[str] | None = None,
+    build_container_override: str | None = None,
+    mpy_dir: str | Path | None = None,
+    ccache: bool = False,
+    use_cached: bool = True,
+    offline: bool = False,
+    runtime: Runtime | None = None,
+    memory_budget: int | None = None,
+    shard: str | None = None,
+    durations: Path | None = None,
+    timings_json: Path | None = None,
+    trace: Path | None = None,
+    profile_compiles: bool = False,
+) -> list[BuildResult]:
+    """
+    Build a selection of boards concurrently and print a summary.
+
+    ``shard`` (``I/N``) builds only that part of the selection, see
+    ``shard_targets``, split by the durations in ``durations``. Without them
+    the split uses each port's default duration, not this machine's history,
+    so that every machine splits the same way (see history.py).
+
+    The build images are checked first and missing ones pulled concurrently;
+    with ``offline`` a missing image stops the run before anything builds.
+    ``runtime`` is what runs the builds, see ``build.build_board``.
+    ``memory_budget`` (bytes, default: ``memory.default_memory_budget()``, 0 for
+    none) is the memory the concurrent builds are kept within.
+
+    The summary ends with the time spent in each build step across the
+    builds (see timings.py) and what their containers used;
+    ``timings_json`` writes every build's steps and usage to that file, and
+    ``trace`` writes the session as a trace with a track per worker that
+    Perfetto opens (see trace.py). With ``profile_compiles`` it lists the
+    slowest compiles across the builds, and each build's log its own.
+
+    This command writes to stdout and exits the program with status 1 if any
+    target failed.
+    """
+    console = Console()
+    mpy_dir, _ = find_mpy_root(mpy_dir)
+    db = board_database(mpy_dir)
+
+    try:
+        targets = select_targets(db, names or [], port=port, all_boards=all_boards)
+    except MpbuildBatchException as e:
+        console.print(e)
+        raise SystemExit(1) from e
+    if not targets:
+        console.print("Nothing to build: give board names, --port or --all")
+        raise SystemExit(1)
+    if shard is not None:
+        try:
+            index, count = parse_shard(shard)
+        except ValueError as e:
+            console.print(f"[red]ERROR:[/] {e}")
+            raise SystemExit(1) from e
+        history = DurationHistory(durations) if durations else DurationHistory.defaults()
+        selected = len(targets)
+        targets = shard_targets(targets, index, count, history)
+        expected = sum(history.estimate(str(t), t.board.port.name) for t in targets)
+        console.print(
+            f"Shard {index}/{count}: {len(targets)} of {selected} target(s), "
+            f"about {_format_duration(expected)} of building"
+        )
+        if not targets:
+            return []
+
+    if memory_budget is None:
+        try:
+            memory_budget = default_memory_budget()
+        except ValueError as e:
+            console.print(f"[red]ERROR:[/] {e}")
+            raise SystemExit(1) from e
+
+    context = BuildContext.create(db.mpy_root_directory, runtime=runtime, jobserver=True)
+    setup: list[PhaseResult] = []
+    pulls: list[PhaseResult] = []
+    try:
+        with host_phase(setup, "images"):
+            ensure_images(
+                [(t.board, t.variant) for t in targets],
+                build_container_override,
+                offline=offline,
+                console=console,
+                context=context,
+                pulls=pulls,
+            )
+    except MpbuildImageException as e:
+        console.print(f"[red]ERROR:[/] {e}")
+        raise SystemExit(1) from e
+
+    jobs = max(1, min(jobs, len(targets)))
+    log_dir = cache_dir() / "logs"
+    if context.jobserver is not None:
+        parallelism = f"sharing {context.jobserver.tokens} make jobs"
+    else:
+        parallelism = f"make -j {max(1, nprocs // jobs)} each"
+    if memory_budget:
+        parallelism += f", within {format_size(memory_budget)} of memory"
+    console.print(
+        f"Building {len(targets)} target(s), {jobs} at a time ({parallelism}). Logs: {log_dir}"
+    )
+
+    def report(result: BuildResult) -> None:
+        status = "[green]PASS[/]" if result.ok else "[red]FAIL[/]"
+        if result.cached:
+            status += " (cached)"
+        if result.oom_kills:
+            status += f" [yellow](out of memory {result.oom_kills}x)[/]"
+        console.print(f"{status} {result.target} ({_format_duration(result.duration)})")
+
+    results = build_many(
+        targets,
+        jobs=jobs,
+        extra_args=extra_args,
+        build_container_override=build_container_override,
+        log_dir=log_dir,
+        on_done=report,
+        ccache=ccache,
+        use_cached=use_cached,
+        context=context,
+        memory_budget=memory_budget or None,
+        profile_compiles=profile_compiles,
+    )
+    print_summary(results, db.mpy_root_directory, console)
+    timings = [
+        BuildTimings(
+            str(r.target),
+            r.target.board.port.name,
+            r.returncode,
+            r.phases,
+            r.slot,
+            r.compiles,
+            r.usage,
+        )
+        for r in results
+    ]
+    console.print(f"Time per step: {format_timings(setup + phase_totals(timings))}")
+    usage = ResourceUsage()
+    for r in results:
+        usage.add(r.usage)
+    if usage.known:
+        console.print(f"Container usage, all builds: {format_usage(usage)}")
+    if any(t.compiles for t in timings):
+        console.print("Slowest compiles:")
+        for line in format_slowest(slowest_compiles(timings)):
+            console.print(line, markup=False, highlight=False)
+    if timings_json is not None:
+        try:
+            write_timings_json(timings_json, timings, setup)
+        except OSError as e:
+            console.print(f"[red]ERROR:[/] Could not write the timings to {timings_json}: {e}")
+    if trace is not None:
+        try:
+            write_trace(trace, timings, setup, pulls)
+        except OSError as e:
+            console.print(f"[red]ERROR:[/] Could not write the trace to {trace}: {e}")
+    if not all(r.ok for r in results):
+        raise SystemExit(1)
+    return results
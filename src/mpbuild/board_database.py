@@ -30,15 +30,31 @@ ports/stm32/boards/PYBV11/board.json
 
 This module implements `class Database` which reads all 'board.json' files and
 provides a way to browse it's data.
+
+Parsing every 'board.json' is slow on network and WSL filesystems, so the
+parsed files are kept in a persistent index (see `load_board_index`). The index
+is revalidated with one `stat` per file and only changed files are re-read.
 """
 
 from __future__ import annotations
 
+import hashlib
 import json
+import os
 from dataclasses import dataclass, field
-from glob import glob
+from glob import escape, glob
 from pathlib import Path
 
+from .state import cache_dir, read_json, write_json
+
+BOARD_INDEX_VERSION = 1
+
+SPECIAL_PORTS = ["unix", "webassembly", "windows"]
+"""
+Ports that don't have boards. Each is presented as a single board named after
+the port, with variants taken from the port's 'variants' directory.
+"""
+
 
 class MpbuildMpyDirectoryException(Exception):
     pass
@@ -106,9 +122,15 @@ class Board:
     def factory(port: Port, filename_json: Path) -> Board:
         with filename_json.open() as f:
             board_json = json.load(f)
+        return Board.from_json(port, filename_json.parent.name, board_json)
 
+    @staticmethod
+    def from_json(port: Port, name: str, board_json: dict) -> Board:
+        """
+        Creates a board from the already decoded contents of its 'board.json'.
+        """
         board = Board(
-            name=filename_json.parent.name,
+            name=name,
             variants=[],
             url=board_json.get("url", "http://micropython.org"),
             mcu=board_json.get("mcu", ""),
@@ -207,13 +229,12 @@ class Database:
                 f"repo: {self.mpy_root_directory}"
             )
 
-        # Take care to avoid using Path.glob! Performance was 15x slower.
-        for p in glob(f"{self.mpy_root_directory}/ports/*/boards/*/board.json"):
-            filename_json = Path(p)
-            port_directory = filename_json.parent.parent.parent
-            port_name = port_directory.name
+        for relative_json, board_json in load_board_index(self.mpy_root_directory).items():
+            # relative_json: "ports/<port>/boards/<board>/board.json"
+            _, port_name, _, board_name, _ = relative_json.split("/")
             if self.port_filter and self.port_filter != port_name:
                 continue
+            port_directory = self.mpy_root_directory / "ports" / port_name
 
             # Create a port
             port = self.ports.get(port_name, None)
@@ -221,19 +242,19 @@ class Database:
                 port = Port(name=port_name, directory=port_directory)
                 self.ports[port_name] = port
 
-            # Load board.json and attach it to the board
-            board = Board.factory(port=port, filename_json=filename_json)
+            # Attach the board.json contents to the board
+            board = Board.from_json(port=port, name=board_name, board_json=board_json)
 
             port.boards[board.name] = board
             self.boards[board.name] = board
 
         # Add 'special' ports, that don't have boards
         # TODO(mst) Tidy up later (variant descriptions etc)
-        for special_port_name in ["unix", "webassembly", "windows"]:
+        for special_port_name in SPECIAL_PORTS:
             if self.port_filter and self.port_filter != special_port_name:
                 continue
             path = self.mpy_root_directory / "ports" / special_port_name
-            variant_names = [var.name for var in path.glob("variants/*") if var.is_dir()]
+            variant_names = special_port_variants(path)
             port = Port(
                 name=special_port_name,
                 directory=path,
@@ -291,3 +312,67 @@ class Database:
             issues.append(f"{port_name}/{board_name}: 'deploy' is not a list")
 
         return issues
+
+
+def special_port_variants(port_directory: Path) -> list[str]:
+    """
+    Returns the variant names of a special port, for example ["minimal", "standard"].
+    """
+    return [var.name for var in port_directory.glob("variants/*") if var.is_dir()]
+
+
+def _board_index_path(mpy_root_directory: Path) -> Path:
+    """
+    The index file for one MicroPython checkout. Worktrees and forks each get
+    their own index, keyed on the absolute path of the repo.
+    """
+    key = hashlib.sha1(str(mpy_root_directory.resolve()).encode()).hexdigest()[:16]
+    return cache_dir() / "boards" / f"{key}.json"
+
+
+def load_board_index(mpy_root_directory: Path) -> dict[str, dict]:
+    """
+    Returns the decoded contents of every 'board.json' in the repo.
+
+    Keys are paths relative to the repo root, in the order the files were
+    found, for example "ports/stm32/boards/PYBV11/board.json".
+
+    The result is persisted between runs. An entry is reused as long as the
+    size and modification time of its 'board.json' are unchanged, so a warm
+    start costs one directory walk plus one `stat` per board instead of
+    opening and parsing every file. Boards that were added or removed are
+    picked up by the walk.
+    """
+    index_path = _board_index_path(mpy_root_directory)
+    cached = read_json(index_path)
+    entries: dict[str, dict] = {}
+    if (
+        isinstance(cached, dict)
+        and cached.get("version") == BOARD_INDEX_VERSION
+        and cached.get("root") == str(mpy_root_directory)
+        and isinstance(cached.get("boards"), dict)
+    ):
+        entries = cached["boards"]
+
+    prefix_len = len(str(mpy_root_directory)) + 1
+    fresh: dict[str, dict] = {}
+    changed = False
+    # Take care to avoid using Path.glob! Performance was 15x slower.
+    for p in glob(f"{escape(str(mpy_root_directory))}/ports/*/boards/*/board.json"):
+        relative_json = p[prefix_len:].replace(os.sep, "/")
+        st = os.stat(p)
+        stat_key = [st.st_mtime_ns, st.st_size]
+        entry = entries.get(relative_json)
+        if not isinstance(entry, dict) or entry.get("stat") != stat_key:
+            with open(p) as f:
+                entry = {"stat": stat_key, "json": json.load(f)}
+            changed = True
+        fresh[relative_json] = entry
+
+    if changed or fresh.keys() != entries.keys():
+        write_json(
+            index_path,
+            {"version": BOARD_INDEX_VERSION, "root": str(mpy_root_directory), "boards": fresh},
+        )
+
+    return {relative_json: entry["json"] for relative_json, entry in fresh.items()}
@@ -1,17 +1,39 @@
+from __future__ import annotations
+
 import glob
-import multiprocessing
+import hashlib
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
+import time
+from collections.abc import Callable, Hashable
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, TypeVar, cast
 
 from rich import print
 from rich.markdown import Markdown
 from rich.panel import Panel
 
-from . import board_database, find_mpy_root
+from . import Runtime, board_database, find_mpy_root
 from .board_database import Board
+from .jobserver import JOBSERVER_FD, JOBSERVER_MOUNT, Jobserver, available_cpus, shared_jobserver
+from .state import cache_dir
+from .submodules import (
+    SUBMODULE_FETCH_JOBS,
+    record_submodules,
+    submodule_state,
+    submodules_current,
+)
+
+if TYPE_CHECKING:
+    from .docker_engine import EngineProcess
+
+T = TypeVar("T")
 
 
 def get_main_git_directory(mpy_dir: Path) -> Path | None:
@@ -179,6 +201,63 @@ def detect_idf_version(mpy_dir: Path, mcu: str) -> str | None:
     )
 
 
+# Compiler (or build tool) a native build of each port needs on PATH. Ports
+# not listed only need make.
+NATIVE_TOOLCHAINS = {
+    "stm32": "arm-none-eabi-gcc",
+    "rp2": "arm-none-eabi-gcc",
+    "nrf": "arm-none-eabi-gcc",
+    "mimxrt": "arm-none-eabi-gcc",
+    "renesas-ra": "arm-none-eabi-gcc",
+    "samd": "arm-none-eabi-gcc",
+    "alif": "arm-none-eabi-gcc",
+    "psoc-edge": "arm-none-eabi-gcc",
+    "esp32": "idf.py",
+    "esp8266": "xtensa-lx106-elf-gcc",
+    "unix": "gcc",
+    "windows": "i686-w64-mingw32-gcc",
+}
+
+# Stands in for the build image in cache keys and per-image directories
+# (mpy-cross, ccache) when building natively.
+NATIVE_IMAGE = "native"
+
+
+def native_toolchain_version(port_name: str) -> str | None:
+    """
+    The path and first line of ``--version`` of the toolchain a native build
+    of the port uses (see ``NATIVE_TOOLCHAINS``). None if the port doesn't
+    list one, or it isn't on PATH or won't run.
+    """
+    toolchain = NATIVE_TOOLCHAINS.get(port_name)
+    path = shutil.which(toolchain) if toolchain else None
+    if path is None:
+        return None
+    try:
+        proc = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0:
+        return None
+    return f"{path}: {next(iter(proc.stdout.splitlines()), '')}"
+
+
+RUNTIME_ENV = "MPBUILD_RUNTIME"
+
+
+def default_runtime() -> Runtime:
+    """
+    The runtime set with MPBUILD_RUNTIME, docker if it isn't set.
+    """
+    value = os.environ.get(RUNTIME_ENV, "") or Runtime.docker
+    try:
+        return Runtime(value)
+    except ValueError:
+        raise ValueError(
+            f"{RUNTIME_ENV}={value} is not one of: {', '.join(r.value for r in Runtime)}"
+        ) from None
+
+
 class MpbuildNotSupportedException(Exception):
     pass
 
@@ -221,19 +300,1071 @@ def get_build_container(board: Board, variant: str | None = None) -> str:
         raise MpbuildNotSupportedException(f"{board.name}-{variant}") from e
 
 
-nprocs = multiprocessing.cpu_count()
+def host_device_flags() -> str:
+    """
+    Returns the ``--device`` flags that give a build container access to the
+    USB bus and every ttyACM/ttyUSB serial device, for deploying.
+    """
+    # Dynamically find all ttyACM and ttyUSB devices
+    tty_devices = []
+    for pattern in ["/dev/ttyACM*", "/dev/ttyUSB*"]:
+        tty_devices.extend(glob.glob(pattern))
 
+    # Build device flags
+    device_flags = ""
+    if os.path.exists("/dev/bus/usb/") and os.listdir("/dev/bus/usb/"):
+        device_flags += "--device /dev/bus/usb/ "  # USB access
+    for device in tty_devices:
+        device_flags += f"--device {device} "
+    return device_flags
 
-def docker_build_cmd(
+
+@dataclass
+class BuildContext:
+    """
+    Repository and host facts every build in a session needs, worked out
+    once: the common git directory of a worktree (a git subprocess), the
+    devices to pass through (globbing /dev) and each board's build image
+    (for esp32, reading and parsing lockfiles).
+
+    Create one per command, batch or TUI action and pass it to each
+    ``docker_build_cmd`` call. Devices are scanned when the context is
+    created, so one plugged in later is seen by the next context.
+
+    Builds change the submodule checkout and mpy-cross, so those are looked
+    at again on every call, unless ``static_tree`` says nothing will build
+    while the context is in use (``mpbuild plan``).
+
+    Builds in a context with a ``jobserver`` take their make jobs from it
+    rather than each running ``make -j``.
+    """
+
+    mpy_dir: Path
+    main_git_dir: Path | None
+    """
+    The common .git directory when ``mpy_dir`` is a worktree, else None.
+    """
+    device_flags: str
+    static_tree: bool = False
+    runtime: Runtime = Runtime.docker
+    jobserver: Jobserver | None = None
+    _build_containers: dict[tuple[str, str, str | None], str] = field(
+        default_factory=dict, repr=False
+    )
+    _static: dict[Hashable, Any] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def create(
+        cls,
+        mpy_dir: str | Path,
+        static_tree: bool = False,
+        runtime: Runtime | None = None,
+        jobserver: bool = False,
+    ) -> BuildContext:
+        """
+        ``runtime`` defaults to ``default_runtime()``. With ``jobserver``
+        builds share the machine's jobserver, if it's enabled (see
+        ``jobserver.shared_jobserver``).
+        """
+        mpy_dir = Path(mpy_dir)
+        return cls(
+            mpy_dir=mpy_dir,
+            main_git_dir=get_main_git_directory(mpy_dir),
+            device_flags=host_device_flags(),
+            static_tree=static_tree,
+            runtime=runtime or default_runtime(),
+            jobserver=shared_jobserver() if jobserver else None,
+        )
+
+    @property
+    def devices(self) -> list[str]:
+        """
+        The device paths in ``device_flags``.
+        """
+        return shlex.split(self.device_flags)[1::2]
+
+    def _once(self, key: Hashable, compute: Callable[[], T]) -> T:
+        if not self.static_tree:
+            return compute()
+        if key not in self._static:
+            self._static[key] = compute()
+        return cast(T, self._static[key])
+
+    def submodule_state(self) -> str | None:
+        return self._once("submodules", lambda: submodule_state(self.mpy_dir))
+
+    def mpy_cross_signature(self, build_container: str) -> str:
+        return self._once(
+            ("mpy-cross", build_container),
+            lambda: mpy_cross_signature(self.mpy_dir, build_container),
+        )
+
+    def submodules_current(self, board: Board, variant: str | None = None) -> bool:
+        """
+        ``submodules.submodules_current`` using this context's state.
+        """
+        state = self.submodule_state()
+        return state is not None and submodules_current(board, variant, state)
+
+    def mpy_cross_current(self, build_container: str) -> bool:
+        """
+        ``mpy_cross_is_current`` using this context's signature.
+        """
+        return _mpy_cross_stamp_matches(
+            mpy_cross_build_dir(self.mpy_dir, build_container),
+            self.mpy_cross_signature(build_container),
+        )
+
+    def build_container(self, board: Board, variant: str | None = None) -> str:
+        """
+        ``get_build_container``, remembered per board and variant.
+        """
+        key = (board.port.name, board.name, variant)
+        if key not in self._build_containers:
+            self._build_containers[key] = get_build_container(board, variant)
+        return self._build_containers[key]
+
+    def image(
+        self, board: Board, variant: str | None = None, build_container_override: str | None = None
+    ) -> str:
+        """
+        The image this board/variant builds in with this context's runtime:
+        ``NATIVE_IMAGE`` natively, else the override or ``build_container``.
+        """
+        if self.runtime == Runtime.native:
+            return NATIVE_IMAGE
+        return build_container_override or self.build_container(board, variant)
+
+
+# CPUs a build may use, within any cgroup quota. Builds sharing the
+# jobserver (see jobserver.py) share these between them.
+nprocs = available_cpus()
+
+# Variant each special port builds when none is given (the VARIANT ?= default
+# in the port's Makefile). Their build directory is named after the variant.
+SPECIAL_PORT_DEFAULT_VARIANTS = {
+    "unix": "standard",
+    "webassembly": "standard",
+    "windows": "dev",
+}
+
+# Files a successful build leaves in its build directory, most useful first.
+FIRMWARE_PATTERNS = [
+    "firmware*.uf2",
+    "firmware*.dfu",
+    "firmware*.bin",
+    "firmware*.hex",
+    "micropython",
+    "micropython.exe",
+    "micropython.mjs",
+    "firmware*.elf",
+]
+
+
+def build_directory(board: Board, variant: str | None = None) -> Path:
+    """
+    Returns the directory make writes this board/variant's build output to.
+
+    Example: board="PYBV11", variant="DP" => ports/stm32/build-PYBV11-DP
+    Example: board="unix", variant=None => ports/unix/build-standard
+    """
+    if board.physical_board:
+        name = f"build-{board.name}" + (f"-{variant}" if variant else "")
+    else:
+        name = f"build-{variant or SPECIAL_PORT_DEFAULT_VARIANTS.get(board.port.name, '')}"
+    return board.port.directory / name
+
+
+def firmware_artifacts(board: Board, variant: str | None = None) -> list[Path]:
+    """
+    Returns the firmware files present in the build directory, most useful
+    first (see FIRMWARE_PATTERNS). Empty if nothing has been built.
+    """
+    directory = build_directory(board, variant)
+    artifacts: list[Path] = []
+    for pattern in FIRMWARE_PATTERNS:
+        for p in sorted(glob.glob(f"{glob.escape(str(directory))}/{pattern}")):
+            path = Path(p)
+            if path.is_file() and path not in artifacts:
+                artifacts.append(path)
+    return artifacts
+
+
+def image_slug(build_container: str) -> str:
+    """
+    Returns ``build_container`` as a file name.
+
+    Example: "espressif/idf:v5.4.2" => "espressif_idf_v5.4.2"
+    """
+    return re.sub(r"[^\w.-]+", "_", build_container)
+
+
+# Ports built through cmake find mpy-cross at its default location
+# (mpy-cross/build) and build it themselves if it's missing, so they don't
+# use the per-image mpy-cross below.
+CMAKE_PORTS = {"esp32", "rp2"}
+
+MPY_CROSS_STAMP = ".mpbuild-stamp"
+
+# What mpy-cross is built from, relative to the repo root.
+_MPY_CROSS_SOURCES = ["mpy-cross", "py"]
+
+
+def mpy_cross_build_dir(mpy_dir: Path, build_container: str) -> Path:
+    """
+    Returns where mpy-cross is built for this image. Each image gets its own
+    directory so builds in different images neither relink each other's
+    mpy-cross nor race writing the same binary.
+
+    Example: mpy-cross/build-micropython_build-micropython-arm
+    """
+    return Path(mpy_dir) / "mpy-cross" / f"build-{image_slug(build_container)}"
+
+
+def mpy_cross_signature(mpy_dir: Path, build_container: str) -> str:
+    """
+    Returns a digest of the image and the path, mtime and size of every
+    mpy-cross source file (``mpy-cross/`` and ``py/``, build output
+    excluded). It changes whenever make would consider mpy-cross stale.
+    """
+    digest = hashlib.sha1(build_container.encode())
+    for top in _MPY_CROSS_SOURCES:
+        for dirpath, dirnames, filenames in os.walk(Path(mpy_dir) / top):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("build"))
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                digest.update(f"{path} {st.st_mtime_ns} {st.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def _mpy_cross_stamp_matches(build_dir: Path, signature: str) -> bool:
+    try:
+        stamp = (build_dir / MPY_CROSS_STAMP).read_text().strip()
+    except OSError:
+        return False
+    return stamp == signature and (build_dir / "mpy-cross").is_file()
+
+
+def mpy_cross_is_current(mpy_dir: Path, build_container: str) -> bool:
+    """
+    True if mpy-cross has been built for this image from the current sources.
+    """
+    return _mpy_cross_stamp_matches(
+        mpy_cross_build_dir(mpy_dir, build_container),
+        mpy_cross_signature(mpy_dir, build_container),
+    )
+
+
+def _make_mpy_cross_cmd(mpy_dir: Path, build_container: str, signature: str) -> str:
+    """
+    Returns the shell steps that build this image's mpy-cross and record the
+    stamp, each followed by ``&&``; empty if it is already current.
+    """
+    build_dir = mpy_cross_build_dir(mpy_dir, build_container)
+    if _mpy_cross_stamp_matches(build_dir, signature):
+        return ""
+    return (
+        f"make -C mpy-cross BUILD={build_dir.name} && "
+        f"echo {signature} > mpy-cross/{build_dir.name}/{MPY_CROSS_STAMP} && "
+    )
+
+
+# Where a ccache directory is mounted in the build container.
+CCACHE_MOUNT = "/ccache"
+
+# Compilers the ports' makefiles call, by name, on PATH. With --ccache each
+# one is shadowed by a wrapper that runs the real compiler through ccache.
+# The esp32 port's ESP-IDF compilers aren't listed: ESP-IDF has its own
+# ccache support (``idf.py --ccache``).
+CCACHE_COMPILERS = [
+    "cc",
+    "c++",
+    "gcc",
+    "g++",
+    "arm-none-eabi-gcc",
+    "arm-none-eabi-g++",
+    "riscv32-unknown-elf-gcc",
+    "riscv32-unknown-elf-g++",
+    "i686-w64-mingw32-gcc",
+    "i686-w64-mingw32-g++",
+    "xtensa-lx106-elf-gcc",
+    "xtensa-lx106-elf-g++",
+]
+
+# The scripts find the cache next to themselves: under CCACHE_MOUNT in a
+# container, in the host directory when building natively.
+_CCACHE_WRAPPER = """#!/bin/sh
+# Written by mpbuild: compile through ccache. The wrapper directory is taken
+# off PATH so ccache finds the real compiler rather than this script.
+PATH="${PATH#"${0%/*}":}"
+export PATH
+exec ccache "$(basename "$0")" "$@"
+"""
+
+_CCACHE_RUNNER = """#!/bin/sh
+# Written by mpbuild: run a build with the compiler going through ccache and
+# report how many compilations were served from the cache.
+dir="${0%/*}"
+export CCACHE_DIR="$dir/cache"
+if ! command -v ccache > /dev/null 2>&1; then
+    echo "mpbuild: ccache is not installed in this build image, building without it" >&2
+    exec "$@"
+fi
+# ESP-IDF wires ccache in itself (IDF_CCACHE_ENABLE), so only shadow the
+# compilers for make based ports.
+[ -n "$IDF_PATH" ] || PATH="$dir/bin:$PATH"
+export PATH IDF_CCACHE_ENABLE=1
+
+stats() {
+    ccache --print-stats 2> /dev/null |
+        awk -F '\\t' '$1 ~ /_cache_hit$/ { h += $2 } $1 == "cache_miss" { m += $2 }
+            END { print h + 0, m + 0 }'
+}
+
+before=$(stats)
+"$@"
+rc=$?
+after=$(stats)
+echo "$before $after" | awk '{
+    hits = $3 - $1; misses = $4 - $2; total = hits + misses
+    printf "ccache: %d hits, %d misses (%.0f%% hit rate)\\n", hits, misses,
+        total ? 100 * hits / total : 0
+}'
+exit $rc
+"""
+
+
+def ccache_directory(build_container: str) -> Path:
+    """
+    Returns the host directory holding the compiler cache for this image.
+
+    Each image gets its own cache: object files from different toolchains
+    never match anyway, and this keeps one image's builds from evicting
+    another's.
+
+    Example: "espressif/idf:v5.4.2" => ~/.cache/mpbuild/ccache/espressif_idf_v5.4.2
+    """
+    return cache_dir() / "ccache" / image_slug(build_container)
+
+
+def _write_if_changed(path: Path, text: str, mode: int = 0o755) -> None:
+    if not path.is_file() or path.read_text() != text:
+        path.write_text(text)
+    path.chmod(mode)
+
+
+def prepare_ccache(build_container: str) -> Path:
+    """
+    Creates the ccache directory for this image, with the compiler wrappers
+    and the ``run`` script that the build command calls, and returns it.
+    """
+    directory = ccache_directory(build_container)
+    bin_dir = directory / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (directory / "cache").mkdir(exist_ok=True)
+    _write_if_changed(directory / "run", _CCACHE_RUNNER)
+    for compiler in CCACHE_COMPILERS:
+        _write_if_changed(bin_dir / compiler, _CCACHE_WRAPPER)
+    return directory
+
+
+# Where the compile profiler (see ``prepare_profiler``) is mounted in the
+# build container.
+PROFILE_MOUNT = "/mpbuild-profile"
+
+# Shadows each of CCACHE_COMPILERS when profiling compiles. After a ccache
+# runner it runs in front of ccache's wrapper, so cache hits are timed too.
+_PROFILE_WRAPPER = """#!/bin/bash
+# Written by mpbuild: run the compiler this script shadows and append how
+# long it took and the most memory it used to $MPBUILD_COMPILES. The wrapper
+# directory is taken off PATH so the real compiler (or ccache) runs.
+PATH="${PATH#"${0%/*}":}"
+export PATH
+compiler=${0##*/}
+[ -n "$MPBUILD_COMPILES" ] || exec "$compiler" "$@"
+
+kind=link source= output= prev=
+for arg in "$@"; do
+    if [ "$prev" = -o ]; then
+        output=$arg
+    else
+        case $arg in
+            -E) kind=preprocess ;;
+            -c | -S) [ $kind = preprocess ] || kind=compile ;;
+            -*) ;;
+            *.c | *.cc | *.cpp | *.cxx | *.s | *.S) source=$arg ;;
+        esac
+    fi
+    prev=$arg
+done
+file=${source:-$output}
+[ -n "$file" ] || exec "$compiler" "$@"
+case $file in /*) ;; *) file=$PWD/$file ;; esac
+
+# Microseconds since the epoch. EPOCHREALTIME needs bash 5; the images with
+# older ones have GNU date.
+start=${EPOCHREALTIME//[!0-9]/}
+[ -n "$start" ] || start=$(date +%s%6N)
+peak=
+if [ -x /usr/bin/time ] && used=$(mktemp 2> /dev/null); then
+    /usr/bin/time -f %M -o "$used" "$compiler" "$@"
+    rc=$?
+    peak=$(tail -n 1 "$used")
+    rm -f "$used"
+else
+    "$compiler" "$@"
+    rc=$?
+fi
+end=${EPOCHREALTIME//[!0-9]/}
+[ -n "$end" ] || end=$(date +%s%6N)
+us=$(( end - start ))
+case $peak in '' | *[!0-9]*) peak=- ;; *) peak=${peak}K ;; esac
+printf 'mpbuild-compile: %s exited %d after %d.%06ds peak %s %s\\n' \\
+    $kind $rc $((us / 1000000)) $((us % 1000000)) "$peak" "$file" >> "$MPBUILD_COMPILES"
+exit $rc
+"""
+
+_PROFILE_RUNNER = """#!/bin/sh
+# Written by mpbuild: run a build with the compilers it calls by name going
+# through the wrappers that record each compile to the file given first.
+MPBUILD_COMPILES=$1
+shift
+PATH="${0%/*}/bin:$PATH"
+export MPBUILD_COMPILES PATH
+exec "$@"
+"""
+
+_COMPILE_RE = re.compile(
+    r"mpbuild-compile: (\S+) exited (\d+) after (\d+\.\d+)s peak (?:(\d+)K|-) (.+)"
+)
+
+
+@dataclass
+class CompileResult:
+    """
+    One run of a compiler in a profiled build.
+    """
+
+    file: str
+    """
+    The source file, or what a link made; see ``timings.read_compiles``.
+    """
+    kind: str
+    """
+    ``compile``, ``preprocess`` (like the qstr extraction) or ``link``.
+    """
+    returncode: int
+    duration: float
+    """
+    Seconds.
+    """
+    peak_memory: int | None = None
+    """
+    The most memory it used, in bytes, if the image has GNU time.
+    """
+
+
+def parse_compile(line: str) -> CompileResult | None:
+    """
+    Returns the compiler run a profiled build recorded on ``line``, or None
+    for any other line.
+    """
+    m = _COMPILE_RE.fullmatch(line.strip())
+    if m is None:
+        return None
+    peak = int(m[4]) * 1024 if m[4] else None
+    return CompileResult(m[5], m[1], int(m[2]), float(m[3]), peak)
+
+
+def profile_directory() -> Path:
+    """
+    Returns the host directory holding the compile profiler: its ``run``
+    script, the compiler wrappers and, under ``records``, what the builds
+    record (see ``timings.compiles_file``).
+    """
+    return cache_dir() / "profile"
+
+
+def prepare_profiler() -> Path:
+    """
+    Creates the compile profiler's directory (see ``profile_directory``),
+    with the compiler wrappers and the ``run`` script that the build command
+    calls, and returns it.
+    """
+    directory = profile_directory()
+    bin_dir = directory / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    (directory / "records").mkdir(exist_ok=True)
+    _write_if_changed(directory / "run", _PROFILE_RUNNER)
+    for compiler in CCACHE_COMPILERS:
+        _write_if_changed(bin_dir / compiler, _PROFILE_WRAPPER)
+    return directory
+
+
+REUSE_CONTAINER_ENV = "MPBUILD_REUSE_CONTAINER"
+IDLE_TIMEOUT_ENV = "MPBUILD_CONTAINER_IDLE_TIMEOUT"
+DEFAULT_IDLE_TIMEOUT = 15 * 60
+"""
+Seconds a reused build container stays up after its last build finished.
+"""
+
+# Inside a reused container: touched whenever a build starts or ends, and one
+# marker file per build that is running right now.
+_ACTIVE_FILE = "/tmp/.mpbuild-active"
+_BUSY_PREFIX = "/tmp/.mpbuild-busy."
+
+
+def reuse_container_enabled() -> bool:
+    """
+    True if builds should run in a long-lived container (see
+    ``docker_build_cmd``), as requested with MPBUILD_REUSE_CONTAINER=1.
+    """
+    return os.environ.get(REUSE_CONTAINER_ENV, "") not in ("", "0")
+
+
+def _idle_timeout() -> int:
+    try:
+        return int(os.environ.get(IDLE_TIMEOUT_ENV, DEFAULT_IDLE_TIMEOUT))
+    except ValueError:
+        return DEFAULT_IDLE_TIMEOUT
+
+
+def pooled_container_name(build_container: str, run_options: str) -> str:
+    """
+    Returns the name of the reusable container for this image and set of
+    mounts/devices. Builds that agree on both share one container.
+
+    Example: "mpbuild-3f2a9c0d1b7e"
+    """
+    digest = hashlib.sha1(f"{build_container}\n{run_options}".encode()).hexdigest()
+    return f"mpbuild-{digest[:12]}"
+
+
+_SAFE_DIRECTORY_CMD = 'git config --global --add safe.directory "*" 2> /dev/null;'
+
+
+def _keepalive_script(idle_timeout: int) -> str:
+    """
+    The main process of a reused container. It does the one-off setup, then
+    sleeps until no build has run for ``idle_timeout`` seconds and exits,
+    which removes the container (it is started with --rm).
+    """
+    return (
+        f"{_SAFE_DIRECTORY_CMD} "
+        # Builds run as the host user and must be able to touch it too.
+        f"touch {_ACTIVE_FILE}; chmod 666 {_ACTIVE_FILE}; "
+        'trap "exit 0" TERM; '
+        "while true; do "
+        "sleep 10 & wait $!; "
+        f"if ls {_BUSY_PREFIX}* > /dev/null 2>&1; then touch {_ACTIVE_FILE}; fi; "
+        f"if [ $(( $(date +%s) - $(stat -c %Y {_ACTIVE_FILE}) )) -ge {idle_timeout} ]; "
+        "then exit 0; fi; "
+        "done"
+    )
+
+
+# A timed build (see ``timings_file`` in docker_build_spec) runs each phase
+# through this function, which ends the phase with a line giving its exit status, duration and start
+# (see ``parse_phase``): on stdout, or appended to $MPBUILD_PHASES if set.
+# Times are in microseconds from EPOCHREALTIME, or from date before bash 5.
+_PHASE_FUNCTION = (
+    "_mpbuild_phase() { "
+    "local name=$1 start=${EPOCHREALTIME//[!0-9]/} end rc line; "
+    '[ -n "$start" ] || start=$(date +%s%6N); '
+    'eval "$2"; rc=$?; '
+    'end=${EPOCHREALTIME//[!0-9]/}; [ -n "$end" ] || end=$(date +%s%6N); '
+    "local us=$(( end - start )); "
+    "printf -v line 'mpbuild-phase: %s exited %d after %d.%06ds at %d.%06d' "
+    '"$name" $rc $((us / 1000000)) $((us % 1000000)) $((start / 1000000)) $((start % 1000000)); '
+    'if [ -n "$MPBUILD_PHASES" ]; then echo "$line" >> "$MPBUILD_PHASES"; '
+    "else printf '\\n%s\\n' \"$line\"; fi; "
+    "return $rc; }; "
+)
+
+_PHASE_RE = re.compile(r"mpbuild-phase: (\S+) exited (\d+) after (\d+\.\d+)s(?: at (\d+\.\d+))?")
+
+# Where the directory of a timed build's ``timings_file`` is mounted in the
+# build container.
+TIMINGS_MOUNT = "/mpbuild-timings"
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    returncode: int
+    duration: float
+    """
+    Seconds.
+    """
+    start: float | None = None
+    """
+    Unix time the phase started, if known.
+    """
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def parse_phase(line: str) -> PhaseResult | None:
+    """
+    Returns the phase ``line`` reports the end of, or None for any other
+    output line.
+    """
+    m = _PHASE_RE.fullmatch(line.strip())
+    if m is None:
+        return None
+    return PhaseResult(m[1], int(m[2]), float(m[3]), float(m[4]) if m[4] else None)
+
+
+# Reports what the container used as the build exits (cgroup v2, then v1):
+# its peak memory, how many processes the OOM killer killed in it, its CPU
+# time in microseconds and the bytes it read and wrote on block devices. On
+# stdout, or like the phases appended to $MPBUILD_PHASES if set.
+_USAGE_TRAP = (
+    "_mpbuild_usage() { "
+    "local peak oom cpu io lines; "
+    "peak=$(cat /sys/fs/cgroup/memory.peak "
+    "/sys/fs/cgroup/memory/memory.max_usage_in_bytes 2> /dev/null | head -n 1); "
+    "oom=$(grep -h '^oom_kill ' /sys/fs/cgroup/memory.events "
+    "/sys/fs/cgroup/memory/memory.oom_control 2> /dev/null | head -n 1); "
+    "if [ -r /sys/fs/cgroup/cpu.stat ]; then "
+    "cpu=$(awk '$1 == \"usage_usec\" { print $2 }' /sys/fs/cgroup/cpu.stat); "
+    "elif [ -r /sys/fs/cgroup/cpuacct/cpuacct.usage ]; then "
+    "cpu=$(awk '{ print int($1 / 1000) }' /sys/fs/cgroup/cpuacct/cpuacct.usage); fi; "
+    "if [ -r /sys/fs/cgroup/io.stat ]; then "
+    'io=$(awk \'{ for (i = 2; i <= NF; i++) { split($i, f, "="); '
+    'if (f[1] == "rbytes") r += f[2]; if (f[1] == "wbytes") w += f[2] } } '
+    "END { print r + 0, w + 0 }' /sys/fs/cgroup/io.stat); "
+    "elif [ -r /sys/fs/cgroup/blkio/blkio.throttle.io_service_bytes ]; then "
+    'io=$(awk \'$2 == "Read" { r += $3 } $2 == "Write" { w += $3 } '
+    "END { print r + 0, w + 0 }' /sys/fs/cgroup/blkio/blkio.throttle.io_service_bytes); fi; "
+    "lines=$("
+    '[ -n "$peak" ] && echo "mpbuild-memory-peak: $peak"; '
+    '[ -n "$oom" ] && echo "mpbuild-oom-kills: ${oom#oom_kill }"; '
+    '[ -n "$cpu" ] && echo "mpbuild-cpu-usec: $cpu"; '
+    '[ -n "$io" ] && echo "mpbuild-block-io: $io"'
+    "); "
+    '[ -z "$lines" ] || if [ -n "$MPBUILD_PHASES" ]; then echo "$lines" >> "$MPBUILD_PHASES"; '
+    'else echo "$lines"; fi; '
+    "}; trap _mpbuild_usage EXIT; "
+)
+
+_PEAK_MEMORY_RE = re.compile(r"mpbuild-memory-peak: (\d+)")
+_OOM_KILLS_RE = re.compile(r"mpbuild-oom-kills: (\d+)")
+_CPU_TIME_RE = re.compile(r"mpbuild-cpu-usec: (\d+)")
+_BLOCK_IO_RE = re.compile(r"mpbuild-block-io: (\d+) (\d+)")
+
+
+def parse_peak_memory(line: str) -> int | None:
+    """
+    Returns the peak memory, in bytes, a ``report_memory`` build
+    reported on ``line``, or None for any other output line.
+    """
+    m = _PEAK_MEMORY_RE.fullmatch(line.strip())
+    return int(m[1]) if m else None
+
+
+def parse_oom_kills(line: str) -> int | None:
+    """
+    Returns how many processes of a ``report_memory`` build the OOM killer
+    killed, as reported on ``line``, or None for any other output line.
+    """
+    m = _OOM_KILLS_RE.fullmatch(line.strip())
+    return int(m[1]) if m else None
+
+
+def parse_cpu_time(line: str) -> float | None:
+    """
+    Returns the CPU seconds a ``report_memory`` build reported using on
+    ``line``, or None for any other output line.
+    """
+    m = _CPU_TIME_RE.fullmatch(line.strip())
+    return int(m[1]) / 1e6 if m else None
+
+
+def parse_block_io(line: str) -> tuple[int, int] | None:
+    """
+    Returns the bytes a ``report_memory`` build reported reading and
+    writing on block devices on ``line``, or None for any other output
+    line.
+    """
+    m = _BLOCK_IO_RE.fullmatch(line.strip())
+    return (int(m[1]), int(m[2])) if m else None
+
+
+@dataclass
+class ResourceUsage:
+    """
+    What a ``report_memory`` build's container used. None where the cgroup
+    didn't tell.
+    """
+
+    peak_memory: int | None = None
+    """
+    Bytes.
+    """
+    oom_kills: int = 0
+    """
+    Processes the OOM killer killed.
+    """
+    cpu_seconds: float | None = None
+    read_bytes: int | None = None
+    written_bytes: int | None = None
+    """
+    Bytes read from and written to block devices; page cache hits and
+    writes not flushed before the build ended don't count.
+    """
+
+    def update(self, line: str) -> bool:
+        """
+        Takes in what the build reported on ``line``, if it's one of the
+        usage lines. Returns whether it was.
+        """
+        if (peak := parse_peak_memory(line)) is not None:
+            self.peak_memory = peak
+        elif (oom_kills := parse_oom_kills(line)) is not None:
+            self.oom_kills = oom_kills
+        elif (cpu := parse_cpu_time(line)) is not None:
+            self.cpu_seconds = cpu
+        elif (io := parse_block_io(line)) is not None:
+            self.read_bytes, self.written_bytes = io
+        else:
+            return False
+        return True
+
+    def add(self, other: ResourceUsage) -> None:
+        """
+        Adds the usage of another attempt at the build: the higher peak,
+        the sum of the rest.
+        """
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+        self.oom_kills += other.oom_kills
+        if other.cpu_seconds is not None:
+            self.cpu_seconds = (self.cpu_seconds or 0.0) + other.cpu_seconds
+        if other.read_bytes is not None:
+            self.read_bytes = (self.read_bytes or 0) + other.read_bytes
+        if other.written_bytes is not None:
+            self.written_bytes = (self.written_bytes or 0) + other.written_bytes
+
+    @property
+    def known(self) -> bool:
+        return any(
+            v is not None
+            for v in (self.peak_memory, self.cpu_seconds, self.read_bytes, self.written_bytes)
+        )
+
+
+# A build's exit status when it was SIGKILLed, which in a build container is
+# almost always the OOM killer.
+OOM_EXIT_CODE = 128 + 9
+
+# How many times a build that ran out of memory is tried again, each time
+# with half the make jobs.
+OOM_RETRIES = 2
+
+
+def oom_killed(proc: subprocess.Popen | EngineProcess, returncode: int) -> bool:
+    """
+    Whether the build ``proc`` ran was stopped because it ran out of memory:
+    the Engine API says the container was OOM-killed or, through the CLI
+    where the ``--rm`` container is gone by now, it was SIGKILLed.
+    """
+    return returncode != 0 and (returncode == OOM_EXIT_CODE or getattr(proc, "oom_killed", False))
+
+
+def format_phases(phases: list[PhaseResult]) -> str:
+    """
+    Example: "clean ok (0.1s), build exit 2 (41.3s)"
+    """
+    return ", ".join(
+        f"{p.name} {'ok' if p.ok else f'exit {p.returncode}'} ({p.duration:.1f}s)" for p in phases
+    )
+
+
+@dataclass
+class ContainerSpec:
+    """
+    A build step to run in a container, as data rather than a shell command
+    line. ``argv`` runs it through the docker CLI without a shell in
+    between; docker_engine.py runs it through the Docker Engine API.
+    """
+
+    image: str
+    script: str
+    """
+    The build steps, run with ``bash -c`` in ``workdir``.
+    """
+    workdir: str
+    uid: int
+    gid: int
+    mounts: list[tuple[str, str]] = field(default_factory=list)
+    """
+    Bind mounts as (host path, container path).
+    """
+    devices: list[str] = field(default_factory=list)
+    env: dict[str, str] = field(default_factory=lambda: {"HOME": "/tmp"})
+    interactive: bool = False
+    """
+    Attach the terminal (``docker run -it``).
+    """
+    reuse_container: bool = False
+    """
+    Run with ``docker exec`` in the long-lived container for this image and
+    set of mounts (see ``docker_build_cmd``), starting it if needed.
+    """
+    runtime: Runtime = Runtime.docker
+    """
+    What runs the build: the docker or podman CLI, or natively the host's
+    own bash in ``workdir``, in which case the image, mounts and user are
+    unused.
+    """
+    memory_limit: int | None = None
+    """
+    The container's memory limit in bytes (``--memory``). Not applied to a
+    reused container.
+    """
+    report_memory: bool = False
+    """
+    Print what the container used as it exits: its peak memory, OOM kills,
+    CPU time and block I/O, see ``ResourceUsage``. With a ``timings_file``
+    they're appended to it rather than printed. Not for reused containers,
+    which share one cgroup, or native builds.
+    """
+    timings_file: str | None = None
+    """
+    Where (in the container) the build steps append their timings, see
+    ``docker_build_spec``.
+    """
+
+    def _mount_options(self) -> list[str]:
+        options: list[str] = []
+        for device in self.devices:
+            options += ["--device", device]
+        for source, target in self.mounts:
+            options += ["-v", f"{source}:{target}"]
+        return options + ["-w", self.workdir]
+
+    def _env_options(self) -> list[str]:
+        return [option for name, value in self.env.items() for option in ("-e", f"{name}={value}")]
+
+    def run_options(self) -> list[str]:
+        """
+        The devices, mounts, working directory and environment, as
+        ``docker run`` options.
+        """
+        return self._mount_options() + self._env_options()
+
+    @property
+    def pool_name(self) -> str:
+        """
+        The name of the reused container, see ``pooled_container_name``.
+        """
+        return pooled_container_name(self.image, " ".join(self.run_options()) + " ")
+
+    @property
+    def user(self) -> str:
+        return f"{self.uid}:{self.gid}"
+
+    def shell_script(self) -> str:
+        """
+        The script ``bash -c`` runs: the build steps plus, in a fresh
+        container, the git setup, or in a reused one, the busy marker that
+        keeps it alive.
+        """
+        timing = ""
+        safe_directory = _SAFE_DIRECTORY_CMD
+        if self.timings_file:
+            timing = f"MPBUILD_PHASES={shlex.quote(self.timings_file)}; {_PHASE_FUNCTION}"
+            safe_directory = f"_mpbuild_phase safe-directory {shlex.quote(safe_directory)}; "
+        if self.runtime == Runtime.native:
+            return f"{timing}{self.script}"
+        if self.reuse_container:
+            return (
+                f"marker={_BUSY_PREFIX}$$; touch $marker; "
+                f'trap "rm -f $marker; touch {_ACTIVE_FILE}" EXIT; '
+                f"{timing}{self.script}"
+            )
+        trap = _USAGE_TRAP if self.report_memory else ""
+        return f"{timing}{safe_directory}{trap}{self.script}"
+
+    def keepalive_argv(self) -> list[str]:
+        """
+        Starts the reused container in the background.
+        """
+        return [
+            self.runtime.value,
+            "run",
+            "-d",
+            "--rm",
+            "--name",
+            self.pool_name,
+            "--label",
+            "mpbuild.pool=1",
+            *self.run_options(),
+            self.image,
+            "bash",
+            "-c",
+            _keepalive_script(_idle_timeout()),
+        ]
+
+    def argv(self) -> list[str]:
+        """
+        The docker (or podman) CLI invocation that runs the build, or
+        natively the bash command to run in ``workdir``. With
+        ``reuse_container`` the container has to be running already, see
+        ``keepalive_argv``.
+        """
+        if self.runtime == Runtime.native:
+            return ["bash", "-c", self.shell_script()]
+        tty = ["-it"] if self.interactive else []
+        if self.reuse_container:
+            return [
+                self.runtime.value,
+                "exec",
+                *tty,
+                "--user",
+                self.user,
+                "-w",
+                self.workdir,
+                self.pool_name,
+                "bash",
+                "-c",
+                self.shell_script(),
+            ]
+        # Each option, in order:
+        #   --device ...               USB and serial devices for deploy
+        #   -v <mpy>:<mpy> -w <mpy>    mount mpy dir at same path so elf/map paths match host
+        #   -v ...                     common .git dir of a worktree, the ccache directory
+        #   --user <uid>:<gid>         match host user id so generated files aren't owned by root
+        #   -e HOME=/tmp               set HOME to /tmp for the container
+        #   --userns=keep-id           (rootless podman) keep that user id inside the container
+        #   --memory <bytes>           the memory limit, if any
+        userns = ["--userns=keep-id"] if self.runtime == Runtime.podman and self.uid else []
+        memory = ["--memory", str(self.memory_limit)] if self.memory_limit else []
+        return [
+            self.runtime.value,
+            "run",
+            "--rm",
+            *tty,
+            *self._mount_options(),
+            "--user",
+            self.user,
+            *userns,
+            *memory,
+            *self._env_options(),
+            self.image,
+            "bash",
+            "-c",
+            self.shell_script(),
+        ]
+
+    def command(self) -> str:
+        """
+        The build as one shell command line, for display and for running
+        where only a shell will do.
+        """
+        if self.runtime == Runtime.native:
+            return f"cd {shlex.quote(self.workdir)} && {shlex.join(self.argv())}"
+        if self.reuse_container:
+            return (
+                f"{self.runtime.value} container inspect {self.pool_name} > /dev/null 2>&1 || "
+                f"{shlex.join(self.keepalive_argv())} > /dev/null; "
+                f"{shlex.join(self.argv())}"
+            )
+        return shlex.join(self.argv())
+
+    def __str__(self) -> str:
+        return self.command()
+
+
+def docker_build_spec(
     board: Board,
     variant: str | None = None,
     extra_args: list[str] | None = None,
     do_clean: bool = False,
     build_container_override: str | None = None,
     docker_interactive: bool = True,
-) -> str:
+    make_jobs: int | None = None,
+    reuse_container: bool | None = None,
+    ccache: bool = False,
+    mpy_cross_only: bool = False,
+    context: BuildContext | None = None,
+    submodules: bool = True,
+    submodules_only: bool = False,
+    memory_limit: int | None = None,
+    report_memory: bool = False,
+    timings_file: Path | None = None,
+    compiles_file: Path | None = None,
+    prepare: bool = True,
+) -> ContainerSpec:
     """
-    Returns the docker-command which will build the firmware.
+    Returns the container that will build the firmware.
+
+    Pass a ``context`` when building more than once in a session so the
+    repository and host facts it holds are worked out once (see
+    ``BuildContext``).
+
+    ``make_jobs`` is the ``make -j`` value; defaults to every CPU the host
+    lets us use (see ``jobserver.available_cpus``). Batch builds lower it so
+    concurrent builds share the machine instead of each claiming all of it.
+    If the context has a jobserver, make takes its jobs from that instead
+    and ``make_jobs`` only applies if the jobserver can't be opened.
+
+    With ``reuse_container`` (default: MPBUILD_REUSE_CONTAINER) the build runs
+    via ``docker exec`` in a long-lived container per image and mount set
+    instead of a fresh ``docker run --rm``. Container startup and the
+    ``safe.directory`` setup are then paid once, and HOME (/tmp) persists
+    between builds. The container removes itself after
+    MPBUILD_CONTAINER_IDLE_TIMEOUT seconds (default 15 minutes) without a
+    build. Stopping the docker client doesn't stop a build that's running in
+    a reused container; it finishes in the background.
+
+    With ``ccache`` the port's compiler runs through ccache, with the cache
+    kept on the host per build image (see ``prepare_ccache``), and the build
+    ends by printing the cache hit/miss counts. Cleaning ignores it.
+
+    Except for the cmake based ports, mpy-cross is built once per image into
+    its own directory (see ``mpy_cross_build_dir``) and the step is left out
+    while its stamp is current. ``mpy_cross_only`` returns a container that
+    only does that step, so batch builds can run it once per image before
+    starting the board builds.
+
+    ``make submodules`` is left out while the submodules are as they were
+    after this board/variant last built successfully (see submodules.py),
+    and always without ``submodules``. ``submodules_only`` returns a
+    container that only runs that step: concurrent updates of one checkout
+    race on git's index locks, so batch builds run it one at a time before
+    each board build and leave it out of the builds.
+
+    ``memory_limit`` caps the container's memory and ``report_memory``
+    reports what it used: memory, CPU time and block I/O, see
+    ``ContainerSpec``. Batch builds use them to keep within the machine's
+    memory (see memory.py).
+
+    With a ``timings_file`` (a host file, see ``timings.phases_file``) each
+    step of the build appends its timing to it, see timings.py. Its
+    directory is mounted into the container.
+
+    With a ``compiles_file`` (see ``timings.compiles_file``) the port's
+    compilers run through the wrappers of ``prepare_profiler``, which append
+    each compile's duration and peak memory to it. Not for the cmake based
+    ports, which would keep the wrappers' path in their build directory.
+
+    Without ``prepare`` the host directories the container would mount for
+    ccache and the profiler are named but not created, for a spec that is
+    only shown (``mpbuild plan``).
+
+    The context's runtime decides what runs the steps (see ``ContainerSpec``).
+    Natively they run on the host, which needs the port's toolchain on PATH
+    (see ``NATIVE_TOOLCHAINS``) and never reuses a container; the host's
+    git config is left alone.
+
+    Raises:
+        MpbuildNotSupportedException: If building natively and the port's
+            toolchain isn't installed.
     """
     if extra_args is None:
         extra_args = []
@@ -248,11 +1379,18 @@ def docker_build_cmd(
                 f"Valid variants are: {[v.name for v in board.variants]}"
             )
 
-    build_container = (
-        build_container_override
-        if build_container_override
-        else get_build_container(board=board, variant=variant)
-    )
+    if context is None:
+        context = BuildContext.create(port.directory_repo)
+    native = context.runtime == Runtime.native
+
+    if native:
+        toolchain = NATIVE_TOOLCHAINS.get(port.name, "make")
+        if shutil.which(toolchain) is None:
+            raise MpbuildNotSupportedException(
+                f"Can't build the {port.name} port natively: {toolchain} is not on PATH"
+            )
+
+    build_container = context.image(board, variant, build_container_override)
 
     variant_param = "BOARD_VARIANT" if board.physical_board else "VARIANT"
     variant_cmd = "" if variant is None else f" {variant_param}={variant}"
@@ -265,12 +1403,32 @@ def docker_build_cmd(
     elif port.name == "windows":
         extra_args = ["CROSS_COMPILE=i686-w64-mingw32-"] + extra_args
 
+    make_mpy_cross_cmd = "make -C mpy-cross && "
+    if port.name not in CMAKE_PORTS and not do_clean:
+        make_mpy_cross_cmd = _make_mpy_cross_cmd(
+            port.directory_repo, build_container, context.mpy_cross_signature(build_container)
+        )
+        mpy_cross = mpy_cross_build_dir(port.directory_repo, build_container) / "mpy-cross"
+        extra_args = [f"MPY_CROSS={mpy_cross}"] + extra_args
+
     args = " " + " ".join(extra_args)
 
-    make_mpy_cross_cmd = "make -C mpy-cross && "
-    update_submodules_cmd = (
-        f"make -C ports/{port.name} BOARD={board.name}{variant_cmd} submodules && "
-    )
+    update_submodules_cmd = ""
+    if submodules and not do_clean and not context.submodules_current(board, variant):
+        make_submodules_cmd = (
+            f"make -C ports/{port.name} BOARD={board.name}{variant_cmd} submodules"
+        )
+        if native:
+            # Only for this command, not in the user's global git config
+            update_submodules_cmd = (
+                "GIT_CONFIG_COUNT=1 GIT_CONFIG_KEY_0=submodule.fetchJobs "
+                f"GIT_CONFIG_VALUE_0={SUBMODULE_FETCH_JOBS} {make_submodules_cmd} && "
+            )
+        else:
+            update_submodules_cmd = (
+                f"git config --global submodule.fetchJobs {SUBMODULE_FETCH_JOBS} 2> /dev/null;"
+                f"{make_submodules_cmd} && "
+            )
     uid, gid = os.getuid(), os.getgid()
 
     if do_clean:
@@ -283,50 +1441,161 @@ def docker_build_cmd(
         ci_setup_cmd = ""
 
     mpy_dir = str(port.directory_repo)
+    # Mount mpy dir at same path so elf/map paths match host
+    mounts = [(mpy_dir, mpy_dir)]
 
     # Handle git worktrees by mounting the main .git directory
-    git_volume_mount = ""
-    main_git_dir = get_main_git_directory(Path(mpy_dir))
-    if main_git_dir:
-        git_volume_mount = f"-v {main_git_dir}:{main_git_dir} "
+    if context.main_git_dir:
+        mounts.append((str(context.main_git_dir), str(context.main_git_dir)))
+
+    # Compiler cache: mount this image's cache and wrap the port's make in
+    # the runner that routes compilers through ccache.
+    ccache_run = ""
+    if ccache and not do_clean:
+        ccache_dir = (
+            prepare_ccache(build_container) if prepare else ccache_directory(build_container)
+        )
+        if native:
+            ccache_run = f"{shlex.quote(str(ccache_dir))}/run "
+        else:
+            mounts.append((str(ccache_dir), CCACHE_MOUNT))
+            ccache_run = f"{CCACHE_MOUNT}/run "
+
+    # Compile profiling: mount the profiler and run the port's make (after
+    # ccache's runner, so the wrappers time ccache too) through its runner.
+    profile_run = ""
+    if compiles_file is not None and port.name not in CMAKE_PORTS and not do_clean:
+        profile_dir = prepare_profiler() if prepare else profile_directory()
+        records = str(compiles_file)
+        if native:
+            profile_run = f"{shlex.quote(str(profile_dir))}/run {shlex.quote(records)} "
+        else:
+            mounts.append((str(profile_dir), PROFILE_MOUNT))
+            records = f"{PROFILE_MOUNT}/{compiles_file.relative_to(profile_dir).as_posix()}"
+            profile_run = f"{PROFILE_MOUNT}/run {shlex.quote(records)} "
+
+    # Share the jobserver: make and every sub-make it starts (including
+    # mpy-cross and the submodules) read MAKEFLAGS.
+    jobserver_cmd = ""
+    make_jobs_flag = f"-j {make_jobs or nprocs} "
+    if context.jobserver is not None and not do_clean:
+        fifo = str(context.jobserver.path)
+        if not native:
+            mounts.append((fifo, JOBSERVER_MOUNT))
+            fifo = JOBSERVER_MOUNT
+        fd = JOBSERVER_FD
+        jobserver_cmd = (
+            f"{{ exec {fd}<>{fifo} && export MAKEFLAGS="
+            f'"-j{context.jobserver.tokens} --jobserver-auth={fd},{fd}"; }} 2> /dev/null || '
+            f'export MAKEFLAGS="-j{make_jobs or nprocs}";'
+        )
+        make_jobs_flag = ""
 
-    # Dynamically find all ttyACM and ttyUSB devices
-    tty_devices = []
-    for pattern in ["/dev/ttyACM*", "/dev/ttyUSB*"]:
-        tty_devices.extend(glob.glob(pattern))
+    port_make_cmd = (
+        f"{ccache_run}{profile_run}make {make_jobs_flag}-C ports/{port.name} "
+        f"BOARD={board.name}{variant_cmd}{args}"
+    )
+    if mpy_cross_only:
+        ci_setup_cmd = ci_environment_cmd = update_submodules_cmd = ""
+        port_make_cmd = make_mpy_cross_cmd.removesuffix(" && ") or "true"
+        make_mpy_cross_cmd = ""
+    elif submodules_only:
+        ci_setup_cmd = ci_environment_cmd = make_mpy_cross_cmd = ""
+        port_make_cmd = update_submodules_cmd.removesuffix(" && ") or "true"
+        update_submodules_cmd = ""
 
-    # Build device flags
-    device_flags = ""
-    if os.path.exists("/dev/bus/usb/") and os.listdir("/dev/bus/usb/"):
-        device_flags += "--device /dev/bus/usb/ "  # USB access
-    for device in tty_devices:
-        device_flags += f"--device {device} "
+    container_timings_file = None
+    if timings_file is not None:
+        container_timings_file = str(timings_file)
+        if not native:
+            mounts.append((str(timings_file.parent), TIMINGS_MOUNT))
+            container_timings_file = f"{TIMINGS_MOUNT}/{timings_file.name}"
+        script = jobserver_cmd + _timed_steps(
+            [
+                ("ci-setup", f"{ci_setup_cmd}{ci_environment_cmd}"),
+                ("mpy-cross", make_mpy_cross_cmd),
+                ("submodules", update_submodules_cmd),
+                ("make", port_make_cmd),
+            ]
+        )
+    else:
+        script = (
+            f"{jobserver_cmd}"
+            f"{ci_setup_cmd}"
+            f"{ci_environment_cmd}"
+            f"{make_mpy_cross_cmd}"
+            f"{update_submodules_cmd}"
+            f"{port_make_cmd}"
+        )
 
-    # Build the docker run invocation. Each option, in order:
-    #   {device_flags}             USB and serial devices for deploy
-    #   -v <mpy>:<mpy> -w <mpy>    mount mpy dir at same path so elf/map paths match host
-    #   {git_volume_mount}         mount common .git dir when building from a worktree
-    #   --user <uid>:<gid>         match host user id so generated files aren't owned by root
-    #   -e HOME=/tmp               set HOME to /tmp for the container
-    build_cmd = (
-        f"docker run --rm "
-        f"{'-it ' if docker_interactive else ''}"
-        f"{device_flags}"
-        f"-v {mpy_dir}:{mpy_dir} -w {mpy_dir} "
-        f"{git_volume_mount}"
-        f"--user {uid}:{gid} "
-        f"-e HOME=/tmp "
-        f"{build_container} "
-        f'bash -c "'
-        f"git config --global --add safe.directory '*' 2> /dev/null;"
-        f"{ci_setup_cmd}"
-        f"{ci_environment_cmd}"
-        f"{make_mpy_cross_cmd}"
-        f"{update_submodules_cmd}"
-        f'make -j {nprocs} -C ports/{port.name} BOARD={board.name}{variant_cmd}{args}"'
+    if reuse_container is None:
+        reuse_container = reuse_container_enabled()
+    reuse_container = reuse_container and not native
+    return ContainerSpec(
+        image=build_container,
+        script=script,
+        workdir=mpy_dir,
+        uid=uid,
+        gid=gid,
+        mounts=mounts,
+        devices=context.devices,
+        interactive=docker_interactive,
+        reuse_container=reuse_container,
+        runtime=context.runtime,
+        memory_limit=None if native or reuse_container else memory_limit,
+        report_memory=report_memory and not (native or reuse_container),
+        timings_file=container_timings_file,
     )
 
-    return build_cmd
+
+def _timed_steps(steps: list[tuple[str, str]]) -> str:
+    """
+    Runs each (name, shell steps) pair that isn't empty through
+    ``_mpbuild_phase``. Steps ending in ``&&`` stop the build if they fail,
+    as they do untimed.
+    """
+    script = ""
+    separator = ""
+    for name, step in steps:
+        step = step.strip()
+        if not step:
+            continue
+        command = shlex.quote(step.removesuffix("&&").rstrip())
+        script += f"{separator}_mpbuild_phase {name} {command}"
+        separator = " && " if step.endswith("&&") else "; "
+    return script
+
+
+def docker_build_cmd(
+    board: Board,
+    variant: str | None = None,
+    extra_args: list[str] | None = None,
+    do_clean: bool = False,
+    build_container_override: str | None = None,
+    docker_interactive: bool = True,
+    make_jobs: int | None = None,
+    reuse_container: bool | None = None,
+    ccache: bool = False,
+    mpy_cross_only: bool = False,
+    context: BuildContext | None = None,
+) -> str:
+    """
+    Returns the docker-command which will build the firmware, as a shell
+    command line. See ``docker_build_spec`` for the arguments.
+    """
+    return docker_build_spec(
+        board,
+        variant,
+        extra_args,
+        do_clean=do_clean,
+        build_container_override=build_container_override,
+        docker_interactive=docker_interactive,
+        make_jobs=make_jobs,
+        reuse_container=reuse_container,
+        ccache=ccache,
+        mpy_cross_only=mpy_cross_only,
+        context=context,
+    ).command()
 
 
 def build_board(
@@ -335,10 +1604,41 @@ def build_board(
     extra_args: list[str] | None = None,
     build_container_override: str | None = None,
     mpy_dir: str | Path | None = None,
+    ccache: bool = False,
+    use_cached: bool = True,
+    offline: bool = False,
+    context: BuildContext | None = None,
+    runtime: Runtime | None = None,
+    timings_json: Path | None = None,
+    trace: Path | None = None,
+    profile_compiles: bool = False,
 ) -> None:
     """
     Build the firmware.
 
+    If an earlier build of the same sources, board, variant, make arguments
+    and image succeeded, its firmware is restored instead (see results.py).
+    ``use_cached=False`` always builds; the result is still recorded.
+
+    A missing build image is pulled before the build starts, or with
+    ``offline`` reported as an error.
+
+    ``runtime`` (default: MPBUILD_RUNTIME, else docker) is what runs the build,
+    see ``docker_build_spec``. A ``context`` brings its own.
+
+    A build that runs out of memory (see ``oom_killed``), or in which the
+    OOM killer killed a compiler (see ``ResourceUsage``), is tried again up
+    to ``OOM_RETRIES`` times, each time with half the make jobs and outside
+    the jobserver. A successful build records how long it took (see
+    history.py).
+
+    Ends by printing how long each step took (see timings.py) and what the
+    build's container used (see ``ResourceUsage``), and with
+    ``timings_json`` writes them to that file. With ``trace`` the build is
+    written there as a trace that Perfetto opens (see trace.py). With
+    ``profile_compiles`` it also lists the slowest ``timings.SLOWEST_COMPILES``
+    compiles (see ``docker_build_spec``).
+
     This command writes to stdout/stderr and may exit the program on failure.
     """
     if extra_args is None:
@@ -365,34 +1665,200 @@ def build_board(
         raise SystemExit()
 
     do_clean = bool(extra_args and extra_args[0].strip() == "clean")
-    build_cmd = docker_build_cmd(
-        board=_board,
-        variant=variant,
-        extra_args=extra_args,
-        do_clean=do_clean,
-        build_container_override=build_container_override,
-        docker_interactive=sys.stdin.isatty(),
+    if context is None:
+        context = BuildContext.create(mpy_dir, runtime=runtime, jobserver=True)
+
+    from .timings import (
+        BuildTimings,
+        compiles_file,
+        format_slowest,
+        format_timings,
+        format_usage,
+        host_phase,
+        phases_file,
+        read_compiles,
+        read_phases,
+        slowest_compiles,
+        write_timings_json,
     )
 
-    title = "Clean" if do_clean else "Build"
-    title += f" {port}/{board}" + (f" ({variant})" if variant else "")
-    print(Panel(build_cmd, title=title, title_align="left", padding=1))
+    name = board + (f":{variant}" if variant else "")
+    usage = ResourceUsage()
+    timings = BuildTimings(name, port, usage=usage)
+    setup: list[PhaseResult] = []
+    pulls: list[PhaseResult] = []
+
+    def report_timings() -> None:
+        if setup or timings.phases:
+            steps = sorted(setup + timings.phases, key=lambda p: p.start or 0.0)
+            print(f"Timings: {format_timings(steps)}")
+        if usage.known:
+            print(f"Container usage: {format_usage(usage)}")
+        if timings.compiles:
+            print("Slowest compiles:")
+            for line in format_slowest(slowest_compiles([timings]), targets=False):
+                print(line)
+        if timings_json is not None:
+            try:
+                write_timings_json(timings_json, [timings], setup)
+            except OSError as e:
+                print(f"ERROR: Could not write the timings to {timings_json}: {e}")
+        if trace is not None:
+            from .trace import write_trace
+
+            try:
+                write_trace(trace, [timings], setup, pulls)
+            except OSError as e:
+                print(f"ERROR: Could not write the trace to {trace}: {e}")
+
+    result_key = None
+    if not do_clean:
+        from .results import cache_key, restore, source_state
+
+        with host_phase(timings.phases, "cache"):
+            state = source_state(mpy_dir)
+            if state is not None:
+                result_key = cache_key(
+                    state,
+                    _board,
+                    variant,
+                    extra_args,
+                    context.image(_board, variant, build_container_override),
+                )
+            restored = restore(result_key, _board, variant) if result_key and use_cached else None
+        if restored:
+            title = f"Build {port}/{board}" + (f" ({variant})" if variant else "")
+            files = "\n".join(str(p.relative_to(mpy_dir)) for p in restored)
+            print(
+                Panel(
+                    f"Sources unchanged since an earlier build, restored:\n{files}",
+                    title=f"{title} (cached)",
+                    title_align="left",
+                    padding=1,
+                )
+            )
+            _print_deploy(_board)
+            report_timings()
+            return
 
-    proc = subprocess.run(build_cmd, shell=True, check=False)
+    from .container_images import MpbuildImageException, ensure_images
 
-    if proc.returncode != 0:
-        print(f"ERROR: The following command returned {proc.returncode}: {build_cmd}")
-        raise SystemExit(proc.returncode)
+    try:
+        with host_phase(setup, "images"):
+            ensure_images(
+                [(_board, variant)],
+                build_container_override,
+                offline=offline,
+                context=context,
+                pulls=pulls,
+            )
+    except MpbuildImageException as e:
+        print(f"ERROR: {e}")
+        timings.returncode = 1
+        report_timings()
+        raise SystemExit(1) from e
+
+    from .docker_engine import DockerEngineError
+    from .runtimes import spawn
 
-    # Display deployment markdown for successful builds
+    title = "Clean" if do_clean else "Build"
+    title += f" {port}/{board}" + (f" ({variant})" if variant else "")
+    make_jobs = None
+    if profile_compiles and port in CMAKE_PORTS:
+        print(f"Compiles aren't profiled for the {port} port, which builds with cmake")
+    with (
+        phases_file() as timings_file,
+        compiles_file() if profile_compiles else nullcontext() as profile_file,
+    ):
+        for attempt in range(OOM_RETRIES + 1):
+            try:
+                spec = docker_build_spec(
+                    board=_board,
+                    variant=variant,
+                    extra_args=extra_args,
+                    do_clean=do_clean,
+                    build_container_override=build_container_override,
+                    docker_interactive=sys.stdin.isatty(),
+                    make_jobs=make_jobs,
+                    ccache=ccache,
+                    context=context,
+                    report_memory=True,
+                    timings_file=timings_file,
+                    compiles_file=profile_file,
+                )
+            except MpbuildNotSupportedException as e:
+                print(f"ERROR: {e}")
+                raise SystemExit(1) from e
+            build_cmd = spec.command()
+            if attempt == 0:
+                print(Panel(build_cmd, title=title, title_align="left", padding=1))
+
+            started = time.monotonic()
+            spawned = time.time()
+            try:
+                proc = spawn(spec)
+            except (OSError, DockerEngineError) as e:
+                print(f"ERROR: Could not start the build: {e}")
+                raise SystemExit(1) from e
+            try:
+                returncode = proc.wait()
+            except KeyboardInterrupt:
+                proc.terminate()
+                raise
+            attempt_usage = ResourceUsage()
+            timings.phases += read_phases(timings_file, spawned, attempt_usage)
+            usage.add(attempt_usage)
+            if profile_file is not None:
+                timings.compiles += read_compiles(profile_file, mpy_dir)
+
+            # Also when the OOM killer only killed a compiler and make failed.
+            out_of_memory = oom_killed(proc, returncode) or (
+                returncode != 0 and attempt_usage.oom_kills > 0
+            )
+            jobs = make_jobs or (context.jobserver.tokens if context.jobserver else nprocs)
+            if do_clean or jobs == 1 or attempt == OOM_RETRIES or not out_of_memory:
+                break
+            # Out of memory: try again on our own, with half the compilers.
+            make_jobs = max(1, jobs // 2)
+            context = replace(context, jobserver=None)
+            print(f"WARNING: The build ran out of memory, retrying with make -j {make_jobs}")
+
+    if returncode != 0:
+        print(f"ERROR: The following command returned {returncode}: {build_cmd}")
+        if out_of_memory:
+            print("The build ran out of memory (OOM-killed).")
+        timings.returncode = returncode
+        report_timings()
+        raise SystemExit(returncode)
+
+    if not do_clean:
+        from .history import DurationHistory
+
+        DurationHistory().record(name, port, time.monotonic() - started)
+        record_submodules(_board, variant)
+    if result_key:
+        from .results import store
+
+        store(result_key, _board, variant)
+
+    if "clean" not in extra_args:
+        with host_phase(timings.phases, "deploy"):
+            _print_deploy(_board)
+    report_timings()
+
+
+def _print_deploy(board: Board) -> None:
+    """
+    Display deployment markdown for successful builds
+    """
     # Note: Only displaying the first deploy file.
     # Q: Are there cases where there's >1? A: Currently, no.
     #    >>> sum([len(b.deploy) for b in db.boards.values()])
     #    166
     #    >>> len(db.boards())
     #    169  # 3x boards are the 'special' boards without deployment instructions.
-    if _board.deploy and "clean" not in extra_args and proc.returncode == 0:
-        deploy_path = _board.deploy_filename
+    if board.deploy:
+        deploy_path = board.deploy_filename
         if deploy_path is not None and deploy_path.is_file():
             print(Panel(Markdown(deploy_path.read_text())))
 
@@ -402,12 +1868,13 @@ def clean_board(
     variant: str | None = None,
     mpy_dir: str | None = None,
 ) -> None:
-    build_board(
-        board=board,
-        variant=variant,
-        mpy_dir=mpy_dir,
-        extra_args=["clean"],
-    )
+    """
+    Removes the board's build directory, on the host if possible (see
+    clean.py).
+    """
+    from .clean import clean_boards
+
+    clean_boards([f"{board}:{variant}" if variant else board], mpy_dir=mpy_dir)
 
 
 def rebuild_board(
@@ -416,26 +1883,62 @@ def rebuild_board(
     extra_args: list[str] | None = None,
     build_container_override: str | None = None,
     mpy_dir: str | Path | None = None,
+    ccache: bool = False,
+    offline: bool = False,
+    runtime: Runtime | None = None,
 ) -> None:
     """Clean and then build a board.
 
-    Calls ``build_board`` twice (clean phase, then build phase) so the build
-    container override and any extra make args are preserved for both phases.
-    If the clean phase fails ``build_board`` raises ``SystemExit`` and the
-    build phase is skipped — which is the right behaviour because a failed
-    clean leaves the build state unknown.
+    The clean phase removes the build directory on the host, falling back to
+    a container clean with the same build container override if it can't
+    (see clean.py). If the clean phase fails it raises ``SystemExit`` and
+    the build phase is skipped — which is the right behaviour because a
+    failed clean leaves the build state unknown.
+
+    With ``ccache`` the build phase after the clean is mostly cache hits.
+    The build phase never restores a cached result: a rebuild always builds.
+
+    Ends by printing each phase's exit status and duration.
     """
-    build_board(
-        board=board,
-        variant=variant,
-        extra_args=["clean"],
-        build_container_override=build_container_override,
-        mpy_dir=mpy_dir,
+    mpy_dir, _ = find_mpy_root(mpy_dir)
+    from .clean import clean_boards
+
+    context = BuildContext.create(mpy_dir, runtime=runtime, jobserver=True)
+    phases: list[PhaseResult] = []
+
+    def run_phase(name: str, phase: Callable[[], None]) -> None:
+        start = time.monotonic()
+        try:
+            phase()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+            phases.append(PhaseResult(name, code, time.monotonic() - start))
+            print(f"Rebuild: {format_phases(phases)}")
+            raise
+        phases.append(PhaseResult(name, 0, time.monotonic() - start))
+
+    run_phase(
+        "clean",
+        lambda: clean_boards(
+            [f"{board}:{variant}" if variant else board],
+            build_container_override=build_container_override,
+            mpy_dir=mpy_dir,
+            offline=offline,
+            context=context,
+        ),
     )
-    build_board(
-        board=board,
-        variant=variant,
-        extra_args=extra_args,
-        build_container_override=build_container_override,
-        mpy_dir=mpy_dir,
+    run_phase(
+        "build",
+        lambda: build_board(
+            board=board,
+            variant=variant,
+            extra_args=extra_args,
+            build_container_override=build_container_override,
+            mpy_dir=mpy_dir,
+            ccache=ccache,
+            use_cached=False,
+            offline=offline,
+            context=context,
+        ),
     )
+    print(f"Rebuild: {format_phases(phases)}")
@@ -1,12 +1,72 @@
-from typing import Annotated
+from collections.abc import Callable
+from importlib import import_module
+from pathlib import Path
+from typing import Annotated, Any
 
 import typer
 
-from . import OutputFormat, __app_name__, __version__
-from .build import build_board, clean_board, rebuild_board
-from .check_images import check_boards
-from .completions import list_boards, list_ports, list_variants_for_board
-from .list_boards import print_boards
+from . import OutputFormat, Runtime, __app_name__
+
+
+def _lazy(module: str, name: str) -> Callable[..., Any]:
+    """
+    Returns a stand-in for ``module.name`` that imports it on first call.
+
+    The command implementations pull in docker helpers, urllib, rich trees
+    and so on. Deferring them keeps `mpbuild --help`, `--version` and
+    completion from paying for commands that aren't being run.
+    """
+
+    def call(*args: Any, **kwargs: Any) -> Any:
+        return getattr(import_module(module, __package__), name)(*args, **kwargs)
+
+    call.__name__ = call.__qualname__ = name
+    return call
+
+
+build_board = _lazy(".build", "build_board")
+clean_board = _lazy(".build", "clean_board")
+clean_boards = _lazy(".clean", "clean_boards")
+rebuild_board = _lazy(".build", "rebuild_board")
+build_many_boards = _lazy(".batch", "build_many_boards")
+print_plan = _lazy(".plan", "print_plan")
+check_boards = _lazy(".check_images", "check_boards")
+print_boards = _lazy(".list_boards", "print_boards")
+list_boards = _lazy(".completions", "list_boards")
+list_ports = _lazy(".completions", "list_ports")
+list_variants_for_board = _lazy(".completions", "list_variants_for_board")
+
+
+def _parse_size(value: str) -> int:
+    from .memory import parse_size
+
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+
+def _parse_shard(value: str) -> str:
+    from .batch import parse_shard
+
+    try:
+        index, count = parse_shard(value)
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    return f"{index}/{count}"
+
+
+_SHARD_HELP = (
+    "Only this part, I of N, of the selection; shards are split to take about as long "
+    "to build as each other"
+)
+_DURATIONS_HELP = (
+    "Build times to split shards by (default: each port's default); give every shard the same file"
+)
+_TIMINGS_JSON_HELP = "Write how long each step of the build took to this JSON file"
+_TRACE_HELP = "Write the session as a trace to open in Perfetto or chrome://tracing"
+_PROFILE_COMPILES_HELP = "Time each compile and list the slowest files"
+
 
 app = typer.Typer(chain=True, context_settings={"help_option_names": ["-h", "--help"]})
 
@@ -48,13 +108,64 @@ def build(
         str | None,
         typer.Option(help="Override the default build container"),
     ] = None,
+    ccache: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_CCACHE",
+            help="Compile through ccache, with a persistent cache per build container",
+        ),
+    ] = False,
+    offline: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_OFFLINE",
+            help="Don't pull build images; fail if one is missing",
+        ),
+    ] = False,
+    runtime: Annotated[
+        Runtime | None,
+        typer.Option(
+            envvar="MPBUILD_RUNTIME",
+            case_sensitive=False,
+            help="Build in docker or podman, or natively with the host's toolchain",
+        ),
+    ] = None,
+    cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache",
+            help="Restore the firmware of an earlier build of the same sources instead of building",
+        ),
+    ] = True,
+    timings_json: Annotated[
+        Path | None, typer.Option(metavar="PATH", dir_okay=False, help=_TIMINGS_JSON_HELP)
+    ] = None,
+    trace: Annotated[
+        Path | None,
+        typer.Option(envvar="MPBUILD_TRACE", metavar="FILE", dir_okay=False, help=_TRACE_HELP),
+    ] = None,
+    profile_compiles: Annotated[
+        bool, typer.Option("--profile-compiles", help=_PROFILE_COMPILES_HELP)
+    ] = False,
 ) -> None:
     """
     Build a MicroPython board.
     """
     if variant == "":
         variant = None
-    build_board(board, variant, extra_args or [], build_container)
+    build_board(
+        board,
+        variant,
+        extra_args or [],
+        build_container,
+        ccache=ccache,
+        use_cached=cache,
+        offline=offline,
+        runtime=runtime,
+        timings_json=timings_json,
+        trace=trace,
+        profile_compiles=profile_compiles,
+    )
 
 
 @app.command()
@@ -71,21 +182,229 @@ def rebuild(
         str | None,
         typer.Option(help="Override the default build container"),
     ] = None,
+    ccache: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_CCACHE",
+            help="Compile through ccache, with a persistent cache per build container",
+        ),
+    ] = False,
+    offline: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_OFFLINE",
+            help="Don't pull build images; fail if one is missing",
+        ),
+    ] = False,
+    runtime: Annotated[
+        Runtime | None,
+        typer.Option(
+            envvar="MPBUILD_RUNTIME",
+            case_sensitive=False,
+            help="Build in docker or podman, or natively with the host's toolchain",
+        ),
+    ] = None,
 ) -> None:
     """
     Clean and then build a MicroPython board.
     """
     if variant == "":
         variant = None
-    rebuild_board(board, variant, extra_args or [], build_container)
+    rebuild_board(
+        board,
+        variant,
+        extra_args or [],
+        build_container,
+        ccache=ccache,
+        offline=offline,
+        runtime=runtime,
+    )
+
+
+@app.command("build-many")
+def build_many(
+    targets: Annotated[
+        list[str] | None,
+        typer.Argument(
+            help="Boards to build, as BOARD or BOARD:VARIANT", autocompletion=_complete_board
+        ),
+    ] = None,
+    port: Annotated[
+        str | None,
+        typer.Option(help="Build every board of this port", autocompletion=_complete_port),
+    ] = None,
+    all_boards: Annotated[bool, typer.Option("--all", help="Build every board")] = False,
+    jobs: Annotated[
+        int, typer.Option("--jobs", "-j", min=1, help="Number of boards to build at the same time")
+    ] = 2,
+    build_container: Annotated[
+        str | None,
+        typer.Option(help="Override the default build container"),
+    ] = None,
+    ccache: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_CCACHE",
+            help="Compile through ccache, with a persistent cache per build container",
+        ),
+    ] = False,
+    offline: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_OFFLINE",
+            help="Don't pull build images; fail if one is missing",
+        ),
+    ] = False,
+    runtime: Annotated[
+        Runtime | None,
+        typer.Option(
+            envvar="MPBUILD_RUNTIME",
+            case_sensitive=False,
+            help="Build in docker or podman, or natively with the host's toolchain",
+        ),
+    ] = None,
+    cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache",
+            help="Restore the firmware of an earlier build of the same sources instead of building",
+        ),
+    ] = True,
+    memory_budget: Annotated[
+        int | None,
+        typer.Option(
+            envvar="MPBUILD_MEMORY_BUDGET",
+            parser=_parse_size,
+            metavar="SIZE",
+            help="Only start builds while their estimated memory fits in this, like 12G "
+            "(default: 85% of the memory, 0: no limit)",
+        ),
+    ] = None,
+    shard: Annotated[
+        str | None, typer.Option(parser=_parse_shard, metavar="I/N", help=_SHARD_HELP)
+    ] = None,
+    durations: Annotated[
+        Path | None, typer.Option(metavar="FILE", dir_okay=False, help=_DURATIONS_HELP)
+    ] = None,
+    timings_json: Annotated[
+        Path | None, typer.Option(metavar="PATH", dir_okay=False, help=_TIMINGS_JSON_HELP)
+    ] = None,
+    trace: Annotated[
+        Path | None,
+        typer.Option(envvar="MPBUILD_TRACE", metavar="FILE", dir_okay=False, help=_TRACE_HELP),
+    ] = None,
+    profile_compiles: Annotated[
+        bool, typer.Option("--profile-compiles", help=_PROFILE_COMPILES_HELP)
+    ] = False,
+) -> None:
+    """
+    Build several MicroPython boards concurrently.
+    """
+    build_many_boards(
+        targets or [],
+        port=port,
+        all_boards=all_boards,
+        jobs=jobs,
+        build_container_override=build_container,
+        ccache=ccache,
+        use_cached=cache,
+        offline=offline,
+        runtime=runtime,
+        memory_budget=memory_budget,
+        shard=shard,
+        durations=durations,
+        timings_json=timings_json,
+        trace=trace,
+        profile_compiles=profile_compiles,
+    )
+
+
+@app.command("plan")
+def plan(
+    targets: Annotated[
+        list[str] | None,
+        typer.Argument(
+            help="Boards to plan, as BOARD or BOARD:VARIANT", autocompletion=_complete_board
+        ),
+    ] = None,
+    port: Annotated[
+        str | None,
+        typer.Option(help="Plan every board of this port", autocompletion=_complete_port),
+    ] = None,
+    all_boards: Annotated[bool, typer.Option("--all", help="Plan every board")] = False,
+    as_json: Annotated[bool, typer.Option("--json", help="Print the plan as JSON")] = False,
+    build_container: Annotated[
+        str | None,
+        typer.Option(help="Override the default build container"),
+    ] = None,
+    ccache: Annotated[
+        bool,
+        typer.Option(
+            envvar="MPBUILD_CCACHE",
+            help="Compile through ccache, with a persistent cache per build container",
+        ),
+    ] = False,
+    runtime: Annotated[
+        Runtime | None,
+        typer.Option(
+            envvar="MPBUILD_RUNTIME",
+            case_sensitive=False,
+            help="Build in docker or podman, or natively with the host's toolchain",
+        ),
+    ] = None,
+    shard: Annotated[
+        str | None, typer.Option(parser=_parse_shard, metavar="I/N", help=_SHARD_HELP)
+    ] = None,
+    durations: Annotated[
+        Path | None, typer.Option(metavar="FILE", dir_okay=False, help=_DURATIONS_HELP)
+    ] = None,
+) -> None:
+    """
+    Show how boards would be built, without building them.
+    """
+    print_plan(
+        targets or [],
+        port=port,
+        all_boards=all_boards,
+        as_json=as_json,
+        build_container_override=build_container,
+        ccache=ccache,
+        runtime=runtime,
+        shard=shard,
+        durations=durations,
+    )
 
 
 @app.command()
-def clean(board: str, variant: Annotated[str | None, typer.Argument()] = None) -> None:
+def clean(
+    board: Annotated[
+        str | None, typer.Argument(help="Board name", autocompletion=_complete_board)
+    ] = None,
+    variant: Annotated[
+        str | None, typer.Argument(help="Board variant", autocompletion=_complete_variant)
+    ] = None,
+    port: Annotated[
+        str | None,
+        typer.Option(help="Clean every board of this port", autocompletion=_complete_port),
+    ] = None,
+    all_boards: Annotated[bool, typer.Option("--all", help="Clean every board")] = False,
+    jobs: Annotated[
+        int,
+        typer.Option(
+            "--jobs", "-j", min=1, help="Number of build directories to remove at the same time"
+        ),
+    ] = 8,
+) -> None:
     """
-    Clean a MicroPython board.
+    Clean a MicroPython board, or with --port/--all many of them.
     """
-    clean_board(board, variant)
+    if variant == "":
+        variant = None
+    if board is not None and not port and not all_boards:
+        clean_board(board, variant)
+        return
+    names = [f"{board}:{variant}" if variant else board] if board else []
+    clean_boards(names, port=port, all_boards=all_boards, jobs=jobs)
 
 
 @app.command("list")
@@ -127,6 +446,8 @@ def image_check(
 
 def _version_callback(value: bool) -> None:
     if value:
+        from . import __version__
+
         typer.echo(f"{__app_name__} v{__version__}")
 
         raise typer.Exit()
@@ -1,17 +1,183 @@
-from . import board_database
+"""
+Shell completion for board, variant and port names.
+
+Completion runs on every TAB press, so it answers straight from the persistent
+board index (see `board_database.load_board_index`) instead of building a
+`Database`. `fast_complete` goes one step further and answers the common cases
+before typer, click and rich are even imported; anything it doesn't recognise
+falls through to typer's regular completion.
+"""
+
+import os
+import shlex
+
+from . import Runtime
+from .board_database import SPECIAL_PORTS, load_board_index, special_port_variants
+from .find_boards import find_mpy_root
+
+
+def _names() -> dict[str, list[str]]:
+    """
+    Returns {board name: variant names}, restricted to the port of the
+    current directory when run from inside 'ports/<port>'.
+    """
+    mpy_dir, port_filter = find_mpy_root(None)
+    boards: dict[str, list[str]] = {}
+    for relative_json, board_json in load_board_index(mpy_dir).items():
+        _, port, _, board, _ = relative_json.split("/")
+        if port_filter and port != port_filter:
+            continue
+        boards[board] = sorted(board_json.get("variants", {}))
+    for port in SPECIAL_PORTS:
+        if port_filter and port != port_filter:
+            continue
+        boards[port] = special_port_variants(mpy_dir / "ports" / port)
+    return boards
+
+
+def _ports() -> list[str]:
+    mpy_dir, port_filter = find_mpy_root(None)
+    ports = {relative_json.split("/")[1] for relative_json in load_board_index(mpy_dir)}
+    ports.update(SPECIAL_PORTS)
+    return sorted(p for p in ports if not port_filter or p == port_filter)
 
 
 def list_ports() -> list[str]:
-    db = board_database()
-    return [p.name for p in sorted(db.ports.values())]
+    return _ports()
 
 
 def list_boards() -> list[str]:
-    db = board_database()
-    return [b.name for b in sorted(db.boards.values())]
+    return sorted(_names())
 
 
 def list_variants_for_board(board: str) -> list[str]:
-    db = board_database()
-    variants = db.boards[board].variants
-    return [v.name for v in variants if v]
+    return _names().get(board, [])
+
+
+# Commands whose positional arguments have name completion (in argument order),
+# and the options that consume the following word as their value, with the
+# values to offer for it: [] for a file name, None to leave it to typer.
+_POSITIONAL_COMPLETERS = {
+    "build": ["board", "variant"],
+    "rebuild": ["board", "variant"],
+    "list": ["port"],
+}
+_OPTION_VALUES: dict[str, list[str] | None] = {
+    "--build-container": None,
+    "--format": None,
+    "--port": None,
+    "--jobs": None,
+    "-j": None,
+    "--memory-budget": None,
+    "--shard": None,
+    "--runtime": [runtime.value for runtime in Runtime],
+    "--durations": [],
+    "--timings-json": [],
+    "--trace": [],
+}
+_OPTIONS_WITH_VALUE = set(_OPTION_VALUES)
+
+
+def _completion_args(shell: str) -> tuple[list[str], str] | None:
+    """
+    Returns (words before the cursor, word being completed) using the same
+    environment variables typer's completion scripts set for each shell.
+    """
+    try:
+        if shell == "bash":
+            cwords = shlex.split(os.environ["COMP_WORDS"])
+            cword = int(os.environ["COMP_CWORD"])
+            incomplete = cwords[cword] if cword < len(cwords) else ""
+            return cwords[1:cword], incomplete
+        line = os.environ.get("_TYPER_COMPLETE_ARGS", "")
+        cwords = shlex.split(line)
+        if shell in ("powershell", "pwsh"):
+            incomplete = os.environ.get("_TYPER_COMPLETE_WORD_TO_COMPLETE", "")
+            return (cwords[1:-1] if incomplete else cwords[1:]), incomplete
+        args = cwords[1:]
+        if args and not line.endswith(" "):
+            return args[:-1], args[-1]
+        return args, ""
+    except (KeyError, ValueError):
+        # Unbalanced quotes or a missing variable: let typer deal with it.
+        return None
+
+
+def _candidates(args: list[str], incomplete: str) -> list[str] | None:
+    """
+    Returns the names to offer, or None if this isn't a position the fast
+    path knows how to complete.
+    """
+    if not args or incomplete.startswith("-"):
+        return None
+    if args[-1] in _OPTIONS_WITH_VALUE:
+        values = _OPTION_VALUES[args[-1]]
+        return None if values is None else [v for v in values if v.startswith(incomplete)]
+    command, *rest = args
+    completers = _POSITIONAL_COMPLETERS.get(command)
+    if completers is None:
+        return None
+
+    positionals: list[str] = []
+    skip_value = False
+    for word in rest:
+        if skip_value:
+            skip_value = False
+        elif word in _OPTIONS_WITH_VALUE:
+            skip_value = True
+        elif not word.startswith("-"):
+            positionals.append(word)
+    if len(positionals) >= len(completers):
+        return None
+
+    kind = completers[len(positionals)]
+    if kind == "board":
+        words = list_boards()
+    elif kind == "variant":
+        words = list_variants_for_board(positionals[0])
+    else:
+        words = list_ports()
+    return [w for w in words if w.startswith(incomplete)]
+
+
+def fast_complete(complete_var: str = "_MPBUILD_COMPLETE") -> int | None:
+    """
+    Answers a shell completion request without loading the CLI.
+
+    Returns the exit status to use once the answer is written to stdout, or
+    None if the request must be handled by typer instead (option names,
+    subcommands, completion script installation, unknown shells).
+    The output format mirrors typer's completion classes for each shell.
+    """
+    instruction = os.environ.get(complete_var, "")
+    shell = instruction.removeprefix("complete_")
+    if shell == instruction or shell not in ("bash", "zsh", "fish", "powershell", "pwsh"):
+        return None
+    completion_args = _completion_args(shell)
+    if completion_args is None:
+        return None
+    try:
+        words = _candidates(*completion_args)
+    except SystemExit:
+        # Not inside a MicroPython tree.
+        return None
+    if words is None:
+        return None
+
+    if shell == "bash":
+        out = "\n".join(words)
+    elif shell == "zsh":
+        if words:
+            args_str = "\n".join(f'"{w}"' for w in words)
+            out = f"_arguments '*: :(({args_str}))'"
+        else:
+            out = "_files"
+    elif shell == "fish":
+        if os.environ.get("_TYPER_COMPLETE_FISH_ACTION") == "is-args":
+            return 0 if words else 1
+        out = "\n".join(words)
+    else:
+        out = "\n".join(f"{w}::: " for w in words)
+
+    print(out, flush=True)
+    return 0
@@ -0,0 +1,219 @@
+"""
+Make sure the build images are present before building.
+
+Left to itself, ``docker run`` pulls a missing image in the middle of the
+build, one image at a time. `plan_images` works out which images a set of
+builds needs and checks which are already present locally with a single
+``docker image inspect``. `pull_images` then pulls the missing ones
+concurrently. In offline mode nothing is pulled and a missing image is an
+error before any build starts.
+
+With podman the same is done with the podman CLI; native builds need no
+images.
+"""
+
+from __future__ import annotations
+
+import re
+import subprocess
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from rich.console import Console
+from rich.progress import Progress
+
+from . import Runtime
+from .board_database import Board
+from .build import BuildContext, PhaseResult, get_build_container
+
+DEFAULT_PULL_JOBS = 4
+
+
+class MpbuildImageException(Exception):
+    pass
+
+
+@dataclass
+class ImagePlan:
+    images: list[str]
+    """
+    Every image the builds need, in the order first needed.
+    """
+    missing: list[str] = field(default_factory=list)
+    """
+    The ones not present locally.
+    """
+
+
+def required_images(
+    targets: Iterable[tuple[Board, str | None]],
+    build_container_override: str | None = None,
+    context: BuildContext | None = None,
+) -> list[str]:
+    """
+    Returns the distinct images needed to build ``targets`` (board, variant
+    pairs), in order. Natively there are none.
+    """
+    if context is not None and context.runtime == Runtime.native:
+        return []
+    resolve = context.build_container if context is not None else get_build_container
+    images: list[str] = []
+    for board, variant in targets:
+        image = build_container_override or resolve(board, variant)
+        if image not in images:
+            images.append(image)
+    return images
+
+
+def _inspect(images: list[str], program: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [program, "image", "inspect", "--format", "{{.Id}}", *images],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+def missing_images(images: list[str], program: str = "docker") -> list[str]:
+    """
+    Returns the images in ``images`` that aren't present locally, according
+    to ``program`` (docker or podman).
+
+    All of them are checked with one ``docker image inspect``, which fails
+    if any is missing and names each missing one on stderr ("No such image:
+    <name>").
+    """
+    if not images:
+        return []
+    try:
+        proc = _inspect(images, program)
+    except FileNotFoundError as e:
+        raise MpbuildImageException(f"{program} not found. Please install {program}.") from e
+    if proc.returncode == 0:
+        return []
+    reported = set(re.findall(r"No such image: (\S+)", proc.stderr))
+    missing = [i for i in images if i in reported]
+    if missing:
+        return missing
+    # Unrecognised error output: fall back to asking about each image.
+    return [i for i in images if _inspect([i], program).returncode != 0]
+
+
+def _program(context: BuildContext | None) -> str:
+    return context.runtime.value if context is not None else Runtime.docker.value
+
+
+def plan_images(
+    targets: Iterable[tuple[Board, str | None]],
+    build_container_override: str | None = None,
+    context: BuildContext | None = None,
+) -> ImagePlan:
+    images = required_images(targets, build_container_override, context)
+    return ImagePlan(images=images, missing=missing_images(images, _program(context)))
+
+
+def pull_images(
+    images: list[str],
+    jobs: int = DEFAULT_PULL_JOBS,
+    on_done: Callable[[str, bool, str], None] | None = None,
+    program: str = "docker",
+    on_start: Callable[[str], None] | None = None,
+) -> dict[str, str | None]:
+    """
+    Pulls ``images`` with ``program`` (docker or podman), up to ``jobs`` at
+    the same time.
+
+    Returns the error output per image, None for those pulled successfully.
+    ``on_start(image)`` is called (from a worker thread) as each pull starts
+    and ``on_done(image, ok, output)`` as each one finishes.
+    """
+
+    def pull(image: str) -> tuple[str, str | None]:
+        if on_start is not None:
+            on_start(image)
+        proc = subprocess.run(
+            [program, "pull", "--quiet", image],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        return image, (None if proc.returncode == 0 else proc.stderr.strip() or proc.stdout)
+
+    errors: dict[str, str | None] = {}
+    if not images:
+        return errors
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(images)))) as executor:
+        for future in as_completed([executor.submit(pull, i) for i in images]):
+            image, error = future.result()
+            errors[image] = error
+            if on_done is not None:
+                on_done(image, error is None, error or "")
+    return errors
+
+
+def ensure_images(
+    targets: Iterable[tuple[Board, str | None]],
+    build_container_override: str | None = None,
+    offline: bool = False,
+    jobs: int = DEFAULT_PULL_JOBS,
+    console: Console | None = None,
+    context: BuildContext | None = None,
+    pulls: list[PhaseResult] | None = None,
+) -> ImagePlan:
+    """
+    Checks the images needed for ``targets`` are present, pulling the
+    missing ones concurrently with a progress bar. Each pull is added to
+    ``pulls``, named after its image, with when it started and how long it
+    took (see trace.py).
+
+    Raises MpbuildImageException if an image is missing and ``offline`` is
+    set, or if a pull fails.
+    """
+    if console is None:
+        console = Console()
+    plan = plan_images(targets, build_container_override, context)
+    if not plan.missing:
+        return plan
+    if offline:
+        raise MpbuildImageException(
+            "Offline and these build images are not present locally: " + ", ".join(plan.missing)
+        )
+
+    console.print(
+        f"Pulling {len(plan.missing)} of {len(plan.images)} build image(s): "
+        + ", ".join(plan.missing)
+    )
+    start = time.monotonic()
+    started: dict[str, float] = {}
+    with Progress(console=console, transient=True) as progress:
+        task = progress.add_task("[cyan]Pulling images...", total=len(plan.missing))
+
+        def pull_started(image: str) -> None:
+            started[image] = time.time()
+
+        def report(image: str, ok: bool, _output: str) -> None:
+            status = "[green]pulled[/]" if ok else "[red]failed[/]"
+            progress.console.print(f"{status} {image} ({time.monotonic() - start:.1f}s)")
+            progress.update(task, advance=1)
+            if pulls is not None:
+                began = started.get(image, time.time())
+                pulls.append(PhaseResult(image, 0 if ok else 1, time.time() - began, began))
+
+        errors = pull_images(
+            plan.missing,
+            jobs=jobs,
+            on_done=report,
+            program=_program(context),
+            on_start=pull_started,
+        )
+
+    failed = {image: error for image, error in errors.items() if error is not None}
+    if failed:
+        raise MpbuildImageException(
+            "Failed to pull: " + "; ".join(f"{image}: {error}" for image, error in failed.items())
+        )
+    return plan
@@ -0,0 +1,454 @@
+"""
+Run build containers through the Docker Engine API.
+
+The docker CLI is itself a client of the daemon's HTTP API: ``docker run``
+parses its options, then creates, attaches to, starts, waits for and removes
+the container over the daemon's unix socket. Doing that directly saves
+starting a shell and the CLI for every build step, and gives the output
+stream and the exit code as data instead of CLI output.
+
+`EngineProcess` runs a `ContainerSpec` through the API and has the parts of
+the ``subprocess.Popen`` interface the callers use: ``stdout``, ``poll``,
+``wait``, ``terminate`` and ``kill``. `runtimes.spawn` uses it whenever the
+daemon's socket is reachable, and the docker CLI otherwise.
+
+Only a local unix socket is used: with DOCKER_HOST pointing elsewhere, or
+MPBUILD_DOCKER_API=0, builds go through the CLI. So do builds that need the
+terminal (``docker run -it``).
+"""
+
+from __future__ import annotations
+
+import functools
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from collections.abc import Iterator
+from typing import IO, Any
+from urllib.parse import quote, urlencode
+
+from .build import ContainerSpec
+
+DOCKER_API_ENV = "MPBUILD_DOCKER_API"
+DEFAULT_SOCKET = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+"""
+Docker 20.10, the oldest release still supported upstream.
+"""
+
+# Exit status for a build the daemon failed to run, as for docker run.
+_DAEMON_ERROR = 125
+
+
+class DockerEngineError(Exception):
+    pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None):
+        super().__init__("localhost")
+        self._path = path
+        self._timeout = timeout
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        sock.connect(self._path)
+        self.sock = sock
+
+
+class _Stream:
+    """
+    The raw stream of an attach or exec start request, once the daemon has
+    taken over the connection.
+    """
+
+    def __init__(self, sock: socket.socket, reader: IO[bytes]):
+        self._sock = sock
+        self._reader = reader
+
+    def frames(self) -> Iterator[tuple[int, bytes]]:
+        """
+        Yields (stream, data) until the container's output ends. Without a
+        TTY the daemon multiplexes stdout (1) and stderr (2), each frame
+        headed by the stream number and the payload size.
+        """
+        while True:
+            header = self._reader.read(8)
+            if len(header) < 8:
+                return
+            size = int.from_bytes(header[4:8], "big")
+            yield header[0], self._reader.read(size)
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.close()
+        self._sock.close()
+
+
+class DockerEngine:
+    """
+    A minimal client for the Docker Engine API on a unix socket: the calls
+    needed to run a build container and nothing more.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(
+        self, method: str, path: str, body: Any = None, timeout: float | None = -1
+    ) -> tuple[int, bytes]:
+        conn = _UnixHTTPConnection(self.socket_path, self.timeout if timeout == -1 else timeout)
+        try:
+            headers = {}
+            payload = None
+            if body is not None:
+                headers["Content-Type"] = "application/json"
+                payload = json.dumps(body)
+            conn.request(method, f"/{API_VERSION}{path}", body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except OSError as e:
+            raise DockerEngineError(f"{method} {path}: {e}") from e
+        finally:
+            conn.close()
+
+    def _call(
+        self,
+        method: str,
+        path: str,
+        body: Any = None,
+        timeout: float | None = -1,
+        ok: tuple[int, ...] = (200, 201, 204, 304),
+    ) -> Any:
+        status, data = self._request(method, path, body, timeout)
+        if status not in ok:
+            raise DockerEngineError(_error_message(data) or f"{method} {path}: HTTP {status}")
+        return json.loads(data) if data else None
+
+    def ping(self) -> bool:
+        try:
+            status, data = self._request("GET", "/_ping", timeout=2)
+        except DockerEngineError:
+            return False
+        return status == 200 and data == b"OK"
+
+    def inspect(self, container: str) -> dict | None:
+        """
+        Returns the container's details, or None if there's no such container.
+        """
+        result = self._call("GET", f"/containers/{quote(container)}/json", ok=(200, 404))
+        return result if isinstance(result, dict) and "Id" in result else None
+
+    def create(self, config: dict, name: str | None = None) -> str:
+        query = f"?{urlencode({'name': name})}" if name else ""
+        return self._call("POST", f"/containers/create{query}", config)["Id"]
+
+    def start(self, container: str) -> None:
+        self._call("POST", f"/containers/{quote(container)}/start")
+
+    def wait(self, container: str) -> int:
+        result = self._call("POST", f"/containers/{quote(container)}/wait", timeout=None)
+        return int(result["StatusCode"])
+
+    def kill(self, container: str, signal: str = "SIGKILL") -> None:
+        self._call("POST", f"/containers/{quote(container)}/kill?{urlencode({'signal': signal})}")
+
+    def remove(self, container: str) -> None:
+        self._call("DELETE", f"/containers/{quote(container)}?force=1", ok=(204, 404))
+
+    def exec_create(self, container: str, config: dict) -> str:
+        return self._call("POST", f"/containers/{quote(container)}/exec", config)["Id"]
+
+    def exec_exit_code(self, exec_id: str) -> int:
+        return int(self._call("GET", f"/exec/{quote(exec_id)}/json")["ExitCode"])
+
+    def _hijack(self, path: str, body: Any = None) -> _Stream:
+        """
+        Sends a request after which the daemon switches the connection to the
+        container's raw output stream.
+        """
+        payload = json.dumps(body).encode() if body is not None else b""
+        request = (
+            f"POST /{API_VERSION}{path} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Connection: Upgrade\r\n"
+            "Upgrade: tcp\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "\r\n"
+        ).encode() + payload
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(request)
+            reader = sock.makefile("rb")
+            status_line = reader.readline().decode("latin-1").split(maxsplit=2)
+            headers = {}
+            while (line := reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            status = int(status_line[1]) if len(status_line) > 1 else 0
+            if status not in (101, 200):
+                length = int(headers.get("content-length", 0))
+                raise DockerEngineError(
+                    _error_message(reader.read(length)) or f"POST {path}: HTTP {status}"
+                )
+            # The output can pause for as long as a compile step takes.
+            sock.settimeout(None)
+        except (OSError, ValueError) as e:
+            sock.close()
+            raise DockerEngineError(f"POST {path}: {e}") from e
+        except DockerEngineError:
+            sock.close()
+            raise
+        return _Stream(sock, reader)
+
+    def attach(self, container: str) -> _Stream:
+        return self._hijack(f"/containers/{quote(container)}/attach?stream=1&stdout=1&stderr=1")
+
+    def exec_start(self, exec_id: str) -> _Stream:
+        return self._hijack(f"/exec/{quote(exec_id)}/start", {"Detach": False, "Tty": False})
+
+
+def _error_message(data: bytes) -> str | None:
+    try:
+        return json.loads(data)["message"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def container_config(spec: ContainerSpec) -> dict:
+    """
+    Returns the ``/containers/create`` body equivalent to ``spec.argv()``.
+    """
+    return {
+        "Image": spec.image,
+        "Cmd": ["bash", "-c", spec.shell_script()],
+        "WorkingDir": spec.workdir,
+        "User": spec.user,
+        "Env": [f"{name}={value}" for name, value in spec.env.items()],
+        "AttachStdout": True,
+        "AttachStderr": True,
+        "Tty": False,
+        "OpenStdin": False,
+        "HostConfig": {
+            "Binds": [f"{source}:{target}" for source, target in spec.mounts],
+            "Devices": [
+                {"PathOnHost": d, "PathInContainer": d, "CgroupPermissions": "rwm"}
+                for d in spec.devices
+            ],
+            **({"Memory": spec.memory_limit} if spec.memory_limit else {}),
+        },
+    }
+
+
+def _keepalive_config(spec: ContainerSpec) -> dict:
+    """
+    Returns the ``/containers/create`` body equivalent to
+    ``spec.keepalive_argv()``.
+    """
+    config = container_config(spec)
+    config["Cmd"] = spec.keepalive_argv()[-3:]
+    del config["User"]
+    config["Labels"] = {"mpbuild.pool": "1"}
+    config["HostConfig"]["AutoRemove"] = True
+    return config
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+class EngineProcess:
+    """
+    A build running through the Docker Engine API, with the parts of the
+    ``subprocess.Popen`` interface callers use.
+
+    ``stdout`` is where the container's stdout and stderr go: a file (or
+    anything with a ``fileno``), ``subprocess.PIPE`` to read them from
+    ``self.stdout``, or None for this process's stdout.
+
+    ``oom_killed`` is set once a container that failed is known to have
+    been OOM-killed (``State.OOMKilled``).
+
+    ``terminate`` and ``kill`` remove the container before they return, as
+    ``docker run --rm`` does when stopped. The thread that would otherwise
+    remove it doesn't get to when mpbuild exits straight after, on Ctrl-C.
+    """
+
+    def __init__(
+        self,
+        engine: DockerEngine,
+        spec: ContainerSpec,
+        stdout: int | IO[Any] | None = None,
+        text: bool = False,
+    ):
+        self.args = spec
+        self.returncode: int | None = None
+        self.oom_killed = False
+        self.stdout: IO[Any] | None = None
+        self._engine = engine
+        self._container: str | None = None
+        self._exec_id: str | None = None
+        self._stopped_with: int | None = None
+        self._done = threading.Event()
+
+        if spec.reuse_container:
+            self._stream = self._start_exec(spec)
+        else:
+            self._stream = self._start_container(spec)
+
+        self._close_out = stdout == subprocess.PIPE
+        if self._close_out:
+            read_fd, self._out_fd = os.pipe()
+            self.stdout = (
+                open(read_fd, encoding="utf-8", errors="replace", buffering=1)
+                if text
+                else open(read_fd, "rb")
+            )
+        elif stdout is None:
+            self._out_fd = sys.stdout.fileno()
+        else:
+            self._out_fd = stdout if isinstance(stdout, int) else stdout.fileno()
+
+        threading.Thread(target=self._pump, name="mpbuild-attach", daemon=True).start()
+
+    def _start_container(self, spec: ContainerSpec) -> _Stream:
+        container = self._engine.create(container_config(spec))
+        try:
+            # Attach before starting so no output is missed.
+            stream = self._engine.attach(container)
+            try:
+                self._engine.start(container)
+            except DockerEngineError:
+                stream.close()
+                raise
+        except DockerEngineError:
+            self._engine.remove(container)
+            raise
+        self._container = container
+        return stream
+
+    def _start_exec(self, spec: ContainerSpec) -> _Stream:
+        name = spec.pool_name
+        if self._engine.inspect(name) is None:
+            try:
+                self._engine.start(self._engine.create(_keepalive_config(spec), name=name))
+            except DockerEngineError:
+                # Most likely another build started it first; if not, the
+                # exec below says what's wrong.
+                pass
+        self._exec_id = self._engine.exec_create(
+            name,
+            {
+                "Cmd": ["bash", "-c", spec.shell_script()],
+                "User": spec.user,
+                "WorkingDir": spec.workdir,
+                "AttachStdout": True,
+                "AttachStderr": True,
+                "Tty": False,
+            },
+        )
+        return self._engine.exec_start(self._exec_id)
+
+    def _pump(self) -> None:
+        try:
+            try:
+                for _stream, data in self._stream.frames():
+                    try:
+                        _write_all(self._out_fd, data)
+                    except OSError:
+                        pass  # Reader went away; drain the stream anyway.
+            finally:
+                self._stream.close()
+            if self._container is not None:
+                returncode = self._engine.wait(self._container)
+                if returncode != 0:
+                    info = self._engine.inspect(self._container) or {}
+                    self.oom_killed = bool(info.get("State", {}).get("OOMKilled"))
+                self._engine.remove(self._container)
+            else:
+                assert self._exec_id is not None
+                returncode = self._engine.exec_exit_code(self._exec_id)
+        except Exception as e:  # noqa: BLE001 - must always set returncode
+            if self._stopped_with is not None:
+                # Removed by terminate() or kill() before it could be waited for.
+                returncode = self._stopped_with
+            else:
+                try:
+                    _write_all(self._out_fd, f"mpbuild: docker engine: {e}\n".encode())
+                except OSError:
+                    pass
+                returncode = _DAEMON_ERROR
+        finally:
+            if self._close_out:
+                os.close(self._out_fd)
+        self.returncode = returncode
+        self._done.set()
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        if not self._done.wait(timeout):
+            raise subprocess.TimeoutExpired(str(self.args), timeout or 0)
+        assert self.returncode is not None
+        return self.returncode
+
+    def _signal(self, signal: str, returncode: int) -> None:
+        if self._done.is_set():
+            return
+        if self._container is None:
+            # A build exec'd in a reused container keeps running, as it does
+            # when the docker CLI is stopped; just stop following it.
+            self._stream.close()
+            return
+        self._stopped_with = returncode
+        try:
+            self._engine.kill(self._container, signal)
+        except DockerEngineError:
+            pass
+        try:
+            self._engine.remove(self._container)
+        except DockerEngineError:
+            pass
+
+    def terminate(self) -> None:
+        self._signal("SIGTERM", 128 + 15)
+
+    def kill(self) -> None:
+        self._signal("SIGKILL", 128 + 9)
+
+
+@functools.cache
+def _connect(socket_path: str) -> DockerEngine | None:
+    engine = DockerEngine(socket_path)
+    return engine if engine.ping() else None
+
+
+def engine_from_env() -> DockerEngine | None:
+    """
+    Returns a client for the local Docker daemon, or None if builds should
+    go through the docker CLI instead: MPBUILD_DOCKER_API=0, DOCKER_HOST
+    isn't a unix socket, or the daemon doesn't answer.
+    """
+    if os.environ.get(DOCKER_API_ENV, "") == "0":
+        return None
+    host = os.environ.get("DOCKER_HOST", "")
+    if host and not host.startswith("unix://"):
+        return None
+    socket_path = host.removeprefix("unix://") or DEFAULT_SOCKET
+    if not os.path.exists(socket_path):
+        return None
+    return _connect(socket_path)
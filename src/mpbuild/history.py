@@ -0,0 +1,110 @@
+"""
+Remember how long each board takes to build.
+
+A batch finishes when its slowest worker does. Started in selection order,
+a few long esp32 builds picked up last leave the other workers idle while
+they finish, so `build_many` starts the targets longest first, by their
+expected durations (the longest-processing-time rule).
+
+Every successful build records its wall-clock time against its target
+(BOARD or BOARD:VARIANT) in ``cache_dir()/durations.json``, keeping the last
+few. A target is expected to take the median of those; one that hasn't been
+built yet takes the average of its port's targets, or the port's default
+from ``DEFAULT_PORT_DURATION``.
+
+Splitting a selection into shards (see ``batch.shard_targets``) must come
+out the same on every CI machine, so it uses a given durations file or
+``DurationHistory.defaults()``, never the local history.
+"""
+
+from __future__ import annotations
+
+import statistics
+import threading
+from pathlib import Path
+
+from .state import cache_dir, read_json, write_json
+
+# Seconds a clean build of a port takes, before any of it has been timed.
+DEFAULT_PORT_DURATION = {
+    "esp32": 300.0,
+    "esp8266": 120.0,
+    "rp2": 150.0,
+    "stm32": 90.0,
+    "mimxrt": 100.0,
+    "nrf": 80.0,
+    "renesas-ra": 100.0,
+    "webassembly": 120.0,
+}
+DEFAULT_DURATION = 60.0
+
+# How many durations per target the estimate is taken from.
+DURATION_HISTORY = 5
+
+DURATION_HISTORY_VERSION = 1
+
+
+class DurationHistory:
+    """
+    The recorded build durations per target (see the module docstring).
+    Safe to use from several threads.
+    """
+
+    def __init__(self, path: Path | None = None, load: bool = True):
+        self.path = path or cache_dir() / "durations.json"
+        self._lock = threading.Lock()
+        self._targets = self._load() if load else {}
+
+    @classmethod
+    def defaults(cls) -> DurationHistory:
+        """
+        A history with nothing in it, so each target is expected to take its
+        port's default. Unlike this machine's history, it's the same on every
+        machine.
+        """
+        return cls(load=False)
+
+    def _load(self) -> dict[str, dict]:
+        data = read_json(self.path)
+        if not isinstance(data, dict) or data.get("version") != DURATION_HISTORY_VERSION:
+            return {}
+        targets = data.get("targets")
+        return targets if isinstance(targets, dict) else {}
+
+    def durations(self, target: str) -> list[float]:
+        with self._lock:
+            return list(self._targets.get(target, {}).get("durations", []))
+
+    def port_estimate(self, port: str) -> float:
+        """
+        The average expected duration of the port's timed targets, else the
+        port's default.
+        """
+        with self._lock:
+            timed = [
+                statistics.median(entry["durations"])
+                for entry in self._targets.values()
+                if entry.get("port") == port and entry.get("durations")
+            ]
+        if timed:
+            return statistics.fmean(timed)
+        return DEFAULT_PORT_DURATION.get(port, DEFAULT_DURATION)
+
+    def estimate(self, target: str, port: str) -> float:
+        """
+        The seconds ``target`` (BOARD or BOARD:VARIANT) of ``port`` is
+        expected to take to build.
+        """
+        durations = self.durations(target)
+        return statistics.median(durations) if durations else self.port_estimate(port)
+
+    def record(self, target: str, port: str, seconds: float) -> None:
+        with self._lock:
+            # Take in what other mpbuild processes recorded meanwhile.
+            self._targets = self._load()
+            durations = self._targets.get(target, {}).get("durations", [])
+            self._targets[target] = {
+                "port": port,
+                "durations": [*durations, round(seconds, 1)][-DURATION_HISTORY:],
+            }
+            write_json(self.path, {"version": DURATION_HISTORY_VERSION, "targets": self._targets})
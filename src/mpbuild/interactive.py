@@ -1,15 +1,24 @@
 """Textual-based TUI for browsing boards and triggering builds.
 
 Launched via ``mpbuild --interactive`` (see cli.py). The app reuses the
-existing board database and docker_build_cmd; the build subprocess is
-streamed live into a RichLog widget.
+existing board database and docker_build_spec; the build container's output
+is streamed live into a RichLog widget. A missing build image is pulled
+first, as for the CLI (see container_images.py).
+
+With MPBUILD_TRACE set, the session's builds are written to that file as a
+trace after each one finishes (see trace.py).
 """
 
 from __future__ import annotations
 
+import io
 import subprocess
+import threading
+import time
 from collections.abc import Iterator
+from typing import TextIO
 
+from rich.console import Console
 from textual import work
 from textual.app import App, ComposeResult
 from textual.binding import Binding
@@ -17,8 +26,22 @@ from textual.containers import Horizontal, Vertical
 from textual.widgets import Button, Footer, Header, RichLog, Select, Static, Tree
 
 from . import board_database
+from .batch import BuildTarget
 from .board_database import Board
-from .build import docker_build_cmd
+from .build import (
+    BuildContext,
+    ContainerSpec,
+    PhaseResult,
+    build_directory,
+    docker_build_spec,
+    parse_phase,
+)
+from .clean import remove_build_directory
+from .container_images import ensure_images
+from .docker_engine import DockerEngineError, EngineProcess
+from .runtimes import spawn
+from .timings import BuildTimings
+from .trace import trace_path, write_trace
 
 
 class BoardTree(Tree):
@@ -50,19 +73,31 @@ class BoardTree(Tree):
             parent.collapse()
 
 
-def _spawn(cmd: str) -> subprocess.Popen[str]:
-    """Start ``cmd`` under a shell, line-buffered, with stderr merged into stdout."""
-    return subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-    )
+class _LogWriter(io.TextIOBase, TextIO):
+    """File for a rich Console that writes each line it's given to the app's
+    build log, from the worker thread."""
+
+    def __init__(self, app: MpBuildApp) -> None:
+        super().__init__()
+        self._app = app
+        self._partial = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        *lines, self._partial = (self._partial + text).split("\n")
+        for line in lines:
+            self._app.call_from_thread(self._app._log_line, line)
+        return len(text)
+
 
+def _spawn(spec: ContainerSpec) -> subprocess.Popen[str] | EngineProcess:
+    """Start the build container, line-buffered, with stderr merged into stdout."""
+    return spawn(spec, stdout=subprocess.PIPE, text=True)
 
-def _stream_proc(proc: subprocess.Popen[str]) -> Iterator[str]:
+
+def _stream_proc(proc: subprocess.Popen[str] | EngineProcess) -> Iterator[str]:
     """Yield ``proc``'s stdout lines as they arrive, then a final exit-code line."""
     assert proc.stdout is not None
     for line in proc.stdout:
@@ -103,7 +138,10 @@ class MpBuildApp(App):
         self._selected_board: Board | None = None
         # Single source of truth for "is a build running": None = idle.
         # Build/Clean clicks while non-None terminate it before starting a new one.
-        self._running_proc: subprocess.Popen[str] | None = None
+        self._running_proc: subprocess.Popen[str] | EngineProcess | None = None
+        self._trace = trace_path()
+        self._traced: list[BuildTimings] = []
+        self._trace_lock = threading.Lock()
         tree = self.query_one("#board-tree", BoardTree)
         tree.root.expand()
         self._populate_tree(tree)
@@ -222,59 +260,160 @@ class MpBuildApp(App):
         do_clean: bool,
         do_build: bool,
     ) -> None:
-        """Stream up to two docker phases sequentially.
+        """Clean and/or build one board.
 
         - Clean only:   do_clean=True, do_build=False
         - Build only:   do_clean=False, do_build=True
-        - Rebuild:      do_clean=True, do_build=True (clean then build;
-                        the build phase is skipped if clean fails)
+        - Rebuild:      do_clean=True, do_build=True (the build is skipped
+                        if the clean fails)
+
+        Cleaning works as for the CLI: the build directory is removed on the
+        host, or by ``make clean`` in a container if this user can't remove
+        it (see clean.py).
         """
         suffix = f" ({variant})" if variant else ""
+        rebuild = do_clean and do_build
+        label = "Rebuilding" if rebuild else "Cleaning" if do_clean else "Building"
+        label = f"{label} {board.name}{suffix}"
         try:
-            clean_cmd = (
-                docker_build_cmd(
-                    board=board, variant=variant, do_clean=True, docker_interactive=False
-                )
-                if do_clean
-                else None
-            )
-            build_cmd = (
-                docker_build_cmd(
-                    board=board, variant=variant, do_clean=False, docker_interactive=False
-                )
-                if do_build
-                else None
-            )
-        except Exception as e:  # ValueError from unknown variant, etc.
+            context = BuildContext.create(board.port.directory_repo, jobserver=True)
+        except Exception as e:  # git or /dev unreadable, etc.
             self.call_from_thread(self._log_line, f"[red]error:[/] {e}")
             return
 
-        last_proc: subprocess.Popen[str] | None = None
-        if clean_cmd is not None:
-            last_proc = self._run_phase(f"Cleaning {board.name}{suffix}", clean_cmd)
-            if last_proc.returncode != 0 and build_cmd is not None:
-                self.call_from_thread(
-                    self._log_line,
-                    "[red]Build skipped because clean failed.[/]",
-                )
-                self.call_from_thread(self._on_build_finished, last_proc)
+        spawned = time.time()
+        phases: list[PhaseResult] = []
+        proc = None
+        if do_clean:
+            self.call_from_thread(self._set_log_phase, label)
+            start = time.time()
+            returncode, proc = self._clean(board, variant, context)
+            if returncode is None:
                 return
-        if build_cmd is not None:
-            last_proc = self._run_phase(f"Building {board.name}{suffix}", build_cmd)
-        if last_proc is not None:
-            self.call_from_thread(self._on_build_finished, last_proc)
+            phases.append(PhaseResult("clean", returncode, time.time() - start, start))
+        if do_build and all(p.ok for p in phases):
+            start = time.time()
+            proc = self._spawn_build(f"Building {board.name}{suffix}", board, variant, context)
+            if proc is None:
+                return
+            phases.append(PhaseResult("build", proc.wait(), time.time() - start, start))
+        if rebuild:
+            for phase in phases:
+                self.call_from_thread(self._log_phase_result, phase)
+            if not phases[0].ok:
+                self.call_from_thread(self._log_line, "[red]Build skipped because clean failed.[/]")
+
+        target = board.name + (f":{variant}" if variant else "")
+        step = "rebuild" if rebuild else "clean" if do_clean else "build"
+        # A rebuild is traced phase by phase, a clean or build as one span.
+        self._record_trace(
+            target, board.port.name, step, spawned, phases[-1].returncode, phases if rebuild else []
+        )
+        if proc is not None:
+            self.call_from_thread(self._on_build_finished, proc)
 
-    def _run_phase(self, label: str, cmd: str) -> subprocess.Popen[str]:
-        """Run one docker invocation, stream its output, return the finished Popen.
+    def _clean(
+        self, board: Board, variant: str | None, context: BuildContext
+    ) -> tuple[int | None, subprocess.Popen[str] | EngineProcess | None]:
+        """Remove the build directory, in a container if this user can't.
 
-        Called from inside the @work thread; uses call_from_thread for any UI
-        state changes (log writes, border title, running-proc handle).
+        Returns the exit status, None if the container couldn't be started,
+        and the container's process if one ran.
+        """
+        target = BuildTarget(board, variant)
+        removed = remove_build_directory(target)
+        directory = build_directory(board, variant).relative_to(board.port.directory_repo)
+        if removed is not False:
+            action = "Removed" if removed else "Nothing to remove:"
+            self.call_from_thread(self._log_line, f"{action} {directory}")
+            return 0, None
+        self.call_from_thread(
+            self._log_line, f"Can't remove {directory} as this user, cleaning in a container"
+        )
+        label = f"Cleaning {target} in a container"
+        proc = self._spawn_build(label, board, variant, context, do_clean=True)
+        return (None, None) if proc is None else (proc.wait(), proc)
+
+    def _spawn_build(
+        self,
+        label: str,
+        board: Board,
+        variant: str | None,
+        context: BuildContext,
+        do_clean: bool = False,
+    ) -> subprocess.Popen[str] | EngineProcess | None:
+        """Run the build (or container clean) and return the finished process,
+        or None if it couldn't be started."""
+        try:
+            spec = docker_build_spec(
+                board=board,
+                variant=variant,
+                extra_args=["clean"] if do_clean else None,
+                do_clean=do_clean,
+                docker_interactive=False,
+                context=context,
+            )
+            # Pull a missing image first, as the CLI does: the engine API
+            # doesn't pull on create.
+            console = Console(file=_LogWriter(self))
+            ensure_images([(board, variant)], context=context, console=console)
+        except Exception as e:  # unknown variant, MpbuildImageException, etc.
+            self.call_from_thread(self._log_line, f"[red]error:[/] {e}")
+            return None
+        return self._run_phase(label, spec)
+
+    def _record_trace(
+        self,
+        target: str,
+        port: str,
+        step: str,
+        spawned: float,
+        returncode: int | None,
+        phases: list[PhaseResult],
+    ) -> None:
+        """Add a finished build to the session's trace, if there is one.
+
+        Without ``phases`` the build is one ``step`` span. A rebuild's clean
+        and build phases are timed on the host, so there's no container
+        startup span before them.
+        """
+        if self._trace is None:
+            return
+        returncode = returncode if returncode is not None else 1
+        if not phases:
+            phases = [PhaseResult(step, returncode, time.time() - spawned, spawned)]
+        with self._trace_lock:
+            self._traced.append(BuildTimings(target, port, returncode, phases))
+            try:
+                write_trace(self._trace, self._traced)
+            except OSError as e:
+                self.call_from_thread(self._log_line, f"[red]error:[/] writing the trace: {e}")
+
+    def _run_phase(
+        self, label: str, spec: ContainerSpec
+    ) -> subprocess.Popen[str] | EngineProcess | None:
+        """Run one docker invocation, stream its output, return the finished process.
+
+        Phase lines (see ``build.parse_phase``) are shown as the phase's
+        status and duration.
+
+        Returns None if the container couldn't be started. Called from inside
+        the @work thread; uses call_from_thread for any UI state changes (log
+        writes, border title, running-proc handle).
         """
         self.call_from_thread(self._set_log_phase, label)
-        proc = _spawn(cmd)
+        try:
+            proc = _spawn(spec)
+        except (OSError, DockerEngineError) as e:
+            self.call_from_thread(self._log_line, f"[red]error:[/] {e}")
+            return None
         self.call_from_thread(self._set_running_proc, proc)
         for line in _stream_proc(proc):
-            self.call_from_thread(self._log_line, line)
+            phase = parse_phase(line)
+            if phase is None:
+                self.call_from_thread(self._log_line, line)
+                continue
+            self.call_from_thread(self._log_phase_result, phase)
         return proc
 
     def _set_log_phase(self, label: str) -> None:
@@ -282,11 +421,11 @@ class MpBuildApp(App):
         log.border_title = label
         log.write(f"[bold cyan][{label}][/]")
 
-    def _set_running_proc(self, proc: subprocess.Popen[str]) -> None:
+    def _set_running_proc(self, proc: subprocess.Popen[str] | EngineProcess) -> None:
         self._running_proc = proc
         self._refresh_action_state()
 
-    def _on_build_finished(self, proc: subprocess.Popen[str]) -> None:
+    def _on_build_finished(self, proc: subprocess.Popen[str] | EngineProcess) -> None:
         # Identity check: only clear if we still own this proc. A late callback
         # from a terminated build mustn't trample a freshly started one.
         if self._running_proc is proc:
@@ -308,6 +447,10 @@ class MpBuildApp(App):
             except subprocess.TimeoutExpired:
                 pass
 
+    def _log_phase_result(self, phase: PhaseResult) -> None:
+        status = "[green]ok[/]" if phase.ok else f"[red]exit {phase.returncode}[/]"
+        self._log_line(f"[bold]{phase.name}:[/] {status} ({phase.duration:.1f}s)")
+
     def _log_line(self, text: str) -> None:
         self.query_one("#build-log", RichLog).write(text)
 
@@ -0,0 +1,185 @@
+"""
+Share one pool of make jobs between every build on the machine.
+
+Each build used to run ``make -j <cpus>``, so two builds at once, from a
+batch or from two mpbuild processes, ran twice as many compilers as there
+are CPUs. Instead mpbuild hosts a GNU make jobserver: a FIFO under
+``cache_dir()`` holding one byte per job token. Every build opens it on fd 3
+and runs make with ``--jobserver-auth=3,3``, which make (3.78 onwards) and
+every sub-make it starts take a token from before running a job, and put
+back after. The total across all builds is then the number of tokens, plus
+one per running build: make always runs one job without a token.
+
+The FIFO is bind-mounted into the build containers. Its contents only live
+while some process has it open, so each mpbuild process keeps it open while
+it runs, and the first one to open it (the only holder of the lock) fills it
+with tokens. Tokens held by a build that was killed are recovered once no
+mpbuild process is left.
+
+MPBUILD_JOBSERVER sets the number of tokens (default: ``available_cpus()``),
+or turns the jobserver off with 0. It is only used on Linux, where FIFOs can
+be shared with containers.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import functools
+import math
+import os
+import stat
+import sys
+from contextlib import suppress
+from pathlib import Path
+
+from .state import cache_dir
+
+JOBSERVER_ENV = "MPBUILD_JOBSERVER"
+
+# Where the FIFO is mounted in the build container.
+JOBSERVER_MOUNT = "/mpbuild-jobserver"
+
+# The file descriptor builds open the FIFO on.
+JOBSERVER_FD = 3
+
+
+def _cgroup_quota(directory: Path) -> float | None:
+    """
+    The CPU limit (in CPUs) of the cgroup at ``directory``, if it has one.
+    """
+    with suppress(OSError, ValueError):
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        quota, period = (directory / "cpu.max").read_text().split()
+        return None if quota == "max" else int(quota) / int(period)
+    with suppress(OSError, ValueError):
+        # cgroup v1: a quota of -1 means no limit
+        quota_us = int((directory / "cpu.cfs_quota_us").read_text())
+        period_us = int((directory / "cpu.cfs_period_us").read_text())
+        return quota_us / period_us if quota_us > 0 and period_us > 0 else None
+    return None
+
+
+def _cgroup_cpu_limit(
+    root: Path = Path("/sys/fs/cgroup"), membership: Path = Path("/proc/self/cgroup")
+) -> float | None:
+    """
+    The tightest CPU quota on this process's cgroup or any of its parents,
+    None if there isn't one.
+    """
+    try:
+        lines = membership.read_text().splitlines()
+    except OSError:
+        return None
+    candidates: list[Path] = []
+    for line in lines:
+        _, controllers, path = line.split(":", 2)
+        if controllers == "":
+            base = root  # cgroup v2
+        elif "cpu" in controllers.split(","):
+            base = root / "cpu" if (root / "cpu").is_dir() else root / controllers
+        else:
+            continue
+        directory = base / path.lstrip("/")
+        candidates += [directory, *directory.parents]
+        # In a container the cgroup namespace makes the root the own group.
+        candidates.append(base)
+    limits = [
+        q for d in candidates if d.is_relative_to(root) and (q := _cgroup_quota(d)) is not None
+    ]
+    return min(limits, default=None)
+
+
+def available_cpus() -> int:
+    """
+    Returns how many CPUs this process may use: the CPUs it is allowed to
+    run on, capped by any cgroup CPU quota (as set by ``docker run --cpus``
+    or a CI runner's limits).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+def jobserver_tokens() -> int:
+    """
+    The number of job tokens from MPBUILD_JOBSERVER, 0 if the jobserver is
+    turned off.
+    """
+    value = os.environ.get(JOBSERVER_ENV, "").strip()
+    if not value:
+        return available_cpus()
+    try:
+        return max(0, int(value))
+    except ValueError:
+        raise ValueError(f"{JOBSERVER_ENV}={value} is not a number of jobs") from None
+
+
+class Jobserver:
+    """
+    The machine's jobserver FIFO, held open by this process (see the module
+    docstring).
+    """
+
+    def __init__(self, directory: Path, tokens: int):
+        self.path = directory / "jobserver"
+        self.tokens = tokens
+        self._lock_path = directory / "jobserver.lock"
+        self._lock: int | None = None
+        self._fifo: int | None = None
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another mpbuild process holds it open and has filled it.
+            fcntl.flock(self._lock, fcntl.LOCK_SH)
+            self._fifo = os.open(self.path, os.O_RDWR)
+            return
+
+        with suppress(FileNotFoundError):
+            if not stat.S_ISFIFO(os.lstat(self.path).st_mode):
+                os.unlink(self.path)
+        if not self.path.exists():
+            os.mkfifo(self.path, 0o600)
+        self._fifo = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        with suppress(BlockingIOError):
+            while os.read(self._fifo, 4096):
+                pass
+        # make runs one job without a token, so a single build gets exactly
+        # ``tokens`` jobs, like ``make -j <tokens>``.
+        os.write(self._fifo, b"+" * max(0, self.tokens - 1))
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+
+    def close(self) -> None:
+        for fd in (self._fifo, self._lock):
+            if fd is not None:
+                os.close(fd)
+        self._fifo = self._lock = None
+
+
+@functools.cache
+def shared_jobserver() -> Jobserver | None:
+    """
+    Opens the machine's jobserver for the rest of this process. None if it
+    is turned off or can't be set up, in which case builds fall back to
+    ``make -j``.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    tokens = jobserver_tokens()
+    if tokens == 0:
+        return None
+    jobserver = Jobserver(cache_dir(), tokens)
+    try:
+        jobserver.open()
+    except OSError:
+        jobserver.close()
+        return None
+    return jobserver
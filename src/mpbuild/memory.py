@@ -0,0 +1,170 @@
+"""
+Keep concurrent builds within the machine's memory.
+
+Ports differ a lot in how much memory a build takes: an esp32 (ESP-IDF)
+build peaks at several times what an stm32 build does. Batch builds (see
+batch.py) estimate each build's peak from its port and only start it while
+the estimates of the builds already running plus its own fit in the memory
+budget. A build whose estimate is bigger than the whole budget still runs,
+on its own.
+
+The estimates start from ``DEFAULT_PORT_MEMORY`` and are then replaced by
+what builds of the port actually used: a batch build's container reports
+its cgroup's peak memory as it exits, and the last few peaks per port are
+kept in ``cache_dir()/memory.json``.
+
+Each container also gets a ``--memory`` limit of twice its estimate (at most
+the budget), so a build that runs away is OOM-killed on its own instead of
+taking the machine down with it.
+
+MPBUILD_MEMORY_BUDGET (for example ``12G``) sets the budget; it defaults to
+85% of the physical memory. ``0`` turns this off.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+
+from .state import cache_dir, read_json, write_json
+
+MEMORY_BUDGET_ENV = "MPBUILD_MEMORY_BUDGET"
+
+MIB = 1024**2
+GIB = 1024**3
+
+# Peak memory of one build of a port, until builds of it have been measured.
+DEFAULT_PORT_MEMORY = {
+    "esp32": 4 * GIB,
+    "esp8266": 2 * GIB,
+    "rp2": 2 * GIB,
+    "stm32": 1536 * MIB,
+    "webassembly": 2 * GIB,
+}
+DEFAULT_MEMORY = 1 * GIB
+
+# How many measured peaks per port the estimate is taken from.
+MEMORY_HISTORY = 5
+
+MEMORY_MODEL_VERSION = 1
+
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?", re.IGNORECASE)
+
+
+def parse_size(text: str) -> int:
+    """
+    Returns the number of bytes in ``text``: a number with an optional K, M,
+    G or T suffix (powers of 1024), like docker's ``--memory``.
+
+    Raises:
+        ValueError: If ``text`` isn't a size.
+    """
+    match = _SIZE_RE.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f"'{text}' is not a size, like 512M or 12G")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmgt".index(unit.lower() or " "))
+
+
+def format_size(size: int) -> str:
+    return f"{size / GIB:.1f}G" if size >= GIB else f"{size // MIB}M"
+
+
+def physical_memory() -> int | None:
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return None
+
+
+def default_memory_budget() -> int | None:
+    """
+    The memory budget for concurrent builds, in bytes, from
+    MPBUILD_MEMORY_BUDGET or 85% of the physical memory. None if it's turned
+    off or the machine's memory isn't known.
+
+    Raises:
+        ValueError: If MPBUILD_MEMORY_BUDGET isn't a size.
+    """
+    value = os.environ.get(MEMORY_BUDGET_ENV, "").strip()
+    if value:
+        return parse_size(value) or None
+    total = physical_memory()
+    return int(total * 0.85) if total else None
+
+
+def memory_limit(estimate: int, budget: int | None) -> int:
+    """
+    The ``--memory`` limit of a build estimated to need ``estimate``.
+    """
+    return min(2 * estimate, budget) if budget else 2 * estimate
+
+
+class MemoryModel:
+    """
+    The estimated peak memory of a build per port, refined from the peaks
+    builds report (see the module docstring). Safe to use from several
+    threads.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path or cache_dir() / "memory.json"
+        self._lock = threading.Lock()
+        self._peaks = self._load()
+
+    def _load(self) -> dict[str, list[int]]:
+        data = read_json(self.path)
+        if not isinstance(data, dict) or data.get("version") != MEMORY_MODEL_VERSION:
+            return {}
+        ports = data.get("ports")
+        return ports if isinstance(ports, dict) else {}
+
+    def estimate(self, port: str) -> int:
+        """
+        The biggest of the port's recent peaks, so an estimate goes up as
+        soon as a build needs more and only comes down once the heavy builds
+        have aged out.
+        """
+        with self._lock:
+            peaks = self._peaks.get(port)
+        return max(peaks) if peaks else DEFAULT_PORT_MEMORY.get(port, DEFAULT_MEMORY)
+
+    def record(self, port: str, peak: int) -> None:
+        with self._lock:
+            # Take in what other mpbuild processes recorded meanwhile.
+            self._peaks = self._load()
+            self._peaks[port] = [*self._peaks.get(port, []), peak][-MEMORY_HISTORY:]
+            write_json(self.path, {"version": MEMORY_MODEL_VERSION, "ports": self._peaks})
+
+
+class MemoryBudget:
+    """
+    Admits builds while their estimated memory fits in ``budget`` bytes.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, estimate: int) -> Generator[None, None, None]:
+        """
+        Waits until ``estimate`` bytes fit next to what's already reserved,
+        or nothing is, and holds them until the block exits.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.reserved == 0 or self.reserved + estimate <= self.budget
+            )
+            self.reserved += estimate
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved -= estimate
+                self._condition.notify_all()
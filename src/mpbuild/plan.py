@@ -0,0 +1,248 @@
+"""
+Show what a build would do without running it.
+
+`build_plan` expands a selection of boards into the same docker commands
+`build`/`build-many` would run, along with the image each needs, the mounts,
+the make phases that would run and which caches would be hit. The plan is
+worked out from a single `BuildContext` with a static tree, so the git and
+filesystem checks behind it happen once for the whole selection rather than
+once per board; planning every board takes well under a second.
+
+Each target comes with its expected build time (see history.py), and
+``--shard I/N`` plans only that CI machine's part of the selection (see
+``batch.shard_targets``).
+
+Planning only reads: the ccache directory a command would mount, for
+example, is named in it but not created.
+
+The commands are for the plain ``docker run --rm`` form (or podman's, or
+the host's bash for the native runtime), whatever MPBUILD_REUSE_CONTAINER
+says, so CI can run them as they are.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+from . import Runtime, board_database, find_mpy_root
+from .batch import (
+    BuildTarget,
+    MpbuildBatchException,
+    parse_shard,
+    select_targets,
+    shard_targets,
+)
+from .build import (
+    CMAKE_PORTS,
+    BuildContext,
+    MpbuildNotSupportedException,
+    build_directory,
+    docker_build_spec,
+)
+from .history import DurationHistory
+from .results import cache_key, lookup, source_state
+
+PLAN_VERSION = 1
+
+
+def plan_target(
+    target: BuildTarget,
+    context: BuildContext,
+    state: dict | None,
+    extra_args: list[str] | None = None,
+    build_container_override: str | None = None,
+    ccache: bool = False,
+    history: DurationHistory | None = None,
+) -> dict:
+    """
+    Returns the plan for one target: how it would be built, what would be
+    skipped and how long it's expected to take. ``state`` is the
+    ``results.source_state`` of the tree.
+    """
+    if history is None:
+        history = DurationHistory()
+    board, variant = target.board, target.variant
+    extra_args = extra_args or []
+    image = context.image(board, variant, build_container_override)
+    spec = docker_build_spec(
+        board,
+        variant,
+        extra_args,
+        build_container_override=build_container_override,
+        docker_interactive=False,
+        reuse_container=False,
+        ccache=ccache,
+        context=context,
+        prepare=False,
+    )
+
+    mpy_cross: bool | None = None
+    if board.port.name not in CMAKE_PORTS:
+        mpy_cross = context.mpy_cross_current(image)
+    submodules = context.submodules_current(board, variant)
+    key = None if state is None else cache_key(state, board, variant, extra_args, image)
+
+    phases = []
+    if board.port.name == "webassembly":
+        phases.append("ci-setup")
+    if mpy_cross is False:
+        phases.append("mpy-cross")
+    if not submodules:
+        phases.append("submodules")
+    phases.append("build")
+
+    idf_version = None
+    if board.port.name == "esp32" and not build_container_override:
+        idf_version = image.rpartition(":")[2] or None
+
+    return {
+        "target": str(target),
+        "port": board.port.name,
+        "board": board.name,
+        "variant": variant,
+        "image": image,
+        "idf_version": idf_version,
+        "command": spec.command(),
+        "argv": spec.argv(),
+        "mounts": [{"source": source, "target": target} for source, target in spec.mounts],
+        "phases": phases,
+        "build_dir": str(build_directory(board, variant)),
+        "expected_duration": round(history.estimate(str(target), board.port.name), 1),
+        "result_key": key,
+        "cache": {
+            "result": key is not None and lookup(key),
+            "mpy_cross": mpy_cross,
+            "submodules": submodules,
+        },
+    }
+
+
+def build_plan(
+    targets: list[BuildTarget],
+    mpy_dir: Path,
+    extra_args: list[str] | None = None,
+    build_container_override: str | None = None,
+    ccache: bool = False,
+    runtime: Runtime | None = None,
+    history: DurationHistory | None = None,
+    shard: tuple[int, int] | None = None,
+) -> dict:
+    """
+    Returns the plan for ``targets`` as a JSON-serialisable dict. ``shard``
+    records which shard of the selection they are.
+
+    Raises:
+        MpbuildNotSupportedException: If planning native builds and a
+            target's toolchain isn't installed.
+    """
+    context = BuildContext.create(mpy_dir, static_tree=True, runtime=runtime)
+    state = source_state(mpy_dir)
+    if history is None:
+        history = DurationHistory()
+    planned = [
+        plan_target(t, context, state, extra_args, build_container_override, ccache, history)
+        for t in targets
+    ]
+    images: list[str] = []
+    for p in planned:
+        if p["image"] not in images:
+            images.append(p["image"])
+    return {
+        "version": PLAN_VERSION,
+        "mpy_dir": str(mpy_dir),
+        "runtime": context.runtime.value,
+        "shard": f"{shard[0]}/{shard[1]}" if shard else None,
+        "expected_duration": round(sum(p["expected_duration"] for p in planned), 1),
+        "images": images,
+        "targets": planned,
+    }
+
+
+def print_plan(
+    names: list[str] | None = None,
+    port: str | None = None,
+    all_boards: bool = False,
+    as_json: bool = False,
+    extra_args: list[str] | None = None,
+    build_container_override: str | None = None,
+    mpy_dir: str | Path | None = None,
+    ccache: bool = False,
+    runtime: Runtime | None = None,
+    shard: str | None = None,
+    durations: Path | None = None,
+) -> dict:
+    """
+    Prints the build plan for a selection of boards, as a table or as JSON.
+
+    ``shard`` (``I/N``) plans only that part of the selection, split by the
+    durations in ``durations`` (default: each port's default duration), see
+    ``batch.shard_targets``. The expected durations shown are from
+    ``durations`` or else this machine's history.
+
+    This command writes to stdout and exits the program with status 1 if the
+    selection is invalid or empty.
+    """
+    console = Console()
+    mpy_dir, _ = find_mpy_root(mpy_dir)
+    db = board_database(mpy_dir)
+
+    try:
+        targets = select_targets(db, names or [], port=port, all_boards=all_boards)
+    except MpbuildBatchException as e:
+        console.print(e)
+        raise SystemExit(1) from e
+    if not targets:
+        console.print("Nothing to plan: give board names, --port or --all")
+        raise SystemExit(1)
+
+    history = DurationHistory(durations)
+    shard_of = None
+    if shard is not None:
+        try:
+            shard_of = parse_shard(shard)
+        except ValueError as e:
+            console.print(e)
+            raise SystemExit(1) from e
+        split = history if durations else DurationHistory.defaults()
+        targets = shard_targets(targets, *shard_of, split)
+
+    try:
+        plan = build_plan(
+            targets,
+            Path(db.mpy_root_directory),
+            extra_args=extra_args,
+            build_container_override=build_container_override,
+            ccache=ccache,
+            runtime=runtime,
+            history=history,
+            shard=shard_of,
+        )
+    except MpbuildNotSupportedException as e:
+        console.print(e)
+        raise SystemExit(1) from e
+    if as_json:
+        print(json.dumps(plan, indent=2))
+        return plan
+
+    title = f"Build plan ({len(targets)} target(s), {len(plan['images'])} image(s)"
+    title += f", shard {plan['shard']})" if plan["shard"] else ")"
+    table = Table(title=title)
+    table.add_column("Target")
+    table.add_column("Image")
+    table.add_column("Phases")
+    table.add_column("Cached")
+    table.add_column("Expected", justify="right")
+    for p in plan["targets"]:
+        table.add_row(
+            p["target"],
+            p["image"],
+            ", ".join(p["phases"]),
+            "[green]yes[/]" if p["cache"]["result"] else "no",
+            f"{p['expected_duration']:.0f}s",
+        )
+    console.print(table)
+    return plan
@@ -0,0 +1,258 @@
+"""
+Reuse firmware from an earlier build of exactly the same inputs.
+
+Before a build, mpbuild computes a key from everything that decides its
+output: the source tree (git tree of HEAD plus the contents of every modified
+or untracked file), the board, variant, extra make arguments and the build
+image. After a successful build the firmware files are copied into a
+content-addressed store under ``cache_dir()/results`` and recorded against
+that key. The next build with the same key copies them back into the build
+directory instead of running docker.
+
+A native build has no image, so the version of the host's toolchain (see
+``build.NATIVE_TOOLCHAINS``) goes into the key instead. Native builds of a
+port with no toolchain listed there aren't cached.
+
+Only builds whose extra make arguments are all ``VAR=value`` assignments
+are cached: a make goal such as ``deploy`` or ``erase`` has to run every
+time. Files and directories the values name are hashed as part of the key,
+and a value naming one outside the MicroPython tree (an out-of-tree
+``FROZEN_MANIFEST`` or ``USER_C_MODULES``) leaves the build uncached.
+
+Only the firmware files (see ``build.FIRMWARE_PATTERNS``) are kept, not the
+whole build directory, so a restored build directory is complete enough to
+deploy but a later incremental build starts from scratch.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from contextlib import suppress
+from pathlib import Path
+
+from .board_database import Board
+from .build import NATIVE_IMAGE, build_directory, firmware_artifacts, native_toolchain_version
+from .state import cache_dir, read_json, write_json
+
+RESULT_CACHE_VERSION = 1
+
+_ASSIGNMENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*=.*", re.DOTALL)
+
+
+def results_dir() -> Path:
+    return cache_dir() / "results"
+
+
+def _git(mpy_dir: Path, *args: str) -> str | None:
+    try:
+        proc = subprocess.run(
+            ["git", *args], cwd=mpy_dir, capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return proc.stdout if proc.returncode == 0 else None
+
+
+def _hash_file(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def source_state(mpy_dir: Path) -> dict | None:
+    """
+    Describes the state of the source tree: the tree hash of HEAD and a
+    hash per modified, added or untracked file (git-ignored files, such as
+    build directories, don't count).
+
+    Returns None if the state can't be pinned down, in which case builds are
+    not cached: ``mpy_dir`` isn't a git checkout, or a submodule has local
+    changes.
+    """
+    tree = _git(mpy_dir, "rev-parse", "HEAD^{tree}")
+    status = _git(mpy_dir, "status", "--porcelain", "-z", "--untracked-files=all")
+    if tree is None or status is None:
+        return None
+
+    dirty: dict[str, str] = {}
+    entries = iter(status.split("\0"))
+    for entry in entries:
+        if not entry:
+            continue
+        if entry[0] in "RC":
+            next(entries, None)  # the rename/copy source follows
+        name = entry[3:]
+        path = mpy_dir / name
+        if path.is_dir():
+            # A submodule checked out at another commit. Fine as long as it
+            # has no changes of its own.
+            head = _git(path, "rev-parse", "HEAD")
+            if head is None or _git(path, "status", "--porcelain") != "":
+                return None
+            dirty[name] = f"commit:{head.strip()}"
+        elif path.exists():
+            dirty[name] = _hash_file(path)
+        else:
+            dirty[name] = "deleted"
+    return {"tree": tree.strip(), "dirty": dirty}
+
+
+def _argument_files(board: Board, extra_args: list[str]) -> dict[str, str] | None:
+    """
+    Returns a hash per file that the values of ``extra_args`` name, relative
+    to the MicroPython tree. Relative paths are taken from the port's
+    directory, where make runs.
+
+    Returns None if the build can't be cached: an argument isn't a
+    ``VAR=value`` assignment, or names a path outside the tree.
+    """
+    mpy_dir = board.port.directory_repo.resolve()
+    files: dict[str, str] = {}
+    for arg in extra_args:
+        if not _ASSIGNMENT_RE.fullmatch(arg):
+            return None
+        for word in arg.partition("=")[2].split():
+            path = board.port.directory / word
+            if not path.exists():
+                continue
+            path = path.resolve()
+            if not path.is_relative_to(mpy_dir):
+                return None
+            named = [path] if path.is_file() else sorted(path.rglob("*"))
+            for f in named:
+                if f.is_file():
+                    files[str(f.relative_to(mpy_dir))] = _hash_file(f)
+    return files
+
+
+def cache_key(
+    state: dict,
+    board: Board,
+    variant: str | None,
+    extra_args: list[str],
+    build_container: str,
+) -> str | None:
+    """
+    Returns the key for building ``board``/``variant`` from ``state`` (see
+    ``source_state``) with ``extra_args`` in ``build_container``, or None if
+    the build mustn't be cached (see ``_argument_files``). A native build
+    (``NATIVE_IMAGE``) is keyed on the toolchain's version instead, and isn't
+    cached if that's unknown.
+    """
+    toolchain = None
+    if build_container == NATIVE_IMAGE:
+        toolchain = native_toolchain_version(board.port.name)
+        if toolchain is None:
+            return None
+    try:
+        argument_files = _argument_files(board, extra_args)
+    except OSError:
+        return None
+    if argument_files is None:
+        return None
+    inputs = {
+        "version": RESULT_CACHE_VERSION,
+        "source": state,
+        "port": board.port.name,
+        "board": board.name,
+        "variant": variant,
+        "extra_args": extra_args,
+        "argument_files": argument_files,
+        "image": build_container,
+    }
+    if toolchain is not None:
+        inputs["toolchain"] = toolchain
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _manifest_path(key: str) -> Path:
+    return results_dir() / "keys" / f"{key}.json"
+
+
+def _object_path(digest: str) -> Path:
+    return results_dir() / "objects" / digest[:2] / digest
+
+
+def store(key: str, board: Board, variant: str | None = None) -> bool:
+    """
+    Records the firmware files of a build that just succeeded under ``key``.
+    Returns False if there was nothing to store or the cache isn't writable.
+    """
+    directory = build_directory(board, variant)
+    files = []
+    try:
+        for path in firmware_artifacts(board, variant):
+            digest = _hash_file(path)
+            target = _object_path(digest)
+            if not target.is_file():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp = target.with_name(f".{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+                try:
+                    shutil.copyfile(path, tmp)
+                    os.replace(tmp, target)
+                finally:
+                    with suppress(OSError):
+                        tmp.unlink()
+            files.append(
+                {
+                    "name": str(path.relative_to(directory)),
+                    "sha256": digest,
+                    "mode": path.stat().st_mode & 0o777,
+                }
+            )
+    except OSError:
+        return False
+    if not files:
+        return False
+    return write_json(_manifest_path(key), {"version": RESULT_CACHE_VERSION, "files": files})
+
+
+def _manifest_files(key: str) -> list[dict] | None:
+    """
+    Returns the files recorded under ``key`` if they are all in the store.
+    """
+    manifest = read_json(_manifest_path(key))
+    if not isinstance(manifest, dict) or manifest.get("version") != RESULT_CACHE_VERSION:
+        return None
+    files = manifest.get("files", [])
+    if not files or not all(_object_path(f["sha256"]).is_file() for f in files):
+        return None
+    return files
+
+
+def lookup(key: str) -> bool:
+    """
+    True if ``restore`` would find a result for ``key``.
+    """
+    return _manifest_files(key) is not None
+
+
+def restore(key: str, board: Board, variant: str | None = None) -> list[Path] | None:
+    """
+    Copies the firmware files recorded under ``key`` into the build
+    directory. Returns their paths, most useful first (the order ``store``
+    found them in), or None on a cache miss.
+    """
+    files = _manifest_files(key)
+    if files is None:
+        return None
+
+    directory = build_directory(board, variant)
+    restored = []
+    try:
+        for f in files:
+            target = directory / f["name"]
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            shutil.copyfile(_object_path(f["sha256"]), tmp)
+            tmp.chmod(f["mode"])
+            os.replace(tmp, target)
+            restored.append(target)
+    except OSError:
+        return None
+    return restored
@@ -0,0 +1,69 @@
+"""
+Start a build with the runtime its `ContainerSpec` names.
+
+- docker: through the Docker Engine API when the daemon's socket is
+  reachable (see docker_engine.py), else the docker CLI.
+- podman: the podman CLI, which takes the same options. Rootless podman maps
+  the host user into the container with ``--userns=keep-id``.
+- native: no container. The build steps run in bash on the host, in the
+  MicroPython checkout, with the host's toolchain. There is no container to
+  start and no bind mounts, which is what makes small incremental builds on a
+  machine with the toolchains installed fast.
+
+The CLIs are run as argv lists, without a shell. Whatever runs the build,
+`spawn` returns an object with the parts of the ``subprocess.Popen`` interface
+the callers use: ``stdout``, ``poll``, ``wait``, ``terminate`` and ``kill``.
+"""
+
+from __future__ import annotations
+
+import subprocess
+from typing import IO, Any
+
+from . import Runtime
+from .build import ContainerSpec
+from .docker_engine import EngineProcess, engine_from_env
+
+
+def _start_pool_cli(spec: ContainerSpec) -> None:
+    inspect = subprocess.run(
+        [spec.runtime.value, "container", "inspect", spec.pool_name],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=False,
+    )
+    if inspect.returncode != 0:
+        # Losing a race to start it is harmless, see ContainerSpec.command().
+        subprocess.run(
+            spec.keepalive_argv(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False
+        )
+
+
+def spawn(
+    spec: ContainerSpec,
+    stdout: int | IO[Any] | None = None,
+    text: bool = False,
+) -> subprocess.Popen | EngineProcess:
+    """
+    Starts the build ``spec`` describes. stderr goes wherever ``stdout``
+    does (see ``EngineProcess``).
+
+    Raises DockerEngineError if the docker daemon refuses to create or start
+    the container, and OSError if the CLI (or natively, bash) can't be run.
+    """
+    if spec.runtime == Runtime.docker and not spec.interactive:
+        engine = engine_from_env()
+        if engine is not None:
+            return EngineProcess(engine, spec, stdout=stdout, text=text)
+    if spec.reuse_container:
+        _start_pool_cli(spec)
+    return subprocess.Popen(
+        spec.argv(),
+        cwd=spec.workdir if spec.runtime == Runtime.native else None,
+        stdin=None if spec.interactive else subprocess.DEVNULL,
+        stdout=stdout,
+        stderr=None if stdout is None else subprocess.STDOUT,
+        text=text,
+        bufsize=1 if text else -1,
+    )
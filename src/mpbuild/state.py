@@ -0,0 +1,71 @@
+"""
+On-disk state that mpbuild keeps between runs.
+
+Everything lives under a single per-user directory (see ``cache_dir``) so it
+can be inspected or wiped in one go. The helpers here only use the standard
+library and are cheap to import: the board index is read on every process
+start, including shell completion.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+
+
+def cache_dir() -> Path:
+    """
+    Returns the directory mpbuild stores its persistent state in.
+
+    Resolution order:
+
+    1. ``MPBUILD_CACHE_DIR``
+    2. ``$XDG_CACHE_HOME/mpbuild``
+    3. ``~/.cache/mpbuild``
+
+    The directory is not created here; writers create what they need.
+    """
+    override = os.environ.get("MPBUILD_CACHE_DIR")
+    if override:
+        return Path(override)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    base = Path(xdg) if xdg else Path.home() / ".cache"
+    return base / "mpbuild"
+
+
+def read_json(path: Path, default: Any = None) -> Any:
+    """
+    Returns the decoded contents of ``path``, or ``default`` if the file is
+    missing or unreadable. A corrupt cache file is treated the same as a
+    missing one.
+    """
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: Path, data: Any) -> bool:
+    """
+    Atomically replaces ``path`` with ``data`` encoded as JSON.
+
+    The file is written next to its destination and renamed into place, so
+    concurrent readers see either the old or the new contents, never a torn
+    write. Returns False (instead of raising) if the cache is not writable:
+    callers treat the cache as an optimisation, not a requirement.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp.open("w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError:
+        with suppress(OSError):
+            tmp.unlink()
+        return False
+    return True
@@ -0,0 +1,151 @@
+"""
+Skip ``make submodules`` when it would have nothing to do.
+
+Every build used to start with ``make -C ports/<port> BOARD=... submodules``,
+which runs ``git submodule update --init`` for the submodules the board needs.
+Even with nothing to update that costs several git round trips per
+submodule, and over a slow link it can take longer than the compile.
+
+After a successful build mpbuild records the submodule state of the checkout
+for that port/board/variant. The state is the commit recorded in the
+superproject for each submodule and the commit actually checked out. The
+next build of the same target leaves the step out while the state is
+unchanged.
+
+Skipping the step doesn't make concurrent updates safe: git locks the
+submodules' index files, so batch builds run the step for one target at a
+time, ahead of its build, and record the state straight after it (see
+``batch.build_many``).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import subprocess
+import threading
+from contextlib import suppress
+from pathlib import Path
+
+from .board_database import Board
+from .state import cache_dir
+
+# Passed to git as submodule.fetchJobs when the step does run, so missing
+# submodules are cloned/fetched in parallel rather than one at a time.
+SUBMODULE_FETCH_JOBS = 8
+
+
+def _read_head(git_dir: Path) -> str | None:
+    """
+    Returns the commit HEAD points to in ``git_dir``, following one level of
+    symbolic ref (loose or packed).
+    """
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head.removeprefix("ref: ")
+        ref_file = git_dir / ref
+        if ref_file.is_file():
+            return ref_file.read_text().strip()
+        for line in (git_dir / "packed-refs").read_text().splitlines():
+            if line.endswith(f" {ref}"):
+                return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+def _checked_out_commit(path: Path) -> str:
+    """
+    Returns the commit checked out in the submodule at ``path``, "-" if it
+    isn't initialised and "?" if that can't be worked out without git.
+    """
+    dot_git = path / ".git"
+    if dot_git.is_dir():
+        git_dir = dot_git
+    elif dot_git.is_file():
+        try:
+            gitdir = dot_git.read_text().strip().removeprefix("gitdir: ")
+        except OSError:
+            return "?"
+        git_dir = path / gitdir
+    else:
+        return "-"
+    return _read_head(git_dir) or "?"
+
+
+def submodule_state(mpy_dir: Path) -> str | None:
+    """
+    Returns a digest of every submodule's recorded and checked-out commit,
+    or None if ``mpy_dir`` isn't a git checkout.
+    """
+    try:
+        proc = subprocess.run(
+            ["git", "ls-files", "--stage", "-z"],
+            cwd=mpy_dir,
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0:
+        return None
+
+    digest = hashlib.sha1()
+    for entry in proc.stdout.split("\0"):
+        # "<mode> <object> <stage>\t<path>"; submodules have mode 160000.
+        if not entry.startswith("160000 "):
+            continue
+        info, _, path = entry.partition("\t")
+        recorded = info.split()[1]
+        checked_out = _checked_out_commit(Path(mpy_dir) / path)
+        if checked_out == "?":
+            return None
+        digest.update(f"{path} {recorded} {checked_out}\n".encode())
+    return digest.hexdigest()
+
+
+def _stamp_path(board: Board, variant: str | None) -> Path:
+    repo = board.port.directory_repo
+    repo_key = hashlib.sha1(str(repo.resolve()).encode()).hexdigest()[:16]
+    name = f"{board.port.name}-{board.name}" + (f"-{variant}" if variant else "")
+    return cache_dir() / "submodules" / repo_key / name
+
+
+def submodules_current(board: Board, variant: str | None = None, state: str | None = None) -> bool:
+    """
+    True if the submodules haven't changed since the last successful build
+    of this board/variant, so ``make submodules`` can be skipped.
+
+    ``state`` is the current ``submodule_state``, if already known.
+    """
+    if state is None:
+        state = submodule_state(board.port.directory_repo)
+    if state is None:
+        return False
+    try:
+        return _stamp_path(board, variant).read_text().strip() == state
+    except OSError:
+        return False
+
+
+def record_submodules(board: Board, variant: str | None = None) -> None:
+    """
+    Records the current submodule state after a successful build of this
+    board/variant. The stamp is renamed into place, so a concurrent reader
+    never sees half of it.
+    """
+    state = submodule_state(board.port.directory_repo)
+    if state is None:
+        return
+    path = _stamp_path(board, variant)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(state + "\n")
+        os.replace(tmp, path)
+    except OSError:
+        with suppress(OSError):
+            tmp.unlink()
@@ -0,0 +1,311 @@
+"""
+Time each step of a build.
+
+A build used to be one opaque ``bash -c`` script, so a slow one gave no
+hint whether it was waiting for an image, fetching submodules or compiling.
+Now each step in the container runs through ``build._PHASE_FUNCTION``,
+which appends a line with its name, exit status, start and duration (see
+``build.parse_phase``) to a file of its own under
+``cache_dir()/timings``, mounted into the container. The steps, in order:
+
+- ``cache``: looking the build up in the result cache (see results.py)
+- ``images``: checking and pulling the build images (once per run)
+- ``prepare-mpy-cross``: waiting for mpy-cross to be built for the image
+  (batch builds, see ``batch.build_many``)
+- ``prepare-submodules``: waiting for and running ``make submodules``, one
+  target at a time (batch builds)
+- ``start``: from starting the container until its script runs
+- ``safe-directory``: the git ``safe.directory`` setup
+- ``ci-setup``: the port's CI environment (webassembly)
+- ``mpy-cross``, ``submodules`` and ``make``
+- ``deploy``: rendering the board's deploy instructions
+
+Steps that were left out, like an mpy-cross that is current, aren't listed.
+``write_timings_json`` saves the records of a run for other tools.
+
+A profiled build goes further and times each compile inside ``make`` (see
+``build.prepare_profiler``), to find the few sources, often generated ones
+like the qstr headers, that take the longest; ``slowest_compiles`` lists
+them.
+
+Builds in a fresh container also report what the container used, its CPU
+time, peak memory and block I/O (see ``build.ResourceUsage``), to the same
+file as they exit.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import time
+from collections.abc import Generator
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .build import (
+    CompileResult,
+    PhaseResult,
+    ResourceUsage,
+    parse_compile,
+    parse_phase,
+    profile_directory,
+)
+from .memory import format_size
+from .state import cache_dir
+
+TIMINGS_VERSION = 1
+
+SLOWEST_COMPILES = 50
+"""
+How many compiles ``slowest_compiles`` reports by default.
+"""
+
+
+@dataclass
+class BuildTimings:
+    """
+    The timed steps of one build.
+    """
+
+    target: str
+    """
+    BOARD or BOARD:VARIANT.
+    """
+    port: str
+    returncode: int = 0
+    phases: list[PhaseResult] = field(default_factory=list)
+    slot: int | None = None
+    """
+    The batch worker (from 0) that ran the build.
+    """
+    compiles: list[CompileResult] = field(default_factory=list)
+    """
+    Each compile of a profiled build.
+    """
+    usage: ResourceUsage | None = None
+    """
+    What the build's container used, over every attempt.
+    """
+
+    def as_json(self) -> dict:
+        data = {
+            "target": self.target,
+            "port": self.port,
+            "returncode": self.returncode,
+            "phases": [_phase_json(p) for p in self.phases],
+        }
+        if self.compiles:
+            data["compiles"] = [_compile_json(c) for c in self.compiles]
+        if self.usage is not None and self.usage.known:
+            data["resources"] = {
+                "cpu_seconds": self.usage.cpu_seconds,
+                "peak_memory": self.usage.peak_memory,
+                "read_bytes": self.usage.read_bytes,
+                "written_bytes": self.usage.written_bytes,
+            }
+        return data
+
+
+def _phase_json(phase: PhaseResult) -> dict:
+    return {
+        "name": phase.name,
+        "start": phase.start,
+        "duration": round(phase.duration, 6),
+        "returncode": phase.returncode,
+    }
+
+
+def _compile_json(run: CompileResult) -> dict:
+    return {
+        "file": run.file,
+        "kind": run.kind,
+        "duration": round(run.duration, 6),
+        "peak_memory": run.peak_memory,
+        "returncode": run.returncode,
+    }
+
+
+@contextmanager
+def _temporary_file(directory: Path, suffix: str) -> Generator[Path, None, None]:
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(fd)
+    path = Path(name)
+    try:
+        yield path
+    finally:
+        with suppress(OSError):
+            path.unlink()
+
+
+@contextmanager
+def phases_file() -> Generator[Path, None, None]:
+    """
+    A new, empty file under ``cache_dir()/timings`` for a build's steps to
+    append their timings to, removed again afterwards.
+    """
+    with _temporary_file(cache_dir() / "timings", ".phases") as path:
+        yield path
+
+
+@contextmanager
+def compiles_file() -> Generator[Path, None, None]:
+    """
+    A new, empty file under ``build.profile_directory()`` for a profiled
+    build's compiles to be recorded in, removed again afterwards.
+    """
+    with _temporary_file(profile_directory() / "records", ".compiles") as path:
+        yield path
+
+
+def read_phases(
+    path: Path, spawned: float, usage: ResourceUsage | None = None
+) -> list[PhaseResult]:
+    """
+    Returns the steps recorded in ``path`` by a build started at
+    ``spawned`` (Unix time), after the time it took to start, and empties
+    the file for the next attempt. What the container used goes into
+    ``usage``.
+    """
+    try:
+        lines = path.read_text().splitlines()
+        path.write_text("")
+    except OSError:
+        return []
+    phases = [p for p in map(parse_phase, lines) if p is not None]
+    if usage is not None:
+        for line in lines:
+            usage.update(line)
+    if phases and phases[0].start is not None:
+        # The host and container clocks are the same, unless the container
+        # runs in a VM (podman machine), where they may drift apart.
+        startup = max(0.0, phases[0].start - spawned)
+        phases.insert(0, PhaseResult("start", 0, startup, spawned))
+    return phases
+
+
+def read_compiles(path: Path, root: Path) -> list[CompileResult]:
+    """
+    Returns the compiles recorded in ``path``, with their files relative to
+    ``root`` (the MicroPython repository) where they're in it, and empties
+    the file for the next attempt.
+    """
+    try:
+        lines = path.read_text().splitlines()
+        path.write_text("")
+    except OSError:
+        return []
+    compiles = [c for c in map(parse_compile, lines) if c is not None]
+    for run in compiles:
+        file = os.path.normpath(run.file)
+        relative = os.path.relpath(file, root)
+        run.file = file if relative.startswith("..") else relative
+    return compiles
+
+
+@contextmanager
+def host_phase(phases: list[PhaseResult], name: str) -> Generator[None, None, None]:
+    """
+    Times a step of the build that runs on the host, adding it to
+    ``phases``. A step ended by ``SystemExit`` is recorded with its exit
+    status.
+    """
+    start = time.time()
+    returncode = 0
+    try:
+        yield
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else 1
+        raise
+    except BaseException:
+        returncode = 1
+        raise
+    finally:
+        phases.append(PhaseResult(name, returncode, time.time() - start, start))
+
+
+def format_timings(phases: list[PhaseResult]) -> str:
+    """
+    Example: "images 0.1s, start 0.6s, submodules 3.2s, make 41.3s (exit 2)"
+    """
+    return ", ".join(
+        f"{p.name} {p.duration:.1f}s" + ("" if p.ok else f" (exit {p.returncode})") for p in phases
+    )
+
+
+def phase_totals(builds: list[BuildTimings]) -> list[PhaseResult]:
+    """
+    The time spent in each step across ``builds``, in the order the steps
+    first appear.
+    """
+    totals: dict[str, PhaseResult] = {}
+    for build in builds:
+        for phase in build.phases:
+            total = totals.setdefault(phase.name, PhaseResult(phase.name, 0, 0.0))
+            total.duration += phase.duration
+            if not phase.ok:
+                total.returncode = phase.returncode
+    return list(totals.values())
+
+
+def format_usage(usage: ResourceUsage) -> str:
+    """
+    Example: "412.3s CPU, 1.4G peak memory, 12M read, 310M written"
+    """
+    parts = []
+    if usage.cpu_seconds is not None:
+        parts.append(f"{usage.cpu_seconds:.1f}s CPU")
+    if usage.peak_memory is not None:
+        parts.append(f"{format_size(usage.peak_memory)} peak memory")
+    if usage.read_bytes is not None:
+        parts.append(f"{format_size(usage.read_bytes)} read")
+    if usage.written_bytes is not None:
+        parts.append(f"{format_size(usage.written_bytes)} written")
+    return ", ".join(parts)
+
+
+def slowest_compiles(
+    builds: list[BuildTimings], count: int = SLOWEST_COMPILES
+) -> list[tuple[str, CompileResult]]:
+    """
+    The ``count`` longest compiles of ``builds``, longest first, each with
+    the target it was part of.
+    """
+    compiles = [(b.target, c) for b in builds for c in b.compiles]
+    return sorted(compiles, key=lambda tc: tc[1].duration, reverse=True)[:count]
+
+
+def format_slowest(compiles: list[tuple[str, CompileResult]], targets: bool = True) -> list[str]:
+    """
+    One line per compile, with the target it was part of unless not
+    ``targets``. Example:
+    "   12.3s   412M  preprocess  ports/stm32/build-PYBV11/genhdr/qstr.i.last  PYBV11"
+    """
+    lines = []
+    for target, run in compiles:
+        peak = format_size(run.peak_memory) if run.peak_memory is not None else "?"
+        line = f"{run.duration:7.1f}s {peak:>6}  {run.kind:<10}  {run.file}"
+        if run.returncode != 0:
+            line += f" (exit {run.returncode})"
+        lines.append(f"{line}  {target}" if targets else line)
+    return lines
+
+
+def write_timings_json(
+    path: Path, builds: list[BuildTimings], phases: list[PhaseResult] | None = None
+) -> None:
+    """
+    Writes the timed steps of ``builds`` to ``path``, along with the
+    ``phases`` done once for all of them (like ``images``).
+
+    Raises:
+        OSError: If ``path`` can't be written.
+    """
+    data = {
+        "version": TIMINGS_VERSION,
+        "phases": [_phase_json(p) for p in phases or []],
+        "builds": [b.as_json() for b in builds],
+    }
+    path.write_text(json.dumps(data, indent=2) + "\n")
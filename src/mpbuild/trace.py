@@ -0,0 +1,148 @@
+"""
+Write a build session as a trace that Perfetto (https://ui.perfetto.dev) or
+chrome://tracing opens.
+
+The trace has a track per batch worker slot, holding a span per build and,
+inside it, a span per step of the build (see timings.py): the result cache
+lookup, waiting for mpy-cross, starting the container, make and so on. The
+image check has a track of its own, and the image pulls tracks of as many
+as ran at the same time. Idle gaps in a slot and builds waiting for each
+other stand out.
+
+It is made from the timings the builds record anyway, once the session is
+over, so keeping it on in CI costs nothing while building. MPBUILD_TRACE (or
+``--trace``) names the file to write.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+from .build import PhaseResult
+from .timings import BuildTimings
+
+TRACE_ENV = "MPBUILD_TRACE"
+
+TRACE_VERSION = 1
+
+# Track (thread) ids: the session's own steps, then the image pulls, then
+# one per worker slot.
+_SESSION_TRACK = 1
+_PULL_TRACKS = 100
+_SLOT_TRACKS = 1000
+
+
+def trace_path() -> Path | None:
+    """
+    The file MPBUILD_TRACE names, if any.
+    """
+    value = os.environ.get(TRACE_ENV, "").strip()
+    return Path(value) if value else None
+
+
+def _lanes(spans: list[PhaseResult]) -> list[int]:
+    """
+    Gives each of the (timed) ``spans`` the first lane that is free when it
+    starts, so spans running at the same time get lanes of their own.
+    """
+    ends: list[float] = []
+    lanes = []
+    for span in spans:
+        assert span.start is not None
+        lane = next((i for i, end in enumerate(ends) if end <= span.start), len(ends))
+        if lane == len(ends):
+            ends.append(0.0)
+        ends[lane] = span.start + span.duration
+        lanes.append(lane)
+    return lanes
+
+
+def trace_events(
+    builds: list[BuildTimings],
+    phases: list[PhaseResult] | None = None,
+    pulls: list[PhaseResult] | None = None,
+) -> list[dict]:
+    """
+    The trace events of a session: its ``builds``, the ``phases`` done once
+    for all of them (like ``images``) and the image ``pulls``. Steps without
+    a start time are left out.
+    """
+    phases = [p for p in phases or [] if p.start is not None]
+    pulls = sorted((p for p in pulls or [] if p.start is not None), key=lambda p: p.start or 0)
+    starts = [p.start for p in [*phases, *pulls, *(p for b in builds for p in b.phases)]]
+    if not any(s is not None for s in starts):
+        return []
+    origin = min(s for s in starts if s is not None)
+
+    events: list[dict] = [
+        {"ph": "M", "pid": 1, "name": "process_name", "args": {"name": "mpbuild"}}
+    ]
+    tracks: dict[int, str] = {}
+
+    def span(name: str, category: str, track: int, start: float, end: float, args: dict) -> None:
+        events.append(
+            {
+                "ph": "X",
+                "pid": 1,
+                "tid": track,
+                "name": name,
+                "cat": category,
+                "ts": round((start - origin) * 1e6),
+                "dur": round((end - start) * 1e6),
+                "args": args,
+            }
+        )
+
+    def step(phase: PhaseResult, track: int, category: str = "step") -> None:
+        assert phase.start is not None
+        end = phase.start + phase.duration
+        span(phase.name, category, track, phase.start, end, {"returncode": phase.returncode})
+
+    for phase in phases:
+        tracks[_SESSION_TRACK] = "session"
+        step(phase, _SESSION_TRACK)
+    for pull, lane in zip(pulls, _lanes(pulls), strict=True):
+        tracks[_PULL_TRACKS + lane] = f"image pull {lane + 1}"
+        step(pull, _PULL_TRACKS + lane, "pull")
+    for build in builds:
+        timed = [p for p in build.phases if p.start is not None]
+        if not timed:
+            continue
+        slot = build.slot or 0
+        track = _SLOT_TRACKS + slot
+        tracks[track] = f"slot {slot + 1}"
+        start = min(p.start for p in timed if p.start is not None)
+        end = max(p.start + p.duration for p in timed if p.start is not None)
+        args = {"port": build.port, "returncode": build.returncode}
+        span(build.target, "build", track, start, end, args)
+        for phase in timed:
+            step(phase, track)
+
+    for track, name in sorted(tracks.items()):
+        metadata = {"ph": "M", "pid": 1, "tid": track}
+        events.append({**metadata, "name": "thread_name", "args": {"name": name}})
+        events.append({**metadata, "name": "thread_sort_index", "args": {"sort_index": track}})
+    return events
+
+
+def write_trace(
+    path: Path,
+    builds: list[BuildTimings],
+    phases: list[PhaseResult] | None = None,
+    pulls: list[PhaseResult] | None = None,
+) -> None:
+    """
+    Writes the session (see ``trace_events``) to ``path`` as a trace-event
+    JSON file.
+
+    Raises:
+        OSError: If ``path`` can't be written.
+    """
+    data = {
+        "traceEvents": trace_events(builds, phases, pulls),
+        "displayTimeUnit": "ms",
+        "otherData": {"version": TRACE_VERSION},
+    }
+    path.write_text(json.dumps(data) + "\n")
@@ -15,6 +15,35 @@ from pathlib import Path
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def _isolated_cache_dir(tmp_path_factory: pytest.TempPathFactory, monkeypatch) -> Path:
+    """Point mpbuild's persistent cache at a per-test directory.
+
+    Without this, tests would read and write the developer's real
+    ``~/.cache/mpbuild`` (board index etc.) and leak state between tests.
+    """
+    path = tmp_path_factory.mktemp("mpbuild-cache")
+    monkeypatch.setenv("MPBUILD_CACHE_DIR", str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def _no_jobserver(monkeypatch):
+    """Build without the machine's make jobserver unless a test opts in.
+
+    ``shared_jobserver`` opens the FIFO once per process, which would tie
+    every later test to the cache directory of the first one.
+    """
+    from mpbuild.jobserver import shared_jobserver
+
+    monkeypatch.setenv("MPBUILD_JOBSERVER", "0")
+    shared_jobserver.cache_clear()
+    yield
+    if shared_jobserver.cache_info().currsize and (jobserver := shared_jobserver()):
+        jobserver.close()
+    shared_jobserver.cache_clear()
+
+
 @pytest.fixture
 def mpy_root(tmp_path: Path) -> Path:
     """A minimal MicroPython repo root.
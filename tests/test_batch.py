@@ -0,0 +1,626 @@
+"""Tests for batch — target selection and the concurrent build scheduler.
+
+docker is never run: ``docker_build_spec`` and ``spawn`` are replaced with
+fakes that record what the scheduler asked for.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+import pytest
+
+from mpbuild.batch import (
+    BuildTarget,
+    MpbuildBatchException,
+    build_many,
+    build_many_boards,
+    parse_shard,
+    select_targets,
+    shard_targets,
+)
+from mpbuild.board_database import Database
+from mpbuild.build import OOM_RETRIES, ResourceUsage, get_build_container
+from mpbuild.find_boards import find_mpy_root
+from mpbuild.history import DurationHistory
+from mpbuild.memory import GIB, MemoryModel
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    from mpbuild import board_database
+
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+    yield
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+
+
+@pytest.fixture
+def db(mpy_root, make_board):
+    make_board("stm32", "PYBV11", mcu="stm32f4", variants={"DP": "Double"})
+    make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+    make_board("rp2", "RPI_PICO", mcu="rp2040")
+    make_board("qemu", "MPS2_AN385", mcu="qemu")  # no build container
+    return Database(mpy_root)
+
+
+def reports(monkeypatch, output: str) -> None:
+    """
+    Each build's container reports ``output`` to its timings file, like
+    ``build._USAGE_TRAP`` does as it exits.
+    """
+    from mpbuild import batch
+
+    fake_cmd = batch.docker_build_spec
+
+    def reporting(board, variant=None, **kwargs):
+        if kwargs.get("report_memory"):
+            with kwargs["timings_file"].open("a") as f:
+                f.write(output)
+        return fake_cmd(board, variant, **kwargs)
+
+    monkeypatch.setattr("mpbuild.batch.docker_build_spec", reporting)
+
+
+class FakePopen:
+    """Stand-in for the started container that tracks how many run at once."""
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    commands: list[str] = []
+    fail: set[str] = set()
+
+    def __init__(self, cmd, **_kwargs):
+        self.cmd = cmd
+        with FakePopen.lock:
+            FakePopen.commands.append(cmd)
+            FakePopen.active += 1
+            FakePopen.peak = max(FakePopen.peak, FakePopen.active)
+        self.terminated = False
+
+    def wait(self):
+        time.sleep(0.05)
+        with FakePopen.lock:
+            FakePopen.active -= 1
+        return 2 if any(name in self.cmd for name in FakePopen.fail) else 0
+
+    def terminate(self):
+        self.terminated = True
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    calls: list[dict] = []
+
+    def fake_cmd(board, variant=None, **kwargs):
+        calls.append(dict(board=board.name, variant=variant, **kwargs))
+        return f"build {board.name} {variant}"
+
+    FakePopen.active = FakePopen.peak = 0
+    FakePopen.commands = []
+    FakePopen.fail = set()
+    monkeypatch.setattr("mpbuild.batch.docker_build_spec", fake_cmd)
+    monkeypatch.setattr("mpbuild.batch.spawn", FakePopen)
+    # Keep the git calls behind the result cache, the submodule stamps and
+    # BuildContext out of it; tests that want the cache give a source state
+    # of their own.
+    monkeypatch.setattr("mpbuild.batch.source_state", lambda _mpy_dir: None)
+    monkeypatch.setattr("mpbuild.batch.mpy_cross_is_current", lambda *_: True)
+    monkeypatch.setattr("mpbuild.batch.record_submodules", lambda *_: None)
+    monkeypatch.setattr("mpbuild.build.BuildContext.submodules_current", lambda *_: True)
+    monkeypatch.setattr("mpbuild.batch.ensure_images", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr("mpbuild.build.get_main_git_directory", lambda _mpy_dir: None)
+    return calls
+
+
+# ===================================================================
+# select_targets
+# ===================================================================
+class TestSelectTargets:
+    def test_names_and_variants(self, db):
+        targets = select_targets(db, ["PYBV11:DP", "RPI_PICO"])
+        assert [str(t) for t in targets] == ["PYBV11:DP", "RPI_PICO"]
+        assert targets[0].variant == "DP"
+
+    def test_port_filter(self, db):
+        assert [str(t) for t in select_targets(db, port="stm32")] == ["NUCLEO_F401RE", "PYBV11"]
+
+    def test_all_skips_unsupported_ports(self, db):
+        names = [str(t) for t in select_targets(db, all_boards=True)]
+        assert "MPS2_AN385" not in names
+        assert {"PYBV11", "RPI_PICO", "unix", "windows"} <= set(names)
+
+    def test_duplicates_dropped(self, db):
+        targets = select_targets(db, ["PYBV11", "PYBV11", "PYBV11:DP"], port="stm32")
+        assert [str(t) for t in targets] == ["NUCLEO_F401RE", "PYBV11", "PYBV11:DP"]
+
+    @pytest.mark.parametrize(
+        "names, port, match",
+        [
+            (["NOPE"], None, "Invalid board"),
+            (["PYBV11:NOPE"], None, "Invalid variant"),
+            (["MPS2_AN385"], None, "not supported"),
+            ([], "nope", "Invalid port"),
+        ],
+    )
+    def test_invalid_selection(self, db, names, port, match):
+        with pytest.raises(MpbuildBatchException, match=match):
+            select_targets(db, names, port=port)
+
+    def test_slug(self, db):
+        assert BuildTarget(db.boards["PYBV11"], "DP").slug == "stm32-PYBV11-DP"
+
+
+# ===================================================================
+# build_many
+# ===================================================================
+class TestBuildMany:
+    def test_concurrency_is_bounded(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, all_boards=True)
+        results = build_many(targets, jobs=2, log_dir=tmp_path)
+        assert len(results) == len(targets)
+        assert FakePopen.peak == 2
+
+    def test_cpu_budget_split_between_jobs(self, db, fake_docker, tmp_path, monkeypatch):
+        monkeypatch.setattr("mpbuild.batch.nprocs", 8)
+        build_many(select_targets(db, port="stm32"), jobs=2, log_dir=tmp_path)
+        assert {c["make_jobs"] for c in fake_docker} == {4}
+        assert all(c["docker_interactive"] is False for c in fake_docker)
+
+    def test_ccache_forwarded(self, db, fake_docker, tmp_path):
+        build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path, ccache=True)
+        assert [c["ccache"] for c in fake_docker] == [True]
+
+    def test_unchanged_sources_restored_from_cache(self, db, fake_docker, tmp_path, monkeypatch):
+        monkeypatch.setattr("mpbuild.batch.source_state", lambda _: {"tree": "t", "dirty": {}})
+        build_dir = db.ports["rp2"].directory / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        targets = select_targets(db, ["RPI_PICO"])
+
+        [first] = build_many(targets, log_dir=tmp_path)
+        (build_dir / "firmware.uf2").unlink()
+        [second] = build_many(targets, log_dir=tmp_path)
+
+        assert not first.cached
+        assert second.cached and second.ok
+        assert len(FakePopen.commands) == 1
+        assert (build_dir / "firmware.uf2").read_bytes() == b"uf2"
+
+        [third] = build_many(targets, log_dir=tmp_path, use_cached=False)
+        assert not third.cached
+        assert len(FakePopen.commands) == 2
+
+    def test_mpy_cross_built_once_per_image(self, db, fake_docker, tmp_path, monkeypatch):
+        built: set[str] = set()
+
+        def is_current(_mpy_dir, image):
+            return image in built
+
+        def fake_cmd(board, variant=None, mpy_cross_only=False, **kwargs):
+            fake_docker.append(dict(board=board.name, mpy_cross_only=mpy_cross_only))
+            if mpy_cross_only:
+                built.add(get_build_container(board, variant))
+            return f"build {board.name} {variant}"
+
+        monkeypatch.setattr("mpbuild.batch.mpy_cross_is_current", is_current)
+        monkeypatch.setattr("mpbuild.batch.docker_build_spec", fake_cmd)
+        # PYBV11 and NUCLEO_F401RE share an image; RPI_PICO is a cmake port.
+        build_many(
+            select_targets(db, ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"]), jobs=3, log_dir=tmp_path
+        )
+        prebuilds = [c["board"] for c in fake_docker if c["mpy_cross_only"]]
+        assert len(prebuilds) == 1
+        assert prebuilds[0] in ("PYBV11", "NUCLEO_F401RE")
+        assert len(FakePopen.commands) == 4
+
+    def test_submodules_updated_one_at_a_time(self, db, fake_docker, tmp_path, monkeypatch):
+        recorded: set[tuple[str, str | None]] = set()
+        monkeypatch.setattr(
+            "mpbuild.build.BuildContext.submodules_current",
+            lambda _self, board, variant=None: (board.name, variant) in recorded,
+        )
+        monkeypatch.setattr(
+            "mpbuild.batch.record_submodules",
+            lambda board, variant=None: recorded.add((board.name, variant)),
+        )
+
+        def fake_cmd(board, variant=None, submodules_only=False, **kwargs):
+            fake_docker.append(dict(board=board.name, submodules_only=submodules_only, **kwargs))
+            return f"{'submodules' if submodules_only else 'build'} {board.name} {variant}"
+
+        monkeypatch.setattr("mpbuild.batch.docker_build_spec", fake_cmd)
+        updating = 0
+        most_updating = 0
+
+        class Updates(FakePopen):
+            def __init__(self, cmd, **kwargs):
+                nonlocal updating, most_updating
+                super().__init__(cmd, **kwargs)
+                self.update = cmd.startswith("submodules")
+                if self.update:
+                    with FakePopen.lock:
+                        updating += 1
+                        most_updating = max(most_updating, updating)
+
+            def wait(self):
+                nonlocal updating
+                returncode = super().wait()
+                if self.update:
+                    with FakePopen.lock:
+                        updating -= 1
+                return returncode
+
+        monkeypatch.setattr("mpbuild.batch.spawn", Updates)
+        targets = select_targets(db, ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"])
+        build_many(targets, jobs=3, log_dir=tmp_path)
+
+        updates = [c for c in fake_docker if c["submodules_only"]]
+        builds = [c for c in fake_docker if not c["submodules_only"]]
+        assert sorted(c["board"] for c in updates) == ["NUCLEO_F401RE", "PYBV11", "RPI_PICO"]
+        assert all(c["submodules"] is False for c in builds)
+        assert most_updating == 1
+        assert recorded == {("PYBV11", None), ("NUCLEO_F401RE", None), ("RPI_PICO", None)}
+
+        build_many(targets, jobs=3, log_dir=tmp_path)
+        assert len([c for c in fake_docker if c["submodules_only"]]) == 3
+
+    def test_failure_does_not_stop_other_targets(self, db, fake_docker, tmp_path):
+        FakePopen.fail = {"NUCLEO_F401RE"}
+        results = build_many(select_targets(db, port="stm32"), jobs=1, log_dir=tmp_path)
+        assert [(str(r.target), r.ok, r.returncode) for r in results] == [
+            ("NUCLEO_F401RE", False, 2),
+            ("PYBV11", True, 0),
+        ]
+
+    def test_results_in_target_order_with_logs(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, ["RPI_PICO", "PYBV11:DP"])
+        results = build_many(targets, jobs=2, log_dir=tmp_path)
+        assert [r.target.key for r in results] == [("RPI_PICO", None), ("PYBV11", "DP")]
+        assert results[1].log_path == tmp_path / "stm32-PYBV11-DP.log"
+        assert "build PYBV11 DP" in results[1].log_path.read_text()
+
+    def test_artifacts_collected_on_success(self, db, fake_docker, tmp_path):
+        build_dir = db.ports["rp2"].directory / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert result.artifacts == [build_dir / "firmware.uf2"]
+
+    def test_on_done_called_per_target(self, db, fake_docker, tmp_path):
+        seen = []
+        build_many(select_targets(db, port="stm32"), log_dir=tmp_path, on_done=seen.append)
+        assert sorted(str(r.target) for r in seen) == ["NUCLEO_F401RE", "PYBV11"]
+
+    def test_command_errors_become_failures(self, db, fake_docker, tmp_path, monkeypatch):
+        def broken(*_args, **_kwargs):
+            raise ValueError("bad variant")
+
+        monkeypatch.setattr("mpbuild.batch.docker_build_spec", broken)
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert not result.ok
+        assert "bad variant" in result.log_path.read_text()
+
+
+# ===================================================================
+# build_many_boards — CLI-facing wrapper
+# ===================================================================
+class TestBuildManyBoards:
+    def test_prints_summary(self, db, fake_docker, mpy_root, capsys):
+        results = build_many_boards(["PYBV11"], mpy_dir=mpy_root)
+        assert [r.ok for r in results] == [True]
+        out = capsys.readouterr().out
+        assert "Build summary" in out
+        assert "PASS" in out
+
+    def test_exits_nonzero_on_failure(self, db, fake_docker, mpy_root, capsys):
+        FakePopen.fail = {"PYBV11"}
+        with pytest.raises(SystemExit) as exc:
+            build_many_boards(["PYBV11"], mpy_dir=mpy_root)
+        assert exc.value.code == 1
+        assert "FAIL" in capsys.readouterr().out
+
+    def test_empty_selection(self, db, mpy_root):
+        with pytest.raises(SystemExit):
+            build_many_boards([], mpy_dir=mpy_root)
+
+
+# ===================================================================
+# Memory admission
+# ===================================================================
+class TestMemory:
+    def test_builds_wait_for_memory(self, db, fake_docker, tmp_path):
+        # stm32 builds are estimated at 1.5G: only one fits in 2G at a time
+        targets = select_targets(db, port="stm32")
+        build_many(targets, jobs=2, log_dir=tmp_path, memory_budget=2 * GIB)
+        assert FakePopen.peak == 1
+        assert {c["memory_limit"] for c in fake_docker} == {2 * GIB}
+
+    def test_builds_that_fit_run_together(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, port="stm32")
+        build_many(targets, jobs=2, log_dir=tmp_path, memory_budget=8 * GIB)
+        assert FakePopen.peak == 2
+        assert {c["memory_limit"] for c in fake_docker} == {3 * GIB}
+
+    def test_no_budget_no_limit(self, db, fake_docker, tmp_path):
+        build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert [c["memory_limit"] for c in fake_docker] == [None]
+        assert [c["report_memory"] for c in fake_docker] == [True]
+
+    def test_reported_peak_recorded(self, db, fake_docker, tmp_path, monkeypatch):
+        reports(monkeypatch, "mpbuild-memory-peak: 123456789\n")
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert result.peak_memory == 123456789
+        assert MemoryModel().estimate("rp2") == 123456789
+
+    def test_usage(self, db, fake_docker, mpy_root, monkeypatch, capsys):
+        reports(
+            monkeypatch,
+            "mpbuild-memory-peak: 1073741824\n"
+            "mpbuild-cpu-usec: 61500000\n"
+            "mpbuild-block-io: 1048576 10485760\n",
+        )
+        results = build_many_boards(["PYBV11", "RPI_PICO"], mpy_dir=mpy_root)
+        assert results[0].usage == ResourceUsage(GIB, 0, 61.5, 1024**2, 10 * 1024**2)
+        assert (
+            "Container usage, all builds: 123.0s CPU, 1.0G peak memory, 2M read, 20M written"
+            in capsys.readouterr().out
+        )
+
+    def test_budget_in_summary(self, db, fake_docker, mpy_root, capsys):
+        build_many_boards(["PYBV11"], mpy_dir=mpy_root, memory_budget=4 * GIB)
+        assert "within 4.0G of memory" in capsys.readouterr().out
+
+    def test_invalid_budget_from_env(self, db, fake_docker, mpy_root, monkeypatch, capsys):
+        monkeypatch.setenv("MPBUILD_MEMORY_BUDGET", "lots")
+        with pytest.raises(SystemExit):
+            build_many_boards(["PYBV11"], mpy_dir=mpy_root)
+        assert "not a size" in capsys.readouterr().out
+
+
+# ===================================================================
+# Running out of memory
+# ===================================================================
+class ScriptedPopen:
+    """A build that exits with the next of ``returncodes``."""
+
+    returncodes: list[int] = []
+
+    def __init__(self, spec, **_kwargs):
+        self.returncode = ScriptedPopen.returncodes.pop(0)
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+
+class TestOutOfMemory:
+    @pytest.fixture
+    def scripted(self, fake_docker, monkeypatch):
+        monkeypatch.setattr("mpbuild.batch.spawn", ScriptedPopen)
+        monkeypatch.setattr("mpbuild.batch.nprocs", 8)
+        return fake_docker
+
+    def test_retried_with_fewer_jobs(self, db, scripted, tmp_path):
+        ScriptedPopen.returncodes = [137, 0]
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), jobs=2, log_dir=tmp_path)
+        assert result.ok
+        assert result.oom_kills == 1
+        assert [c["make_jobs"] for c in scripted] == [8, 4]
+        assert all(c["context"].jobserver is None for c in scripted)
+        assert "retrying with make -j 4" in result.log_path.read_text()
+
+    def test_oom_kill_inside_container(self, db, scripted, tmp_path, monkeypatch):
+        # cc1 was OOM-killed, make failed normally
+        ScriptedPopen.returncodes = [2, 0]
+        reports(monkeypatch, "mpbuild-oom-kills: 1\n")
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert result.ok
+        assert result.oom_kills == 1
+
+    def test_other_failures_not_retried(self, db, scripted, tmp_path, monkeypatch):
+        ScriptedPopen.returncodes = [2]
+        reports(monkeypatch, "mpbuild-oom-kills: 0\n")
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), log_dir=tmp_path)
+        assert result.returncode == 2
+        assert result.oom_kills == 0
+        assert len(scripted) == 1
+
+    def test_gives_up(self, db, scripted, tmp_path):
+        ScriptedPopen.returncodes = [137] * (OOM_RETRIES + 1)
+        [result] = build_many(select_targets(db, ["RPI_PICO"]), jobs=1, log_dir=tmp_path)
+        assert result.returncode == 137
+        assert result.oom_kills == OOM_RETRIES + 1
+        assert [c["make_jobs"] for c in scripted] == [8, 4, 2]
+
+    def test_fewer_builds_at_once(self, db, scripted, tmp_path):
+        ScriptedPopen.returncodes = [137, 0, 0]
+        results = build_many(select_targets(db, port="stm32"), jobs=2, log_dir=tmp_path)
+        assert all(r.ok for r in results)
+        assert sum(r.oom_kills for r in results) == 1
+        assert any("1 build(s) at a time" in r.log_path.read_text() for r in results)
+
+    def test_in_summary(self, db, scripted, mpy_root, capsys):
+        ScriptedPopen.returncodes = [137, 0]
+        build_many_boards(["RPI_PICO"], mpy_dir=mpy_root, memory_budget=0)
+        out = capsys.readouterr().out
+        assert "out of memory 1x" in out
+        assert "OOM x1" in out
+
+
+# ===================================================================
+# Longest first
+# ===================================================================
+class TestLongestFirst:
+    def test_port_defaults(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, ["PYBV11", "RPI_PICO"])
+        results = build_many(targets, jobs=1, log_dir=tmp_path)
+        assert FakePopen.commands == ["build RPI_PICO None", "build PYBV11 None"]
+        assert [str(r.target) for r in results] == ["PYBV11", "RPI_PICO"]
+
+    def test_recorded_durations(self, db, fake_docker, tmp_path):
+        history = DurationHistory()
+        history.record("PYBV11", "stm32", 20)
+        history.record("NUCLEO_F401RE", "stm32", 600)
+        targets = select_targets(db, ["PYBV11", "RPI_PICO", "NUCLEO_F401RE"])
+        build_many(targets, jobs=1, log_dir=tmp_path)
+        assert FakePopen.commands == [
+            "build NUCLEO_F401RE None",
+            "build RPI_PICO None",
+            "build PYBV11 None",
+        ]
+
+    def test_successful_builds_recorded(self, db, fake_docker, tmp_path):
+        FakePopen.fail = {"NUCLEO_F401RE"}
+        build_many(select_targets(db, port="stm32"), log_dir=tmp_path)
+        history = DurationHistory()
+        assert len(history.durations("PYBV11")) == 1
+        assert 0 < history.durations("PYBV11")[0] < 5
+        assert history.durations("NUCLEO_F401RE") == []
+
+
+# ===================================================================
+# Shards
+# ===================================================================
+class TestShards:
+    @pytest.mark.parametrize(("text", "expected"), [("1/4", (1, 4)), ("03/3", (3, 3))])
+    def test_parse(self, text, expected):
+        assert parse_shard(text) == expected
+
+    @pytest.mark.parametrize("text", ["", "2", "0/4", "5/4", "1/0", "a/b"])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError, match="not a shard"):
+            parse_shard(text)
+
+    def test_partition(self, db):
+        targets = select_targets(db, ["PYBV11", "PYBV11:DP", "NUCLEO_F401RE", "RPI_PICO"])
+        shards = [shard_targets(targets, i, 3, DurationHistory()) for i in (1, 2, 3)]
+        assert sorted(str(t) for shard in shards for t in shard) == sorted(map(str, targets))
+        assert all(shards)
+
+    def test_balanced_by_recorded_durations(self, db):
+        history = DurationHistory()
+        for name, seconds in [("PYBV11", 300), ("NUCLEO_F401RE", 200), ("RPI_PICO", 100)]:
+            history.record(name, "rp2" if name == "RPI_PICO" else "stm32", seconds)
+        targets = select_targets(db, ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"])
+        first = shard_targets(targets, 1, 2, history)
+        second = shard_targets(targets, 2, 2, history)
+        assert [str(t) for t in first] == ["PYBV11"]
+        assert [str(t) for t in second] == ["NUCLEO_F401RE", "RPI_PICO"]
+
+    def test_independent_of_selection_order(self, db):
+        names = ["PYBV11", "PYBV11:DP", "NUCLEO_F401RE", "RPI_PICO"]
+        forward = select_targets(db, names)
+        backward = select_targets(db, names[::-1])
+        for i in (1, 2):
+            assert {str(t) for t in shard_targets(forward, i, 2, DurationHistory())} == {
+                str(t) for t in shard_targets(backward, i, 2, DurationHistory())
+            }
+
+    def test_covered_once_with_or_without_history(self, db):
+        targets = select_targets(db, ["PYBV11", "PYBV11:DP", "NUCLEO_F401RE", "RPI_PICO"])
+        populated = DurationHistory()
+        for name, seconds in [("PYBV11", 40), ("PYBV11:DP", 500), ("RPI_PICO", 10)]:
+            populated.record(name, "rp2" if name == "RPI_PICO" else "stm32", seconds)
+        for history in (DurationHistory.defaults(), populated):
+            for count in (1, 2, 3, 4, 5):
+                built = [
+                    str(t)
+                    for i in range(1, count + 1)
+                    for t in shard_targets(targets, i, count, history)
+                ]
+                assert sorted(built) == sorted(map(str, targets))
+
+    def test_split_ignores_local_history(self, db, fake_docker, mpy_root, capsys):
+        names = ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"]
+        defaults = [
+            [str(r.target) for r in build_many_boards(names, mpy_dir=mpy_root, shard=f"{i}/2")]
+            for i in (1, 2)
+        ]
+        history = DurationHistory()
+        for name, seconds in [("PYBV11", 900), ("NUCLEO_F401RE", 20), ("RPI_PICO", 10)]:
+            history.record(name, "rp2" if name == "RPI_PICO" else "stm32", seconds)
+        targets = select_targets(db, names)
+        assert [str(t) for t in shard_targets(targets, 1, 2, DurationHistory())] != defaults[0]
+        local = [
+            [str(r.target) for r in build_many_boards(names, mpy_dir=mpy_root, shard=f"{i}/2")]
+            for i in (1, 2)
+        ]
+        assert local == defaults
+
+    def test_build_many_boards_builds_own_shard(self, db, fake_docker, mpy_root, capsys):
+        results = build_many_boards(
+            ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"], mpy_dir=mpy_root, shard="1/3"
+        )
+        assert [str(r.target) for r in results] == ["RPI_PICO"]
+        assert "Shard 1/3: 1 of 3 target(s)" in capsys.readouterr().out
+
+    def test_build_many_boards_invalid_shard(self, db, mpy_root, capsys):
+        with pytest.raises(SystemExit) as exc:
+            build_many_boards(["PYBV11"], mpy_dir=mpy_root, shard="2/1")
+        assert exc.value.code == 1
+        assert "not a shard" in capsys.readouterr().out
+
+
+# ===================================================================
+# Timings
+# ===================================================================
+class TestTimings:
+    def test_steps_per_build(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, ["PYBV11"])
+        (result,) = build_many(targets, log_dir=tmp_path)
+        assert [p.name for p in result.phases] == [
+            "cache",
+            "prepare-mpy-cross",
+            "prepare-submodules",
+        ]
+
+    def test_timings_json(self, db, fake_docker, mpy_root, tmp_path, capsys):
+        path = tmp_path / "timings.json"
+        build_many_boards(["PYBV11", "RPI_PICO"], mpy_dir=mpy_root, timings_json=path)
+        assert "Time per step: images " in capsys.readouterr().out
+        data = json.loads(path.read_text())
+        assert [p["name"] for p in data["phases"]] == ["images"]
+        assert [b["target"] for b in data["builds"]] == ["PYBV11", "RPI_PICO"]
+
+    def test_slots(self, db, fake_docker, tmp_path):
+        targets = select_targets(db, ["PYBV11", "NUCLEO_F401RE", "RPI_PICO"])
+        results = build_many(targets, jobs=2, log_dir=tmp_path)
+        assert {r.slot for r in results} <= {0, 1}
+
+    def test_trace(self, db, fake_docker, mpy_root, tmp_path):
+        path = tmp_path / "trace.json"
+        build_many_boards(["PYBV11", "RPI_PICO"], mpy_dir=mpy_root, trace=path)
+        events = json.loads(path.read_text())["traceEvents"]
+        builds = [e["name"] for e in events if e.get("cat") == "build"]
+        assert sorted(builds) == ["PYBV11", "RPI_PICO"]
+        assert any(e["name"] == "images" for e in events)
+
+    def test_profile_compiles(self, db, fake_docker, mpy_root, monkeypatch, capsys):
+        from mpbuild import batch
+
+        fake_cmd = batch.docker_build_spec
+
+        def profiled(board, variant=None, **kwargs):
+            with kwargs["compiles_file"].open("a") as f:
+                f.write(
+                    f"mpbuild-compile: compile exited 0 after {len(board.name)}.000000s "
+                    f"peak 2048K {mpy_root}/ports/{board.port.name}/main.c\n"
+                )
+            return fake_cmd(board, variant, **kwargs)
+
+        monkeypatch.setattr("mpbuild.batch.docker_build_spec", profiled)
+        results = build_many_boards(["PYBV11", "RPI_PICO"], mpy_dir=mpy_root, profile_compiles=True)
+        out = capsys.readouterr().out
+        slowest = out[out.index("Slowest compiles:") :].splitlines()[1:]
+        assert slowest[0].split() == ["8.0s", "2M", "compile", "ports/rp2/main.c", "RPI_PICO"]
+        assert slowest[1].split()[-2:] == ["ports/stm32/main.c", "PYBV11"]
+        for result in results:
+            assert "mpbuild: slowest compiles:" in result.log_path.read_text()
@@ -2,6 +2,9 @@
 
 from __future__ import annotations
 
+import json
+import sys
+
 import pytest
 
 from mpbuild.board_database import (
@@ -10,6 +13,7 @@ from mpbuild.board_database import (
     MpbuildMpyDirectoryException,
     Port,
     Variant,
+    load_board_index,
 )
 
 
@@ -158,6 +162,106 @@ class TestDatabase:
             Database(tmp_path)
 
 
+# ===================================================================
+# load_board_index — persistent board.json index
+# ===================================================================
+class TestBoardIndex:
+    def test_returns_parsed_board_json(self, mpy_root, make_board):
+        """Keys are repo-relative board.json paths; values are the decoded JSON."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        index = load_board_index(mpy_root)
+        assert index == {"ports/stm32/boards/PYBV11/board.json": {"mcu": "stm32f4"}}
+
+    def test_index_file_written(self, mpy_root, make_board, _isolated_cache_dir):
+        """The first load persists an index under the cache dir."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        assert list((_isolated_cache_dir / "boards").glob("*.json"))
+
+    def test_warm_load_does_not_reparse(self, mpy_root, make_board, monkeypatch):
+        """Unchanged board.json files are served from the index without json.load."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+
+        def _no_open(*_args, **_kwargs):
+            raise AssertionError("board.json was re-read")
+
+        # `mpbuild.board_database` the attribute is the factory function in
+        # __init__, so reach the module through sys.modules.
+        module = sys.modules["mpbuild.board_database"]
+        monkeypatch.setattr(module, "open", _no_open, raising=False)
+        assert load_board_index(mpy_root)["ports/stm32/boards/PYBV11/board.json"] == {
+            "mcu": "stm32f4"
+        }
+
+    def test_modified_board_is_reparsed(self, mpy_root, make_board):
+        """A board.json whose size/mtime changed is re-read."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        make_board("stm32", "PYBV11", mcu="stm32f405", product="Pyboard")
+        index = load_board_index(mpy_root)
+        assert index["ports/stm32/boards/PYBV11/board.json"]["mcu"] == "stm32f405"
+
+    def test_added_and_removed_boards_detected(self, mpy_root, make_board):
+        """The directory walk picks up new boards and drops deleted ones."""
+        old = make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        (old / "board.json").unlink()
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        assert list(load_board_index(mpy_root)) == ["ports/rp2/boards/RPI_PICO/board.json"]
+
+    def test_corrupt_index_is_ignored(self, mpy_root, make_board, _isolated_cache_dir):
+        """A damaged index file is rebuilt rather than crashing."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        for f in (_isolated_cache_dir / "boards").glob("*.json"):
+            f.write_text("{not json")
+        assert "ports/stm32/boards/PYBV11/board.json" in load_board_index(mpy_root)
+
+    @pytest.mark.parametrize("content", [[], "x"], ids=["list", "string"])
+    def test_index_of_wrong_shape_is_rebuilt(
+        self, mpy_root, make_board, _isolated_cache_dir, content
+    ):
+        """Valid JSON that isn't an index is rebuilt rather than crashing."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        for f in (_isolated_cache_dir / "boards").glob("*.json"):
+            f.write_text(json.dumps(content))
+        assert "ports/stm32/boards/PYBV11/board.json" in load_board_index(mpy_root)
+
+    def test_boards_of_wrong_shape_are_rebuilt(self, mpy_root, make_board, _isolated_cache_dir):
+        """An index whose boards aren't a dict is rebuilt."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        (index_path,) = (_isolated_cache_dir / "boards").glob("*.json")
+        index = json.loads(index_path.read_text())
+        index["boards"] = []
+        index_path.write_text(json.dumps(index))
+        assert "ports/stm32/boards/PYBV11/board.json" in load_board_index(mpy_root)
+
+    def test_entry_of_wrong_shape_is_reparsed(self, mpy_root, make_board, _isolated_cache_dir):
+        """An index entry that isn't a dict is re-read from its board.json."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        load_board_index(mpy_root)
+        (index_path,) = (_isolated_cache_dir / "boards").glob("*.json")
+        index = json.loads(index_path.read_text())
+        index["boards"]["ports/stm32/boards/PYBV11/board.json"] = "x"
+        index_path.write_text(json.dumps(index))
+        assert load_board_index(mpy_root)["ports/stm32/boards/PYBV11/board.json"] == {
+            "mcu": "stm32f4"
+        }
+
+    def test_database_matches_across_cold_and_warm_loads(self, mpy_root, make_board):
+        """Database built from the index is identical to one built from scratch."""
+        make_board("stm32", "PYBV11", mcu="stm32f4", variants={"DP": "Double"})
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        cold = Database(mpy_root)
+        warm = Database(mpy_root)
+        assert sorted(cold.boards) == sorted(warm.boards)
+        assert warm.boards["PYBV11"].variants[0].name == "DP"
+        assert warm.boards["PYBV11"].port is warm.ports["stm32"]
+
+
 # ===================================================================
 # Database.assert_mpy_root_direcory
 # ===================================================================
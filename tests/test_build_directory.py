@@ -0,0 +1,59 @@
+"""Tests for build_directory / firmware_artifacts — where make puts its output."""
+
+from __future__ import annotations
+
+import pytest
+
+from mpbuild.board_database import Database
+from mpbuild.build import build_directory, firmware_artifacts
+
+
+class TestBuildDirectory:
+    def test_physical_board(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        assert build_directory(db.boards["PYBV11"]) == mpy_root / "ports/stm32/build-PYBV11"
+
+    def test_physical_board_variant(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4", variants={"DP": "Double"})
+        db = Database(mpy_root)
+        assert (
+            build_directory(db.boards["PYBV11"], "DP") == mpy_root / "ports/stm32/build-PYBV11-DP"
+        )
+
+    @pytest.mark.parametrize(
+        "port, default", [("unix", "standard"), ("webassembly", "standard"), ("windows", "dev")]
+    )
+    def test_special_port_named_after_variant(self, mpy_root, port, default):
+        db = Database(mpy_root)
+        assert build_directory(db.boards[port]) == mpy_root / "ports" / port / f"build-{default}"
+        assert build_directory(db.boards[port], "minimal") == (
+            mpy_root / "ports" / port / "build-minimal"
+        )
+
+
+class TestFirmwareArtifacts:
+    def test_none_before_building(self, mpy_root, make_board):
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        db = Database(mpy_root)
+        assert firmware_artifacts(db.boards["RPI_PICO"]) == []
+
+    def test_most_useful_first(self, mpy_root, make_board):
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        db = Database(mpy_root)
+        build_dir = mpy_root / "ports/rp2/build-RPI_PICO"
+        build_dir.mkdir()
+        for name in ("firmware.elf", "firmware.bin", "firmware.uf2", "frozen_content.c"):
+            (build_dir / name).write_bytes(b"")
+        assert [p.name for p in firmware_artifacts(db.boards["RPI_PICO"])] == [
+            "firmware.uf2",
+            "firmware.bin",
+            "firmware.elf",
+        ]
+
+    def test_unix_executable(self, mpy_root):
+        db = Database(mpy_root)
+        build_dir = mpy_root / "ports/unix/build-standard"
+        build_dir.mkdir(parents=True)
+        (build_dir / "micropython").write_bytes(b"")
+        assert firmware_artifacts(db.boards["unix"]) == [build_dir / "micropython"]
@@ -0,0 +1,140 @@
+"""Tests for clean — removing build directories on the host."""
+
+from __future__ import annotations
+
+import pytest
+
+from mpbuild.batch import BuildTarget
+from mpbuild.board_database import Database
+from mpbuild.build import build_directory
+from mpbuild.clean import clean_boards, clean_targets_of, remove_build_directories
+from mpbuild.find_boards import find_mpy_root
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    from mpbuild import board_database
+
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+    yield
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+
+
+@pytest.fixture
+def db(mpy_root, make_board):
+    make_board("stm32", "PYBV11", mcu="stm32f4", variants={"DP": "Double", "THREAD": "Thread"})
+    make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+    make_board("rp2", "RPI_PICO", mcu="rp2040")
+    return Database(mpy_root)
+
+
+def _built(board, variant=None):
+    directory = build_directory(board, variant)
+    (directory / "genhdr").mkdir(parents=True)
+    (directory / "genhdr" / "qstrdefs.h").write_text("")
+    (directory / "firmware.elf").write_bytes(b"elf")
+    return directory
+
+
+@pytest.fixture
+def container_clean(monkeypatch):
+    """Records the container cleans instead of running them."""
+    calls = []
+
+    def build_board(board, variant, extra_args, **_kwargs):
+        assert extra_args == ["clean"]
+        calls.append((board, variant))
+
+    monkeypatch.setattr("mpbuild.clean.build_board", build_board)
+    return calls
+
+
+# ===================================================================
+# Targets
+# ===================================================================
+class TestCleanTargets:
+    def test_all_variants(self, db):
+        targets = clean_targets_of([BuildTarget(db.boards["PYBV11"])], all_variants=True)
+        assert [str(t) for t in targets] == ["PYBV11", "PYBV11:DP", "PYBV11:THREAD"]
+
+    def test_named_variant_only(self, db):
+        targets = clean_targets_of([BuildTarget(db.boards["PYBV11"], "DP")], all_variants=True)
+        assert [str(t) for t in targets] == ["PYBV11:DP"]
+
+    def test_shared_directory_once(self, mpy_root):
+        (mpy_root / "ports/unix/variants/standard").mkdir(parents=True)
+        unix = Database(mpy_root).boards["unix"]
+        targets = clean_targets_of([BuildTarget(unix)], all_variants=True)
+        assert [str(t) for t in targets] == ["unix"]
+
+
+# ===================================================================
+# Removing on the host
+# ===================================================================
+class TestRemove:
+    def test_parallel(self, db):
+        boards = [db.boards[name] for name in ("PYBV11", "NUCLEO_F401RE", "RPI_PICO")]
+        directories = [_built(b) for b in boards]
+        results = remove_build_directories([BuildTarget(b) for b in boards], jobs=3)
+        assert results == {"PYBV11": True, "NUCLEO_F401RE": True, "RPI_PICO": True}
+        assert not any(d.exists() for d in directories)
+
+    def test_nothing_to_remove(self, db):
+        assert remove_build_directories([BuildTarget(db.boards["PYBV11"])]) == {"PYBV11": None}
+
+    def test_not_owned(self, db, monkeypatch):
+        directory = _built(db.boards["PYBV11"])
+        monkeypatch.setattr("mpbuild.clean.os.getuid", lambda: directory.stat().st_uid + 1)
+        assert remove_build_directories([BuildTarget(db.boards["PYBV11"])]) == {"PYBV11": False}
+        assert directory.exists()
+
+
+# ===================================================================
+# clean_boards
+# ===================================================================
+class TestCleanBoards:
+    def test_board_without_container(self, db, mpy_root, container_clean, capsys):
+        pyb = db.boards["PYBV11"]
+        directory = _built(pyb)
+        variant = _built(pyb, "DP")
+        clean_boards(["PYBV11"], mpy_dir=mpy_root)
+        assert not directory.exists()
+        assert variant.exists()  # like `make clean BOARD=PYBV11`
+        assert container_clean == []
+        assert "Removed ports/stm32/build-PYBV11" in capsys.readouterr().out
+
+    def test_port(self, db, mpy_root, container_clean, capsys):
+        pyb = db.boards["PYBV11"]
+        directories = [_built(pyb), _built(pyb, "THREAD"), _built(db.boards["NUCLEO_F401RE"])]
+        pico = _built(db.boards["RPI_PICO"])
+        clean_boards(port="stm32", mpy_dir=mpy_root)
+        assert not any(d.exists() for d in directories)
+        assert pico.exists()
+        assert container_clean == []
+        assert "Removed 3 build directories of 4 target(s)" in capsys.readouterr().out
+
+    def test_falls_back_to_container(self, db, mpy_root, container_clean, monkeypatch):
+        directory = _built(db.boards["PYBV11"], "DP")
+        _built(db.boards["NUCLEO_F401RE"])
+        monkeypatch.setattr("mpbuild.clean.os.getuid", lambda: directory.stat().st_uid + 1)
+        clean_boards(["PYBV11:DP", "NUCLEO_F401RE"], mpy_dir=mpy_root)
+        assert container_clean == [("PYBV11", "DP"), ("NUCLEO_F401RE", None)]
+
+    def test_container_failure_exits(self, db, mpy_root, monkeypatch):
+        directory = _built(db.boards["PYBV11"])
+        monkeypatch.setattr("mpbuild.clean.os.getuid", lambda: directory.stat().st_uid + 1)
+
+        def build_board(**_kwargs):
+            raise SystemExit(2)
+
+        monkeypatch.setattr("mpbuild.clean.build_board", build_board)
+        with pytest.raises(SystemExit) as exc:
+            clean_boards(["PYBV11"], mpy_dir=mpy_root)
+        assert exc.value.code == 1
+
+    def test_empty_selection(self, db, mpy_root, capsys):
+        with pytest.raises(SystemExit):
+            clean_boards(mpy_dir=mpy_root)
+        assert "Nothing to clean" in capsys.readouterr().out
@@ -10,7 +10,7 @@ from __future__ import annotations
 import pytest
 from typer.testing import CliRunner
 
-from mpbuild import OutputFormat, __version__
+from mpbuild import OutputFormat, Runtime, __version__
 from mpbuild.cli import app
 
 
@@ -44,12 +44,31 @@ class TestBuild:
         """`mpbuild build BOARD` calls build_board with default-shaped args."""
         called = {}
 
-        def fake(board, variant, extra_args, build_container):
+        def fake(
+            board,
+            variant,
+            extra_args,
+            build_container,
+            ccache,
+            use_cached,
+            offline,
+            runtime,
+            timings_json,
+            trace,
+            profile_compiles,
+        ):
             called.update(
                 board=board,
                 variant=variant,
                 extra_args=extra_args,
                 build_container=build_container,
+                ccache=ccache,
+                use_cached=use_cached,
+                offline=offline,
+                runtime=runtime,
+                timings_json=timings_json,
+                trace=trace,
+                profile_compiles=profile_compiles,
             )
 
         monkeypatch.setattr("mpbuild.cli.build_board", fake)
@@ -62,6 +81,13 @@ class TestBuild:
             "variant": None,
             "extra_args": [],
             "build_container": None,
+            "ccache": False,
+            "use_cached": True,
+            "offline": False,
+            "runtime": None,
+            "timings_json": None,
+            "trace": None,
+            "profile_compiles": False,
         }
 
     def test_with_variant(self, runner, monkeypatch):
@@ -69,7 +95,7 @@ class TestBuild:
         called = {}
         monkeypatch.setattr(
             "mpbuild.cli.build_board",
-            lambda b, v, e, c: called.update(b=b, v=v, e=e, c=c),
+            lambda b, v, e, c, **kwargs: called.update(b=b, v=v, e=e, c=c),
         )
         result = runner.invoke(app, ["build", "PYBV11", "DP_THREAD"])
         assert result.exit_code == 0
@@ -80,7 +106,7 @@ class TestBuild:
         called = {}
         monkeypatch.setattr(
             "mpbuild.cli.build_board",
-            lambda b, v, e, c: called.update(v=v),
+            lambda b, v, e, c, **kwargs: called.update(v=v),
         )
         result = runner.invoke(app, ["build", "PYBV11", ""])
         assert result.exit_code == 0
@@ -96,12 +122,104 @@ class TestBuild:
         called = {}
         monkeypatch.setattr(
             "mpbuild.cli.build_board",
-            lambda b, v, e, c: called.update(c=c),
+            lambda b, v, e, c, **kwargs: called.update(c=c),
         )
         result = runner.invoke(app, ["build", "--build-container", "custom/image:tag", "PYBV11"])
         assert result.exit_code == 0
         assert called["c"] == "custom/image:tag"
 
+    def test_ccache_flag(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "--ccache", "PYBV11"])
+        assert result.exit_code == 0
+        assert called["ccache"] is True
+
+    def test_no_cache_flag(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "--no-cache", "PYBV11"])
+        assert result.exit_code == 0
+        assert called["use_cached"] is False
+
+    def test_offline_flag(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "--offline", "PYBV11"])
+        assert result.exit_code == 0
+        assert called["offline"] is True
+
+    def test_timings_json(self, runner, monkeypatch, tmp_path):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        path = tmp_path / "timings.json"
+        result = runner.invoke(app, ["build", "PYBV11", "--timings-json", str(path)])
+        assert result.exit_code == 0
+        assert called["timings_json"] == path
+
+    def test_trace_from_environment(self, runner, monkeypatch, tmp_path):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        path = tmp_path / "trace.json"
+        result = runner.invoke(app, ["build", "PYBV11"], env={"MPBUILD_TRACE": str(path)})
+        assert result.exit_code == 0
+        assert called["trace"] == path
+
+    def test_profile_compiles(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "--profile-compiles", "PYBV11"])
+        assert result.exit_code == 0
+        assert called["profile_compiles"] is True
+
+    def test_ccache_from_environment(self, runner, monkeypatch):
+        """MPBUILD_CCACHE=1 turns ccache on without the flag."""
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "PYBV11"], env={"MPBUILD_CCACHE": "1"})
+        assert result.exit_code == 0
+        assert called["ccache"] is True
+
+    def test_runtime(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_board",
+            lambda b, v, e, c, **kwargs: called.update(kwargs),
+        )
+        result = runner.invoke(app, ["build", "--runtime", "native", "PYBV11"])
+        assert result.exit_code == 0
+        assert called["runtime"] is Runtime.native
+
+        result = runner.invoke(app, ["build", "PYBV11"], env={"MPBUILD_RUNTIME": "Podman"})
+        assert result.exit_code == 0
+        assert called["runtime"] is Runtime.podman
+
+    def test_unknown_runtime(self, runner, monkeypatch):
+        monkeypatch.setattr("mpbuild.cli.build_board", lambda *a, **k: None)
+        result = runner.invoke(app, ["build", "--runtime", "lxc", "PYBV11"])
+        assert result.exit_code != 0
+
 
 # ===================================================================
 # rebuild
@@ -111,12 +229,15 @@ class TestRebuild:
         """`mpbuild rebuild BOARD` calls rebuild_board with default-shaped args."""
         called = {}
 
-        def fake(board, variant, extra_args, build_container):
+        def fake(board, variant, extra_args, build_container, ccache, offline, runtime):
             called.update(
                 board=board,
                 variant=variant,
                 extra_args=extra_args,
                 build_container=build_container,
+                ccache=ccache,
+                offline=offline,
+                runtime=runtime,
             )
 
         monkeypatch.setattr("mpbuild.cli.rebuild_board", fake)
@@ -129,6 +250,9 @@ class TestRebuild:
             "variant": None,
             "extra_args": [],
             "build_container": None,
+            "ccache": False,
+            "offline": False,
+            "runtime": None,
         }
 
     def test_with_variant_and_container_override(self, runner, monkeypatch):
@@ -136,7 +260,7 @@ class TestRebuild:
         called = {}
         monkeypatch.setattr(
             "mpbuild.cli.rebuild_board",
-            lambda b, v, e, c: called.update(b=b, v=v, e=e, c=c),
+            lambda b, v, e, c, ccache, offline, runtime: called.update(b=b, v=v, e=e, c=c),
         )
         result = runner.invoke(
             app,
@@ -146,6 +270,112 @@ class TestRebuild:
         assert called == {"b": "PYBV11", "v": "DP_THREAD", "e": [], "c": "custom/image:tag"}
 
 
+# ===================================================================
+# build-many
+# ===================================================================
+class TestBuildMany:
+    def test_dispatches_targets_and_options(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_many_boards",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        result = runner.invoke(
+            app, ["build-many", "--jobs", "4", "--port", "stm32", "PYBV11:DP", "RPI_PICO"]
+        )
+        assert result.exit_code == 0
+        assert called == {
+            "names": ["PYBV11:DP", "RPI_PICO"],
+            "port": "stm32",
+            "all_boards": False,
+            "jobs": 4,
+            "build_container_override": None,
+            "ccache": False,
+            "use_cached": True,
+            "offline": False,
+            "runtime": None,
+            "memory_budget": None,
+            "shard": None,
+            "durations": None,
+            "timings_json": None,
+            "trace": None,
+            "profile_compiles": False,
+        }
+
+    def test_all_flag(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_many_boards",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        result = runner.invoke(app, ["build-many", "--all"])
+        assert result.exit_code == 0
+        assert called["names"] == []
+        assert called["all_boards"] is True
+        assert called["jobs"] == 2
+
+    @pytest.mark.parametrize(("value", "expected"), [("12G", 12 * 1024**3), ("0", 0)])
+    def test_memory_budget(self, runner, monkeypatch, value, expected):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.build_many_boards",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        result = runner.invoke(app, ["build-many", "--all", "--memory-budget", value])
+        assert result.exit_code == 0
+        assert called["memory_budget"] == expected
+
+    def test_memory_budget_invalid(self, runner):
+        result = runner.invoke(app, ["build-many", "--all", "--memory-budget", "lots"])
+        assert result.exit_code == 2
+        assert "not a size" in result.output
+
+
+# ===================================================================
+# plan
+# ===================================================================
+class TestPlan:
+    def test_dispatches_json(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.print_plan",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        result = runner.invoke(app, ["plan", "--json", "--port", "esp32", "PYBV11"])
+        assert result.exit_code == 0
+        assert called == {
+            "names": ["PYBV11"],
+            "port": "esp32",
+            "all_boards": False,
+            "as_json": True,
+            "build_container_override": None,
+            "ccache": False,
+            "runtime": None,
+            "shard": None,
+            "durations": None,
+        }
+
+    def test_shard(self, runner, monkeypatch, tmp_path):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.print_plan",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        durations = tmp_path / "durations.json"
+        result = runner.invoke(
+            app, ["plan", "--all", "--shard", "02/4", "--durations", str(durations)]
+        )
+        assert result.exit_code == 0
+        assert called["shard"] == "2/4"
+        assert called["durations"] == durations
+
+    @pytest.mark.parametrize("shard", ["5/4", "0/4", "1", "a/b"])
+    def test_invalid_shard(self, runner, shard):
+        result = runner.invoke(app, ["build-many", "--all", "--shard", shard])
+        assert result.exit_code == 2
+        assert "not a shard" in result.output
+
+
 # ===================================================================
 # clean
 # ===================================================================
@@ -171,6 +401,21 @@ class TestClean:
         assert result.exit_code == 0
         assert called == {"b": "PYBV11", "v": "DP_THREAD"}
 
+    def test_port_and_all_clean_many(self, runner, monkeypatch):
+        called = {}
+        monkeypatch.setattr(
+            "mpbuild.cli.clean_boards",
+            lambda names, **kwargs: called.update(names=names, **kwargs),
+        )
+        result = runner.invoke(app, ["clean", "--port", "stm32", "-j", "4"])
+        assert result.exit_code == 0
+        assert called == {"names": [], "port": "stm32", "all_boards": False, "jobs": 4}
+
+        result = runner.invoke(app, ["clean", "--all"])
+        assert result.exit_code == 0
+        assert called["all_boards"] is True
+        assert called["jobs"] == 8
+
 
 # ===================================================================
 # list
@@ -0,0 +1,246 @@
+"""Tests for completions — board/variant/port name completion and its fast path."""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import pytest
+from typer.testing import CliRunner
+
+from mpbuild.cli import app
+from mpbuild.completions import (
+    _OPTIONS_WITH_VALUE,
+    fast_complete,
+    list_boards,
+    list_ports,
+    list_variants_for_board,
+)
+from mpbuild.find_boards import find_mpy_root
+
+
+@pytest.fixture(autouse=True)
+def _clear_find_mpy_root_cache():
+    """find_mpy_root is @cache-decorated; clear between tests for isolation."""
+    find_mpy_root.cache_clear()
+    yield
+    find_mpy_root.cache_clear()
+
+
+@pytest.fixture
+def populated_mpy_root(mpy_root, make_board, monkeypatch):
+    make_board("stm32", "PYBV11", mcu="stm32f4", variants={"THREAD": "t", "DP": "d"})
+    make_board("stm32", "PYBD_SF2", mcu="stm32f7")
+    make_board("rp2", "RPI_PICO", mcu="rp2040")
+    (mpy_root / "ports" / "unix" / "variants" / "standard").mkdir(parents=True)
+    monkeypatch.chdir(mpy_root)
+    return mpy_root
+
+
+def _complete_env(monkeypatch, shell: str, line: str) -> None:
+    monkeypatch.setenv("_MPBUILD_COMPLETE", f"complete_{shell}")
+    if shell == "bash":
+        words = line.split()
+        cword = len(words) if line.endswith(" ") else len(words) - 1
+        monkeypatch.setenv("COMP_WORDS", line)
+        monkeypatch.setenv("COMP_CWORD", str(cword))
+    else:
+        monkeypatch.setenv("_TYPER_COMPLETE_ARGS", line)
+        monkeypatch.setenv("_TYPER_COMPLETE_FISH_ACTION", "get-args")
+
+
+# ===================================================================
+# Name lists
+# ===================================================================
+class TestNameLists:
+    def test_list_boards_includes_special_ports(self, populated_mpy_root):
+        assert list_boards() == [
+            "PYBD_SF2",
+            "PYBV11",
+            "RPI_PICO",
+            "unix",
+            "webassembly",
+            "windows",
+        ]
+
+    def test_list_ports(self, populated_mpy_root):
+        assert list_ports() == ["rp2", "stm32", "unix", "webassembly", "windows"]
+
+    def test_variants_sorted(self, populated_mpy_root):
+        assert list_variants_for_board("PYBV11") == ["DP", "THREAD"]
+
+    def test_special_port_variants(self, populated_mpy_root):
+        assert list_variants_for_board("unix") == ["standard"]
+
+    def test_unknown_board_has_no_variants(self, populated_mpy_root):
+        assert list_variants_for_board("NOPE") == []
+
+    def test_port_filter_from_cwd(self, populated_mpy_root, monkeypatch):
+        """Inside ports/<port>, only that port's boards are offered."""
+        monkeypatch.chdir(populated_mpy_root / "ports" / "rp2")
+        assert list_boards() == ["RPI_PICO"]
+        assert list_ports() == ["rp2"]
+
+
+# ===================================================================
+# fast_complete
+# ===================================================================
+class TestFastComplete:
+    @pytest.mark.parametrize(
+        "shell, expected",
+        [
+            ("bash", "PYBD_SF2\nPYBV11\n"),
+            ("zsh", '_arguments \'*: :(("PYBD_SF2"\n"PYBV11"))\'\n'),
+            ("fish", "PYBD_SF2\nPYBV11\n"),
+            ("powershell", "PYBD_SF2::: \nPYBV11::: \n"),
+        ],
+    )
+    def test_board_formats(self, populated_mpy_root, monkeypatch, capsys, shell, expected):
+        _complete_env(monkeypatch, shell, "mpbuild build PYB")
+        if shell == "powershell":
+            monkeypatch.setenv("_TYPER_COMPLETE_WORD_TO_COMPLETE", "PYB")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == expected
+
+    def test_variant(self, populated_mpy_root, monkeypatch, capsys):
+        _complete_env(monkeypatch, "bash", "mpbuild rebuild PYBV11 ")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "DP\nTHREAD\n"
+
+    def test_port(self, populated_mpy_root, monkeypatch, capsys):
+        _complete_env(monkeypatch, "bash", "mpbuild list s")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "stm32\n"
+
+    def test_skips_option_values(self, populated_mpy_root, monkeypatch, capsys):
+        """`--build-container IMAGE` doesn't count as a positional argument."""
+        _complete_env(monkeypatch, "bash", "mpbuild build --build-container img RPI")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "RPI_PICO\n"
+
+    @pytest.mark.parametrize("option", ["--trace", "--timings-json"])
+    def test_skips_path_option_values(self, populated_mpy_root, monkeypatch, capsys, option):
+        _complete_env(monkeypatch, "bash", f"mpbuild build {option} out.json RPI")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "RPI_PICO\n"
+
+    def test_runtime(self, populated_mpy_root, monkeypatch, capsys):
+        _complete_env(monkeypatch, "bash", "mpbuild build --runtime ")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "docker\npodman\nnative\n"
+
+    @pytest.mark.parametrize("option", ["--trace", "--timings-json", "--durations"])
+    def test_path_option_completes_files(self, populated_mpy_root, monkeypatch, capsys, option):
+        _complete_env(monkeypatch, "zsh", f"mpbuild build-many {option} ")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "_files\n"
+
+    def test_every_option_value_skipped(self):
+        """Each option typer declares with a value is known to the fast path."""
+        import typer
+        from typer.core import TyperGroup, TyperOption
+
+        command = typer.main.get_command(app)
+        assert isinstance(command, TyperGroup)
+        options = {
+            opt
+            for sub in command.commands.values()
+            for param in sub.params
+            if isinstance(param, TyperOption) and not param.is_flag
+            for opt in param.opts
+        }
+        assert options
+        assert options <= _OPTIONS_WITH_VALUE
+
+    def test_zsh_no_match_falls_back_to_files(self, populated_mpy_root, monkeypatch, capsys):
+        _complete_env(monkeypatch, "zsh", "mpbuild build NOPE")
+        assert fast_complete() == 0
+        assert capsys.readouterr().out == "_files\n"
+
+    def test_fish_is_args(self, populated_mpy_root, monkeypatch, capsys):
+        """fish's is-args probe is answered by exit status alone."""
+        _complete_env(monkeypatch, "fish", "mpbuild build PYB")
+        monkeypatch.setenv("_TYPER_COMPLETE_FISH_ACTION", "is-args")
+        assert fast_complete() == 0
+        _complete_env(monkeypatch, "fish", "mpbuild build NOPE")
+        monkeypatch.setenv("_TYPER_COMPLETE_FISH_ACTION", "is-args")
+        assert fast_complete() == 1
+        assert capsys.readouterr().out == ""
+
+    @pytest.mark.parametrize(
+        "line",
+        [
+            "mpbuild ",  # subcommand names
+            "mpbuild bu",
+            "mpbuild build --",  # option names
+            "mpbuild build --build-container ",  # option value
+            "mpbuild clean ",  # no name completion on clean
+            "mpbuild build PYBV11 DP ",  # extra make args
+        ],
+    )
+    def test_defers_to_typer(self, populated_mpy_root, monkeypatch, capsys, line):
+        _complete_env(monkeypatch, "bash", line)
+        assert fast_complete() is None
+        assert capsys.readouterr().out == ""
+
+    def test_defers_for_non_completion_instructions(self, monkeypatch):
+        monkeypatch.setenv("_MPBUILD_COMPLETE", "source_bash")
+        assert fast_complete() is None
+
+    def test_defers_outside_micropython_tree(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.delenv("MICROPY_DIR", raising=False)
+        _complete_env(monkeypatch, "bash", "mpbuild build P")
+        assert fast_complete() is None
+
+    @pytest.mark.parametrize("shell", ["bash", "zsh", "fish"])
+    @pytest.mark.parametrize(
+        "line",
+        [
+            "mpbuild build P",
+            "mpbuild build PYBV11 ",
+            "mpbuild list ",
+            "mpbuild build --timings-json ",
+            "mpbuild build --runtime ",
+            "mpbuild build --trace ",
+        ],
+    )
+    def test_matches_typer(self, populated_mpy_root, monkeypatch, capsys, shell, line):
+        """The fast path produces byte-for-byte what typer would."""
+        _complete_env(monkeypatch, shell, line)
+        assert fast_complete() == 0
+        fast = capsys.readouterr().out
+
+        result = CliRunner().invoke(app, [], prog_name="mpbuild", env=dict(os.environ))
+        assert result.output == fast
+
+    def test_does_not_import_cli(self, populated_mpy_root):
+        """The entry point answers without importing typer, click or rich."""
+        env = dict(
+            os.environ,
+            _MPBUILD_COMPLETE="complete_bash",
+            COMP_WORDS="mpbuild build PYB",
+            COMP_CWORD="2",
+        )
+        probe = (
+            "import sys\n"
+            "from mpbuild.__main__ import main\n"
+            "try:\n"
+            "    main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "heavy = sorted(m for m in sys.modules if m == 'mpbuild.build' or "
+            "m.split('.')[0] in ('typer', 'click', 'rich'))\n"
+            "print(heavy, file=sys.stderr)\n"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", probe],
+            cwd=populated_mpy_root,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert proc.stdout == "PYBD_SF2\nPYBV11\n"
+        assert proc.stderr.strip() == "[]"
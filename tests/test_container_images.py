@@ -0,0 +1,222 @@
+"""Tests for container_images — the image pre-pull planner.
+
+docker is replaced by a shell script on PATH. It knows which images are
+"present" from a file, records every invocation, and makes each pull wait
+briefly for the others so concurrent pulls can be observed.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from mpbuild import Runtime
+from mpbuild.board_database import Database
+from mpbuild.build import BuildContext
+from mpbuild.container_images import (
+    MpbuildImageException,
+    ensure_images,
+    missing_images,
+    plan_images,
+    pull_images,
+    required_images,
+)
+
+FAKE_DOCKER = r"""#!/bin/sh
+state="$FAKE_DOCKER_STATE"
+echo "$*" >> "$state/calls"
+if [ "$1 $2" = "image inspect" ]; then
+    shift 4  # image inspect --format <fmt>
+    rc=0
+    for image in "$@"; do
+        if grep -qxF "$image" "$state/present"; then
+            echo "sha256:$image"
+        else
+            echo "Error: No such image: $image" >&2
+            rc=1
+        fi
+    done
+    exit $rc
+fi
+if [ "$1" = "pull" ]; then
+    image="$3"
+    echo "$image" >> "$state/started"
+    # Wait (up to ~2s) for the other expected pulls to start too.
+    i=0
+    while [ "$(wc -l < "$state/started")" -lt "${FAKE_DOCKER_EXPECT:-1}" ] && [ $i -lt 20 ]; do
+        sleep 0.1
+        i=$((i + 1))
+    done
+    echo "$(wc -l < "$state/started")" >> "$state/seen"
+    if grep -qxF "$image" "$state/fail" 2> /dev/null; then
+        echo "pull access denied for $image" >&2
+        exit 1
+    fi
+    echo "$image" >> "$state/present"
+    exit 0
+fi
+exit 2
+"""
+
+
+class FakeDocker:
+    def __init__(self, state: Path):
+        self.state = state
+
+    def present(self, *images: str) -> None:
+        with (self.state / "present").open("a") as f:
+            f.writelines(f"{i}\n" for i in images)
+
+    def fail(self, *images: str) -> None:
+        (self.state / "fail").write_text("".join(f"{i}\n" for i in images))
+
+    def calls(self) -> list[str]:
+        path = self.state / "calls"
+        return path.read_text().splitlines() if path.exists() else []
+
+    def seen(self) -> list[int]:
+        return [int(n) for n in (self.state / "seen").read_text().split()]
+
+
+@pytest.fixture
+def docker(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "docker"
+    script.write_text(FAKE_DOCKER)
+    script.chmod(0o755)
+    state = tmp_path / "state"
+    state.mkdir()
+    (state / "present").touch()
+    (state / "started").touch()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_DOCKER_STATE", str(state))
+    return FakeDocker(state)
+
+
+@pytest.fixture
+def targets(mpy_root, make_board):
+    make_board("stm32", "PYBV11", mcu="stm32f4")
+    make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+    make_board("rp2", "RPI_PICO", mcu="rp2040", variants={"RISCV": "RISC-V"})
+    db = Database(mpy_root)
+    return [
+        (db.boards["PYBV11"], None),
+        (db.boards["NUCLEO_F401RE"], None),
+        (db.boards["RPI_PICO"], None),
+        (db.boards["RPI_PICO"], "RISCV"),
+    ]
+
+
+ARM = "micropython/build-micropython-arm"
+RP2 = "micropython/build-micropython-arm:bookworm"
+RISCV = "micropython/build-micropython-rp2350riscv"
+
+
+# ===================================================================
+# Planning
+# ===================================================================
+class TestPlan:
+    def test_distinct_images_in_order(self, targets):
+        assert required_images(targets) == [ARM, RP2, RISCV]
+
+    def test_override(self, targets):
+        assert required_images(targets, "custom/image") == ["custom/image"]
+
+    def test_one_batched_inspect(self, docker, targets):
+        docker.present(ARM)
+        plan = plan_images(targets)
+        assert plan.images == [ARM, RP2, RISCV]
+        assert plan.missing == [RP2, RISCV]
+        assert docker.calls() == [f"image inspect --format {{{{.Id}}}} {ARM} {RP2} {RISCV}"]
+
+    def test_all_present(self, docker):
+        docker.present(ARM, RP2)
+        assert missing_images([ARM, RP2]) == []
+
+    def test_docker_not_installed(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PATH", str(tmp_path))
+        with pytest.raises(MpbuildImageException, match="docker not found"):
+            missing_images([ARM])
+
+    def test_podman(self, docker, targets, mpy_root):
+        bin_dir = docker.state.parent / "bin"
+        (bin_dir / "docker").rename(bin_dir / "podman")
+        context = BuildContext.create(mpy_root, runtime=Runtime.podman)
+        docker.present(ARM, RP2, RISCV)
+        assert plan_images(targets, context=context).missing == []
+        assert len(docker.calls()) == 1
+
+    def test_native_needs_no_images(self, docker, targets, mpy_root):
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        assert ensure_images(targets, context=context).images == []
+        assert docker.calls() == []
+
+
+# ===================================================================
+# Pulling
+# ===================================================================
+class TestPull:
+    def test_concurrent(self, docker, monkeypatch):
+        monkeypatch.setenv("FAKE_DOCKER_EXPECT", "3")
+        done = []
+        errors = pull_images([ARM, RP2, RISCV], jobs=3, on_done=lambda i, ok, _: done.append(i))
+        assert errors == {ARM: None, RP2: None, RISCV: None}
+        assert sorted(done) == sorted([ARM, RP2, RISCV])
+        # Every pull saw all three in flight.
+        assert docker.seen() == [3, 3, 3]
+
+    def test_jobs_limit(self, docker, monkeypatch):
+        monkeypatch.setenv("FAKE_DOCKER_EXPECT", "2")
+        pull_images([ARM, RP2], jobs=1)
+        assert docker.seen() == [1, 2]
+
+    def test_failure_reported(self, docker):
+        docker.fail(RP2)
+        errors = pull_images([ARM, RP2])
+        assert errors[ARM] is None
+        error = errors[RP2]
+        assert error is not None
+        assert "pull access denied" in error
+
+
+# ===================================================================
+# ensure_images
+# ===================================================================
+class TestEnsureImages:
+    def test_pulls_only_missing(self, docker, targets):
+        docker.present(ARM, RISCV)
+        ensure_images(targets)
+        pulls = [c for c in docker.calls() if c.startswith("pull")]
+        assert pulls == [f"pull --quiet {RP2}"]
+
+    def test_nothing_missing_no_pull(self, docker, targets):
+        docker.present(ARM, RP2, RISCV)
+        ensure_images(targets)
+        assert len(docker.calls()) == 1
+
+    def test_offline_fails_fast(self, docker, targets):
+        docker.present(ARM)
+        with pytest.raises(MpbuildImageException, match="not present locally") as exc:
+            ensure_images(targets, offline=True)
+        assert RP2 in str(exc.value)
+        assert not any(c.startswith("pull") for c in docker.calls())
+
+    def test_pull_failure_raises(self, docker, targets):
+        docker.present(ARM, RISCV)
+        docker.fail(RP2)
+        with pytest.raises(MpbuildImageException, match="Failed to pull"):
+            ensure_images(targets)
+
+    def test_pulls_timed(self, docker, targets):
+        docker.present(ARM)
+        docker.fail(RISCV)
+        pulls = []
+        before = time.time()
+        with pytest.raises(MpbuildImageException):
+            ensure_images(targets, pulls=pulls)
+        assert sorted((p.name, p.returncode) for p in pulls) == [(RP2, 0), (RISCV, 1)]
+        assert all(before <= p.start <= time.time() and p.duration >= 0 for p in pulls)
@@ -3,11 +3,46 @@
 from __future__ import annotations
 
 import os
+import shlex
+import subprocess
+import time
+from pathlib import Path
 
 import pytest
 
+from mpbuild import Runtime
 from mpbuild.board_database import Database
-from mpbuild.build import docker_build_cmd
+from mpbuild.build import (
+    _PHASE_FUNCTION,
+    _USAGE_TRAP,
+    CCACHE_COMPILERS,
+    MPY_CROSS_STAMP,
+    NATIVE_IMAGE,
+    NATIVE_TOOLCHAINS,
+    OOM_EXIT_CODE,
+    OOM_RETRIES,
+    BuildContext,
+    MpbuildNotSupportedException,
+    PhaseResult,
+    ResourceUsage,
+    build_board,
+    ccache_directory,
+    default_runtime,
+    docker_build_cmd,
+    docker_build_spec,
+    format_phases,
+    mpy_cross_build_dir,
+    mpy_cross_is_current,
+    mpy_cross_signature,
+    parse_block_io,
+    parse_cpu_time,
+    parse_oom_kills,
+    parse_peak_memory,
+    parse_phase,
+    pooled_container_name,
+    prepare_ccache,
+)
+from mpbuild.history import DurationHistory
 
 
 @pytest.fixture(autouse=True)
@@ -36,7 +71,7 @@ class TestDockerBuildCmdBasics:
         assert f"-v {mpy_root}:{mpy_root} -w {mpy_root}" in cmd
         assert "micropython/build-micropython-arm" in cmd
         assert "bash -c " in cmd
-        assert "make -C mpy-cross && " in cmd
+        assert "make -C mpy-cross BUILD=build-micropython_build-micropython-arm && " in cmd
         assert "make -C ports/stm32 BOARD=PYBV11 submodules && " in cmd
         assert "make -j" in cmd
         assert "ports/stm32 BOARD=PYBV11" in cmd
@@ -183,3 +218,539 @@ class TestDockerBuildCmdDeviceFlags:
         db = Database(mpy_root)
         cmd = docker_build_cmd(db.boards["PYBV11"])
         assert "--device /dev/bus/usb/" in cmd
+
+
+# ===================================================================
+# Reused (warm) containers
+# ===================================================================
+class TestDockerBuildCmdReuseContainer:
+    def test_default_is_docker_run(self, mpy_root, make_board, monkeypatch):
+        """Without MPBUILD_REUSE_CONTAINER every build gets a fresh container."""
+        monkeypatch.delenv("MPBUILD_REUSE_CONTAINER", raising=False)
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"])
+        assert cmd.startswith("docker run --rm ")
+        assert "docker exec" not in cmd
+
+    def test_env_enables_exec(self, mpy_root, make_board, monkeypatch):
+        """The build is exec'd in a named container, started only if missing."""
+        monkeypatch.setenv("MPBUILD_REUSE_CONTAINER", "1")
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], docker_interactive=False)
+
+        name = pooled_container_name(
+            "micropython/build-micropython-arm",
+            f"-v {mpy_root}:{mpy_root} -w {mpy_root} -e HOME=/tmp ",
+        )
+        assert cmd.startswith(f"docker container inspect {name} > /dev/null 2>&1 || ")
+        assert f"docker run -d --rm --name {name} --label mpbuild.pool=1 " in cmd
+        assert f"docker exec --user {os.getuid()}:{os.getgid()} -w {mpy_root} {name} " in cmd
+        assert "make -C ports/stm32 BOARD=PYBV11 submodules && " in cmd
+        assert "ports/stm32 BOARD=PYBV11" in cmd
+
+    def test_setup_runs_once_in_keepalive(self, mpy_root, make_board):
+        """safe.directory is configured when the container starts, not per build."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], reuse_container=True)
+        start, _, exec_part = cmd.partition("docker exec")
+        assert "safe.directory" in start
+        assert "safe.directory" not in exec_part
+        assert exec_part.startswith(" -it ")
+
+    def test_idle_timeout_from_env(self, mpy_root, make_board, monkeypatch):
+        monkeypatch.setenv("MPBUILD_CONTAINER_IDLE_TIMEOUT", "42")
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], reuse_container=True)
+        assert "-ge 42 ]" in cmd
+
+    def test_container_shared_per_image(self, mpy_root, make_board):
+        """Boards using the same image and mounts share one container."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        db = Database(mpy_root)
+
+        def container(board):
+            cmd = docker_build_cmd(db.boards[board], reuse_container=True)
+            return cmd.split()[3]
+
+        assert container("PYBV11") == container("NUCLEO_F401RE")
+        assert container("PYBV11") != container("RPI_PICO")
+
+    def test_clean_execs_as_root(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], do_clean=True, reuse_container=True)
+        assert "--user 0:0 " in cmd
+        assert "make -C mpy-cross" not in cmd
+
+
+# ===================================================================
+# ccache
+# ===================================================================
+class TestDockerBuildCmdCcache:
+    def test_off_by_default(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        assert "/ccache" not in docker_build_cmd(db.boards["PYBV11"])
+
+    def test_mounts_cache_and_wraps_port_make(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], ccache=True)
+        host_dir = ccache_directory("micropython/build-micropython-arm")
+        assert f"-v {host_dir}:/ccache " in cmd
+        assert "submodules && /ccache/run make -j" in cmd
+        assert (host_dir / "run").is_file()
+
+    def test_clean_ignores_ccache(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        cmd = docker_build_cmd(db.boards["PYBV11"], do_clean=True, ccache=True)
+        assert "/ccache" not in cmd
+
+    def test_cache_per_image(self, _isolated_cache_dir):
+        arm = ccache_directory("micropython/build-micropython-arm")
+        idf = ccache_directory("espressif/idf:v5.4.2")
+        assert arm != idf
+        assert idf == _isolated_cache_dir / "ccache" / "espressif_idf_v5.4.2"
+
+    def test_prepare_writes_executable_wrappers(self):
+        directory = prepare_ccache("micropython/build-micropython-arm")
+        wrapper = directory / "bin" / "arm-none-eabi-gcc"
+        assert os.access(wrapper, os.X_OK)
+        assert os.access(directory / "run", os.X_OK)
+        assert (directory / "cache").is_dir()
+        # Idempotent: a second call leaves everything in place.
+        assert prepare_ccache("micropython/build-micropython-arm") == directory
+
+    @pytest.mark.parametrize(
+        "compiler", sorted({c for c in NATIVE_TOOLCHAINS.values() if c.endswith("gcc")})
+    )
+    def test_every_port_compiler_wrapped(self, compiler):
+        """Each port's C compiler, and its C++ counterpart, go through ccache."""
+        assert compiler in CCACHE_COMPILERS
+        assert compiler.removesuffix("gcc") + "g++" in CCACHE_COMPILERS
+
+
+class TestCcacheRunner:
+    """The run script, executed on the host against a fake ccache."""
+
+    @pytest.fixture
+    def fake_ccache(self, tmp_path, monkeypatch):
+        bin_dir = tmp_path / "fakebin"
+        bin_dir.mkdir()
+        counter = tmp_path / "count"
+        counter.write_text("0")
+        # Each --print-stats call reports 3 more hits and 1 more miss.
+        script = bin_dir / "ccache"
+        script.write_text(
+            "#!/bin/sh\n"
+            f"n=$(cat {counter}); echo $((n + 1)) > {counter}\n"
+            'printf "direct_cache_hit\\t%d\\npreprocessed_cache_hit\\t%d\\n'
+            'cache_miss\\t%d\\n" $((n * 2)) $n $n\n'
+        )
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        return prepare_ccache("test/image") / "run"
+
+    def test_reports_hits_and_keeps_exit_status(self, fake_ccache):
+        proc = subprocess.run(
+            [str(fake_ccache), "sh", "-c", "exit 3"], capture_output=True, text=True
+        )
+        assert proc.returncode == 3
+        assert "ccache: 3 hits, 1 misses (75% hit rate)" in proc.stdout
+
+    def test_without_ccache_runs_plain(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("PATH", str(tmp_path))  # no ccache anywhere
+        run = prepare_ccache("test/image") / "run"
+        proc = subprocess.run([str(run), "/bin/sh", "-c", ":"], capture_output=True, text=True)
+        assert proc.returncode == 0
+        assert "not installed" in proc.stderr
+
+
+# ===================================================================
+# mpy-cross, built once per image
+# ===================================================================
+class TestDockerBuildCmdMpyCross:
+    ARM = "micropython/build-micropython-arm"
+
+    @pytest.fixture
+    def pyb(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        (mpy_root / "py").mkdir()
+        (mpy_root / "py" / "compile.c").write_text("")
+        (mpy_root / "mpy-cross" / "main.c").write_text("")
+        return Database(mpy_root).boards["PYBV11"]
+
+    def _built(self, mpy_root):
+        """Pretend the container built mpy-cross and wrote the stamp."""
+        build_dir = mpy_cross_build_dir(mpy_root, self.ARM)
+        build_dir.mkdir()
+        (build_dir / "mpy-cross").write_text("")
+        (build_dir / MPY_CROSS_STAMP).write_text(mpy_cross_signature(mpy_root, self.ARM) + "\n")
+
+    def test_per_image_build_and_stamp(self, mpy_root, pyb):
+        cmd = docker_build_cmd(pyb)
+        build_dir = mpy_cross_build_dir(mpy_root, self.ARM)
+        signature = mpy_cross_signature(mpy_root, self.ARM)
+        assert f"make -C mpy-cross BUILD={build_dir.name} && " in cmd
+        assert f"echo {signature} > mpy-cross/{build_dir.name}/{MPY_CROSS_STAMP} && " in cmd
+        assert f"BOARD=PYBV11 MPY_CROSS={build_dir}/mpy-cross" in cmd
+
+    def test_step_skipped_while_current(self, mpy_root, pyb):
+        self._built(mpy_root)
+        assert mpy_cross_is_current(mpy_root, self.ARM)
+        cmd = docker_build_cmd(pyb)
+        assert "make -C mpy-cross" not in cmd
+        assert "MPY_CROSS=" in cmd
+
+    def test_source_change_invalidates_stamp(self, mpy_root, pyb):
+        self._built(mpy_root)
+        (mpy_root / "py" / "compile.c").write_text("changed")
+        assert not mpy_cross_is_current(mpy_root, self.ARM)
+        assert "make -C mpy-cross BUILD=" in docker_build_cmd(pyb)
+
+    def test_own_build_output_not_a_source(self, mpy_root, pyb):
+        self._built(mpy_root)
+        (mpy_cross_build_dir(mpy_root, self.ARM) / "main.o").write_text("")
+        assert mpy_cross_is_current(mpy_root, self.ARM)
+
+    def test_images_do_not_share(self, mpy_root, pyb):
+        self._built(mpy_root)
+        assert not mpy_cross_is_current(mpy_root, "other/image")
+        assert mpy_cross_build_dir(mpy_root, "other/image") != mpy_cross_build_dir(
+            mpy_root, self.ARM
+        )
+
+    def test_cmake_ports_keep_default(self, mpy_root, make_board):
+        make_board("rp2", "RPI_PICO", mcu="rp2040")
+        cmd = docker_build_cmd(Database(mpy_root).boards["RPI_PICO"])
+        assert "make -C mpy-cross && " in cmd
+        assert "MPY_CROSS=" not in cmd
+
+    def test_mpy_cross_only(self, mpy_root, pyb):
+        cmd = docker_build_cmd(pyb, mpy_cross_only=True)
+        assert "make -C mpy-cross BUILD=" in cmd
+        assert "submodules" not in cmd
+        assert "ports/stm32" not in cmd
+        self._built(mpy_root)
+        assert docker_build_spec(pyb, mpy_cross_only=True).script == "true"
+
+
+# ===================================================================
+# BuildContext — repo and host facts resolved once
+# ===================================================================
+class TestBuildContext:
+    def test_resolved_once_across_calls(self, mpy_root, make_board, monkeypatch):
+        calls = {"git": 0, "glob": 0}
+
+        def fake_git_dir(_mpy_dir):
+            calls["git"] += 1
+            return None
+
+        def fake_glob(_pattern):
+            calls["glob"] += 1
+            return []
+
+        monkeypatch.setattr("mpbuild.build.get_main_git_directory", fake_git_dir)
+        monkeypatch.setattr("mpbuild.build.glob.glob", fake_glob)
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+        db = Database(mpy_root)
+
+        context = BuildContext.create(mpy_root)
+        for board in ("PYBV11", "NUCLEO_F401RE"):
+            docker_build_cmd(db.boards[board], do_clean=True, context=context)
+            docker_build_cmd(db.boards[board], context=context)
+
+        assert calls == {"git": 1, "glob": 2}  # two tty patterns, scanned once
+
+    def test_without_context_resolves_per_call(self, mpy_root, make_board, monkeypatch):
+        calls = []
+        monkeypatch.setattr("mpbuild.build.get_main_git_directory", calls.append)
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        docker_build_cmd(db.boards["PYBV11"])
+        docker_build_cmd(db.boards["PYBV11"])
+        assert len(calls) == 2
+
+    def test_idf_version_detected_once(self, mpy_root, make_board, monkeypatch):
+        calls = []
+
+        def fake_detect(_mpy_dir, mcu):
+            calls.append(mcu)
+            return "v5.4.1"
+
+        monkeypatch.setattr("mpbuild.build.detect_idf_version", fake_detect)
+        make_board("esp32", "ESP32_GENERIC", mcu="esp32")
+        board = Database(mpy_root).boards["ESP32_GENERIC"]
+        context = BuildContext.create(mpy_root)
+
+        assert context.build_container(board) == "espressif/idf:v5.4.1"
+        cmd = docker_build_cmd(board, context=context)
+        assert "espressif/idf:v5.4.1" in cmd
+        assert calls == ["esp32"]
+
+    def test_context_devices_and_worktree(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        db = Database(mpy_root)
+        context = BuildContext(
+            mpy_dir=mpy_root,
+            main_git_dir=Path("/src/mpy/.git"),
+            device_flags="--device /dev/ttyACM0 ",
+        )
+        cmd = docker_build_cmd(db.boards["PYBV11"], context=context)
+        assert "--device /dev/ttyACM0 " in cmd
+        assert "-v /src/mpy/.git:/src/mpy/.git " in cmd
+
+
+# ===================================================================
+# Runtimes — podman and native
+# ===================================================================
+class TestRuntimes:
+    @pytest.fixture
+    def pyb(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        return Database(mpy_root).boards["PYBV11"]
+
+    @pytest.fixture
+    def toolchain(self, monkeypatch):
+        found = {"arm-none-eabi-gcc": "/usr/bin/arm-none-eabi-gcc"}
+        monkeypatch.setattr("mpbuild.build.shutil.which", found.get)
+        return found
+
+    def test_default_from_environment(self, monkeypatch):
+        monkeypatch.delenv("MPBUILD_RUNTIME", raising=False)
+        assert default_runtime() is Runtime.docker
+        monkeypatch.setenv("MPBUILD_RUNTIME", "podman")
+        assert default_runtime() is Runtime.podman
+        monkeypatch.setenv("MPBUILD_RUNTIME", "lxc")
+        with pytest.raises(ValueError, match="MPBUILD_RUNTIME=lxc"):
+            default_runtime()
+
+    def test_podman(self, pyb, mpy_root):
+        context = BuildContext.create(mpy_root, runtime=Runtime.podman)
+        argv = docker_build_spec(pyb, docker_interactive=False, context=context).argv()
+        assert argv[:3] == ["podman", "run", "--rm"]
+        assert "micropython/build-micropython-arm" in argv
+        assert ("--userns=keep-id" in argv) == (os.getuid() != 0)
+
+    def test_podman_reuse(self, pyb, mpy_root):
+        context = BuildContext.create(mpy_root, runtime=Runtime.podman)
+        spec = docker_build_spec(pyb, reuse_container=True, context=context)
+        assert spec.argv()[:2] == ["podman", "exec"]
+        assert spec.keepalive_argv()[:2] == ["podman", "run"]
+        assert spec.command().startswith("podman container inspect ")
+
+    def test_native(self, pyb, mpy_root, toolchain):
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        spec = docker_build_spec(pyb, reuse_container=True, context=context)
+        assert not spec.reuse_container
+        argv = spec.argv()
+        assert argv[:2] == ["bash", "-c"]
+        script = argv[2]
+        assert "safe.directory" not in script
+        assert "git config --global" not in script
+        assert "GIT_CONFIG_KEY_0=submodule.fetchJobs" in script
+        assert "make -C ports/stm32 BOARD=PYBV11 submodules && " in script
+        assert "BUILD=build-native" in script
+        assert spec.command() == f"cd {mpy_root} && bash -c {shlex.quote(script)}"
+
+    def test_native_ccache_runs_from_host(self, pyb, mpy_root, toolchain):
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        spec = docker_build_spec(pyb, ccache=True, context=context)
+        assert f"{ccache_directory(NATIVE_IMAGE)}/run make -j" in spec.script
+        assert spec.mounts == [(str(mpy_root), str(mpy_root))]
+
+    def test_native_needs_toolchain(self, pyb, mpy_root, toolchain):
+        toolchain.clear()
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        with pytest.raises(MpbuildNotSupportedException, match="arm-none-eabi-gcc"):
+            docker_build_spec(pyb, context=context)
+
+    def test_native_image(self, pyb, mpy_root):
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        assert context.image(pyb) == NATIVE_IMAGE
+        assert context.image(pyb, build_container_override="custom/image") == NATIVE_IMAGE
+        assert BuildContext.create(mpy_root).image(pyb, None, "custom/image") == "custom/image"
+
+
+# ===================================================================
+# Phase lines — _PHASE_FUNCTION and parse_phase
+# ===================================================================
+class TestPhases:
+    def test_parse(self):
+        assert parse_phase("mpbuild-phase: build exited 2 after 41.250000s") == PhaseResult(
+            "build", 2, 41.25
+        )
+        assert parse_phase("compiling mpbuild-phase: build exited 2 after 1.0s") is None
+        assert parse_phase("make: *** [all] Error 2") is None
+
+    @pytest.mark.parametrize("bash4", [False, True])
+    def test_function_times_phase(self, bash4):
+        """Before bash 5 there's no EPOCHREALTIME; the times come from date."""
+        script = ("unset EPOCHREALTIME; " if bash4 else "") + _PHASE_FUNCTION
+        before = time.time()
+        proc = subprocess.run(
+            ["bash", "-c", script + "_mpbuild_phase build 'sleep 0.1; (exit 3)'"],
+            capture_output=True,
+            text=True,
+        )
+        (phase,) = [p for p in map(parse_phase, proc.stdout.splitlines()) if p is not None]
+        assert proc.returncode == 3
+        assert (phase.name, phase.returncode) == ("build", 3)
+        assert 0.1 <= phase.duration < 5
+        assert phase.start is not None
+        assert before - 1 < phase.start < time.time()
+
+    def test_format(self):
+        phases = [PhaseResult("clean", 0, 0.12), PhaseResult("build", 2, 41.3)]
+        assert format_phases(phases) == "clean ok (0.1s), build exit 2 (41.3s)"
+
+
+# ===================================================================
+# Memory limit and peak memory
+# ===================================================================
+class TestMemory:
+    @pytest.fixture
+    def pyb(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        return Database(mpy_root).boards["PYBV11"]
+
+    def test_fresh_container(self, pyb):
+        spec = docker_build_spec(pyb, memory_limit=2**31, report_memory=True)
+        assert spec.memory_limit == 2**31
+        assert "--memory 2147483648 " in spec.command()
+        assert "mpbuild-memory-peak" in spec.shell_script()
+
+    def test_not_for_reused_container(self, pyb):
+        spec = docker_build_spec(pyb, reuse_container=True, memory_limit=2**31, report_memory=True)
+        assert spec.memory_limit is None
+        assert "--memory" not in spec.command()
+        assert "mpbuild-memory-peak" not in spec.command()
+
+    def test_not_for_native(self, pyb, mpy_root, monkeypatch):
+        monkeypatch.setattr("mpbuild.build.shutil.which", lambda name: f"/usr/bin/{name}")
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+        spec = docker_build_spec(pyb, memory_limit=2**31, report_memory=True, context=context)
+        assert spec.memory_limit is None
+        assert "mpbuild-memory-peak" not in spec.shell_script()
+
+    def test_parse(self):
+        assert parse_peak_memory("mpbuild-memory-peak: 1610612736\n") == 1610612736
+        assert parse_peak_memory("mpbuild-phase: build exited 0 after 1.0s") is None
+
+    def test_parse_oom_kills(self):
+        assert parse_oom_kills("mpbuild-oom-kills: 2") == 2
+        assert parse_oom_kills("mpbuild-memory-peak: 2") is None
+
+    def test_parse_usage(self):
+        assert parse_cpu_time("mpbuild-cpu-usec: 2500000") == 2.5
+        assert parse_block_io("mpbuild-block-io: 4096 8192") == (4096, 8192)
+        assert parse_block_io("mpbuild-cpu-usec: 1") is None
+
+    def test_usage(self):
+        usage = ResourceUsage()
+        lines = ["mpbuild-memory-peak: 100", "mpbuild-block-io: 1 2", "make: done"]
+        assert [usage.update(line) for line in lines] == [True, True, False]
+        usage.add(ResourceUsage(50, 1, 2.0, 3, 4))
+        assert usage == ResourceUsage(100, 1, 2.0, 4, 6)
+        assert not ResourceUsage().known
+
+    def test_reported_to_timings_file(self, tmp_path):
+        """The usage lines go to the timings file, leaving the build's output alone."""
+        path = tmp_path / "phases"
+        script = f"MPBUILD_PHASES={path}; {_USAGE_TRAP}echo built; exit 3"
+        proc = subprocess.run(["bash", "-c", script], capture_output=True, text=True)
+        assert (proc.stdout, proc.returncode) == ("built\n", 3)
+        usage = ResourceUsage()
+        lines = path.read_text().splitlines() if path.exists() else []
+        assert all(usage.update(line) for line in lines)
+
+
+# ===================================================================
+# build_board running out of memory
+# ===================================================================
+class TestBuildBoardOutOfMemory:
+    @pytest.fixture
+    def spawned(self, mpy_root, make_board, monkeypatch):
+        """The specs build_board starts; each exits with the next of ``returncodes``."""
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        specs = []
+        returncodes = []
+
+        class Proc:
+            def __init__(self, spec, **_kwargs):
+                specs.append(spec)
+                self.returncode = returncodes.pop(0)
+
+            def wait(self):
+                return self.returncode
+
+        monkeypatch.setattr("mpbuild.runtimes.spawn", Proc)
+        monkeypatch.setattr("mpbuild.container_images.ensure_images", lambda *_a, **_kw: None)
+        monkeypatch.setattr("mpbuild.build.nprocs", 8)
+        monkeypatch.setattr("mpbuild.build.record_submodules", lambda *_: None)
+        return specs, returncodes
+
+    def test_retried_with_fewer_jobs(self, spawned, mpy_root, capsys):
+        specs, returncodes = spawned
+        returncodes += [OOM_EXIT_CODE, 0]
+        build_board("PYBV11", mpy_dir=mpy_root)
+        assert len(specs) == 2
+        assert "make -j 8 -C ports/stm32" in specs[0].script
+        assert "make -j 4 -C ports/stm32" in specs[1].script
+        assert "retrying with make -j 4" in capsys.readouterr().out
+
+    def test_gives_up(self, spawned, mpy_root, capsys):
+        specs, returncodes = spawned
+        returncodes += [OOM_EXIT_CODE] * (OOM_RETRIES + 1)
+        with pytest.raises(SystemExit) as exc:
+            build_board("PYBV11", mpy_dir=mpy_root)
+        assert exc.value.code == OOM_EXIT_CODE
+        assert len(specs) == OOM_RETRIES + 1
+        assert "ran out of memory (OOM-killed)" in capsys.readouterr().out
+
+    def test_duration_recorded(self, spawned, mpy_root):
+        _specs, returncodes = spawned
+        returncodes += [0]
+        build_board("PYBV11", mpy_dir=mpy_root)
+        assert len(DurationHistory().durations("PYBV11")) == 1
+
+    def test_other_failures_not_retried(self, spawned, mpy_root):
+        specs, returncodes = spawned
+        returncodes += [2]
+        with pytest.raises(SystemExit) as exc:
+            build_board("PYBV11", mpy_dir=mpy_root)
+        assert exc.value.code == 2
+        assert len(specs) == 1
+
+    def test_oom_kill_inside_container(
+        self, spawned, mpy_root, monkeypatch, capsys, _isolated_cache_dir
+    ):
+        """cc1 was OOM-killed and make failed normally: the usage trailer tells."""
+        specs, returncodes = spawned
+        returncodes += [2] * (OOM_RETRIES + 1)
+        from mpbuild import runtimes
+
+        proc = runtimes.spawn
+
+        def reporting(spec, **kwargs):
+            name = spec.timings_file.rpartition("/")[2]
+            (_isolated_cache_dir / "timings" / name).write_text("mpbuild-oom-kills: 1\n")
+            return proc(spec, **kwargs)
+
+        monkeypatch.setattr("mpbuild.runtimes.spawn", reporting)
+        with pytest.raises(SystemExit) as exc:
+            build_board("PYBV11", mpy_dir=mpy_root)
+        assert exc.value.code == 2
+        assert len(specs) == OOM_RETRIES + 1
+        assert "make -j 4 -C ports/stm32" in specs[1].script
+        out = capsys.readouterr().out
+        assert "retrying with make -j 4" in out
+        assert "ran out of memory (OOM-killed)" in out
@@ -0,0 +1,441 @@
+"""Tests for docker_engine — running builds through the Docker Engine API.
+
+The daemon is a small HTTP server on a unix socket in the test's temporary
+directory. It keeps containers in memory, records every request and "runs" a
+container by sending back a line of stdout and one of stderr, then exiting
+with the status the test chose.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socketserver
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from mpbuild.board_database import Database
+from mpbuild.build import ContainerSpec, docker_build_spec
+from mpbuild.docker_engine import (
+    DockerEngine,
+    DockerEngineError,
+    EngineProcess,
+    _connect,
+    container_config,
+    engine_from_env,
+)
+from mpbuild.runtimes import spawn
+
+
+def _frame(stream: int, data: bytes) -> bytes:
+    return bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, "big") + data
+
+
+class FakeContainer:
+    def __init__(self, config: dict, name: str | None):
+        self.config = config
+        self.name = name
+        self.started = threading.Event()
+        self.exited = threading.Event()
+        self.hold = threading.Event()
+        self.status: int | None = None
+        self.oom_killed = False
+
+
+class FakeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str):
+        super().__init__(path, FakeDaemonHandler)
+        self.requests: list[tuple[str, str]] = []
+        self.containers: dict[str, FakeContainer] = {}
+        self.execs: dict[str, dict] = {}
+        self.exit_code = 0
+        self.missing_images: set[str] = set()
+        self.oom_kill = False
+        """
+        Containers are OOM-killed.
+        """
+        self.block = False
+        """
+        Containers run until killed.
+        """
+
+    def find(self, ref: str) -> tuple[str, FakeContainer] | None:
+        for cid, container in self.containers.items():
+            if ref in (cid, container.name):
+                return cid, container
+        return None
+
+
+class FakeDaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeDaemon
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _reply(self, status: int, body: object = None) -> None:
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _hijack(self) -> None:
+        self.send_response(101, "UPGRADED")
+        self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Upgrade", "tcp")
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _run(self, container: FakeContainer, cmd: list[str]) -> None:
+        """Streams the "output" of ``cmd``, then exits."""
+        self.wfile.write(_frame(1, f"running {cmd[-1]}\n".encode()))
+        self.wfile.write(_frame(2, b"a warning\n"))
+        self.wfile.flush()
+        if self.server.block:
+            container.hold.wait(5)
+            if container.status is None:
+                container.status = 143
+        if self.server.oom_kill:
+            container.status, container.oom_killed = 137, True
+        if container.status is None:
+            container.status = self.server.exit_code
+        container.exited.set()
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
+
+    def _handle(self, method: str) -> None:
+        path, _, query = self.path.partition("?")
+        assert path.startswith("/v1.41/"), path
+        path = path.removeprefix("/v1.41")
+        self.server.requests.append((method, path))
+        body = self._body()
+        parts = path.strip("/").split("/")
+
+        if path == "/_ping":
+            data = b"OK"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == "/containers/create":
+            if body["Image"] in self.server.missing_images:
+                self._reply(404, {"message": f"No such image: {body['Image']}"})
+                return
+            name = query.removeprefix("name=") or None
+            if name and any(c.name == name for c in self.server.containers.values()):
+                self._reply(409, {"message": "Conflict"})
+                return
+            cid = f"c{len(self.server.containers)}"
+            self.server.containers[cid] = FakeContainer(body, name)
+            self._reply(201, {"Id": cid})
+        elif parts[0] == "containers" and len(parts) == 3:
+            found = self.server.find(parts[1])
+            if found is None:
+                self._reply(404, {"message": f"No such container: {parts[1]}"})
+                return
+            cid, container = found
+            action = parts[2]
+            if action == "json":
+                self._reply(
+                    200,
+                    {
+                        "Id": cid,
+                        "Name": container.name,
+                        "State": {"OOMKilled": container.oom_killed},
+                    },
+                )
+            elif action == "attach":
+                self._hijack()
+                container.started.wait(5)
+                self._run(container, container.config["Cmd"])
+            elif action == "start":
+                container.started.set()
+                self._reply(204)
+            elif action == "wait":
+                container.exited.wait(5)
+                self._reply(200, {"StatusCode": container.status})
+            elif action == "kill":
+                container.status = 137 if "SIGKILL" in query else 143
+                container.hold.set()
+                self._reply(204)
+            elif action == "exec":
+                eid = f"e{len(self.server.execs)}"
+                self.server.execs[eid] = {"container": cid, "config": body}
+                self._reply(201, {"Id": eid})
+            else:
+                self._reply(404, {"message": "unknown"})
+        elif method == "DELETE" and parts[0] == "containers":
+            self.server.containers.pop(parts[1], None)
+            self._reply(204)
+        elif parts[0] == "exec" and parts[2] == "start":
+            exec_ = self.server.execs[parts[1]]
+            self._hijack()
+            container = FakeContainer(exec_["config"], None)
+            self._run(container, exec_["config"]["Cmd"])
+            exec_["exit_code"] = container.status
+        elif parts[0] == "exec" and parts[2] == "json":
+            self._reply(200, {"ExitCode": self.server.execs[parts[1]]["exit_code"]})
+        else:
+            self._reply(404, {"message": "unknown"})
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    path = str(tmp_path / "docker.sock")
+    server = FakeDaemon(path)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{path}")
+    monkeypatch.delenv("MPBUILD_DOCKER_API", raising=False)
+    _connect.cache_clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+    _connect.cache_clear()
+
+
+@pytest.fixture
+def spec(tmp_path):
+    return ContainerSpec(
+        image="micropython/build-micropython-arm",
+        script="make -C ports/stm32 BOARD=PYBV11",
+        workdir=str(tmp_path),
+        uid=1000,
+        gid=1000,
+        mounts=[(str(tmp_path), str(tmp_path))],
+        devices=["/dev/ttyACM0"],
+        interactive=False,
+    )
+
+
+def _run(proc: EngineProcess | subprocess.Popen, out: Path) -> tuple[int, str]:
+    returncode = proc.wait(timeout=5)
+    return returncode, out.read_text()
+
+
+# ===================================================================
+# ContainerSpec
+# ===================================================================
+class TestContainerSpec:
+    def test_argv_keeps_script_as_one_argument(self, spec, tmp_path):
+        argv = spec.argv()
+        assert argv[:3] == ["docker", "run", "--rm"]
+        assert argv[-3:-1] == ["bash", "-c"]
+        assert argv[-1].endswith("make -C ports/stm32 BOARD=PYBV11")
+        assert argv[argv.index("--device") + 1] == "/dev/ttyACM0"
+        assert argv[argv.index("--user") + 1] == "1000:1000"
+
+    def test_command_round_trips(self, spec):
+        import shlex
+
+        assert shlex.split(spec.command()) == spec.argv()
+
+    def test_config_matches_argv(self, spec, tmp_path):
+        config = container_config(spec)
+        assert config["Cmd"] == spec.argv()[-3:]
+        assert config["User"] == "1000:1000"
+        assert config["HostConfig"]["Binds"] == [f"{tmp_path}:{tmp_path}"]
+        assert config["HostConfig"]["Devices"][0]["PathOnHost"] == "/dev/ttyACM0"
+        assert config["Env"] == ["HOME=/tmp"]
+
+    def test_memory_limit(self, spec):
+        spec.memory_limit = 3 * 1024**3
+        argv = spec.argv()
+        assert argv[argv.index("--memory") + 1] == str(3 * 1024**3)
+        assert container_config(spec)["HostConfig"]["Memory"] == 3 * 1024**3
+
+    def test_no_memory_limit(self, spec):
+        assert "--memory" not in spec.argv()
+        assert "Memory" not in container_config(spec)["HostConfig"]
+
+    def test_peak_memory_trap_keeps_exit_status(self, spec):
+        spec.script = "echo built; exit 3"
+        spec.report_memory = True
+        assert "mpbuild-memory-peak" in spec.shell_script()
+        proc = subprocess.run(["bash", "-c", spec.shell_script()], capture_output=True, text=True)
+        assert proc.returncode == 3
+        assert proc.stdout.startswith("built\n")
+
+    def test_quoting_survives_extra_args(self, mpy_root, make_board, monkeypatch):
+        monkeypatch.setattr("mpbuild.build.host_device_flags", lambda: "")
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        board = Database(mpy_root).boards["PYBV11"]
+        spec = docker_build_spec(board, extra_args=['CFLAGS_EXTRA="-DA=1 -DB=2"'])
+        assert spec.argv()[-1].endswith('CFLAGS_EXTRA="-DA=1 -DB=2"')
+
+
+# ===================================================================
+# Docker Engine API
+# ===================================================================
+class TestEngine:
+    def test_found_from_docker_host(self, daemon):
+        assert engine_from_env() is not None
+
+    def test_disabled_by_env(self, daemon, monkeypatch):
+        monkeypatch.setenv("MPBUILD_DOCKER_API", "0")
+        assert engine_from_env() is None
+
+    def test_tcp_docker_host_uses_cli(self, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "tcp://10.0.0.1:2375")
+        assert engine_from_env() is None
+
+    def test_no_socket(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/missing.sock")
+        assert engine_from_env() is None
+
+    def test_run_streams_output_and_exit_code(self, daemon, spec, tmp_path):
+        daemon.exit_code = 3
+        out = tmp_path / "log"
+        with out.open("w") as log:
+            proc = spawn(spec, stdout=log)
+            assert isinstance(proc, EngineProcess)
+            returncode, text = _run(proc, out)
+        assert returncode == 3
+        assert "running git config" in text
+        assert "make -C ports/stm32 BOARD=PYBV11" in text
+        assert "a warning" in text
+        ops = [(m, p.split("/")[-1]) for m, p in daemon.requests]
+        assert ops == [
+            ("GET", "_ping"),
+            ("POST", "create"),
+            ("POST", "attach"),
+            ("POST", "start"),
+            ("POST", "wait"),
+            ("GET", "json"),  # failed: was it OOM-killed?
+            ("DELETE", "c0"),
+        ]
+        assert daemon.containers == {}
+
+    def test_oom_killed(self, daemon, spec):
+        daemon.oom_kill = True
+        proc = spawn(spec, stdout=subprocess.PIPE)
+        assert isinstance(proc, EngineProcess)
+        assert proc.wait(timeout=5) == 137
+        assert proc.oom_killed
+        assert daemon.containers == {}
+
+    def test_failure_not_oom(self, daemon, spec):
+        daemon.exit_code = 2
+        proc = spawn(spec, stdout=subprocess.PIPE)
+        assert isinstance(proc, EngineProcess)
+        assert proc.wait(timeout=5) == 2
+        assert not proc.oom_killed
+
+    def test_pipe_text(self, daemon, spec):
+        proc = spawn(spec, stdout=subprocess.PIPE, text=True)
+        assert proc.stdout is not None
+        lines = list(proc.stdout)
+        assert proc.wait(timeout=5) == 0
+        assert lines[1] == "a warning\n"
+
+    def test_missing_image_raises(self, daemon, spec):
+        daemon.missing_images.add(spec.image)
+        with pytest.raises(DockerEngineError, match="No such image"):
+            spawn(spec)
+
+    def test_terminate_kills_container(self, daemon, spec):
+        daemon.block = True
+        proc = spawn(spec, stdout=subprocess.PIPE)
+        with pytest.raises(subprocess.TimeoutExpired):
+            proc.wait(timeout=0.1)
+        assert proc.poll() is None
+        proc.terminate()
+        # Removed before terminate() returns, not left to the attach thread.
+        assert daemon.containers == {}
+        assert proc.wait(timeout=5) == 143
+        assert ("POST", "/containers/c0/kill") in daemon.requests
+        assert ("DELETE", "/containers/c0") in daemon.requests
+
+    def test_kill_removes_container(self, daemon, spec, tmp_path):
+        daemon.block = True
+        out = tmp_path / "log"
+        with out.open("w") as log:
+            proc = spawn(spec, stdout=log)
+            proc.kill()
+            assert daemon.containers == {}
+            assert proc.wait(timeout=5) == 137
+        assert "docker engine" not in out.read_text()
+
+    def test_reused_container_started_once(self, daemon, spec, tmp_path):
+        spec.reuse_container = True
+        for _ in range(2):
+            proc = spawn(spec, stdout=subprocess.PIPE)
+            assert proc.wait(timeout=5) == 0
+            assert proc.stdout is not None
+            proc.stdout.close()
+        (keepalive,) = daemon.containers.values()
+        assert keepalive.name == spec.pool_name
+        assert keepalive.config["Labels"] == {"mpbuild.pool": "1"}
+        assert keepalive.config["HostConfig"]["AutoRemove"] is True
+        assert "User" not in keepalive.config
+        assert len(daemon.execs) == 2
+        exec_config = daemon.execs["e0"]["config"]
+        assert exec_config["User"] == "1000:1000"
+        assert "mpbuild-busy" in exec_config["Cmd"][-1]
+
+    def test_unreachable_socket(self, tmp_path):
+        engine = DockerEngine(str(tmp_path / "none.sock"))
+        assert not engine.ping()
+        with pytest.raises(DockerEngineError):
+            engine.create({"Image": "x"})
+
+
+# ===================================================================
+# docker CLI fallback
+# ===================================================================
+FAKE_DOCKER = """#!/bin/sh
+for arg in "$@"; do printf '%s\\n' "$arg"; done
+exit 4
+"""
+
+
+class TestCliFallback:
+    def test_argv_without_shell(self, spec, tmp_path, monkeypatch):
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "docker").write_text(FAKE_DOCKER)
+        (bin_dir / "docker").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("MPBUILD_DOCKER_API", "0")
+
+        out = tmp_path / "log"
+        with out.open("w") as log:
+            proc = spawn(spec, stdout=log)
+            assert isinstance(proc, subprocess.Popen)
+            returncode, text = _run(proc, out)
+        assert returncode == 4
+        assert text.splitlines() == spec.argv()[1:]
+
+    def test_interactive_uses_cli(self, daemon, spec, monkeypatch):
+        spec.interactive = True
+        popen = []
+        monkeypatch.setattr(
+            "mpbuild.runtimes.subprocess.Popen", lambda argv, **_: popen.append(argv)
+        )
+        spawn(spec)
+        assert popen == [spec.argv()]
+        assert "-it" in popen[0]
+        assert daemon.requests == []
@@ -0,0 +1,64 @@
+"""Tests for history — recorded build durations and the expected ones."""
+
+from __future__ import annotations
+
+from mpbuild.history import (
+    DEFAULT_DURATION,
+    DEFAULT_PORT_DURATION,
+    DURATION_HISTORY,
+    DurationHistory,
+)
+
+
+# ===================================================================
+# Estimates
+# ===================================================================
+class TestEstimate:
+    def test_port_defaults(self, tmp_path):
+        history = DurationHistory(tmp_path / "durations.json")
+        assert history.estimate("ESP32_GENERIC", "esp32") == DEFAULT_PORT_DURATION["esp32"]
+        assert history.estimate("standard", "unix") == DEFAULT_DURATION
+
+    def test_median_of_recorded(self, tmp_path):
+        history = DurationHistory(tmp_path / "durations.json")
+        for seconds in (100, 40, 45):
+            history.record("PYBV11", "stm32", seconds)
+        assert history.estimate("PYBV11", "stm32") == 45
+
+    def test_untimed_target_takes_port_average(self, tmp_path):
+        history = DurationHistory(tmp_path / "durations.json")
+        history.record("PYBV11", "stm32", 40)
+        history.record("PYBV11:DP", "stm32", 60)
+        history.record("RPI_PICO", "rp2", 500)
+        assert history.estimate("NUCLEO_F401RE", "stm32") == 50
+
+    def test_old_durations_age_out(self, tmp_path):
+        history = DurationHistory(tmp_path / "durations.json")
+        history.record("PYBV11", "stm32", 1000)
+        for _ in range(DURATION_HISTORY):
+            history.record("PYBV11", "stm32", 30)
+        assert history.durations("PYBV11") == [30] * DURATION_HISTORY
+
+
+# ===================================================================
+# Storage
+# ===================================================================
+class TestStorage:
+    def test_persisted(self, tmp_path):
+        DurationHistory(tmp_path / "durations.json").record("PYBV11", "stm32", 42.123)
+        assert DurationHistory(tmp_path / "durations.json").durations("PYBV11") == [42.1]
+
+    def test_merges_other_processes(self, tmp_path):
+        first = DurationHistory(tmp_path / "durations.json")
+        second = DurationHistory(tmp_path / "durations.json")
+        first.record("PYBV11", "stm32", 40)
+        second.record("RPI_PICO", "rp2", 90)
+        assert DurationHistory(tmp_path / "durations.json").durations("PYBV11") == [40]
+
+    def test_corrupt_file(self, tmp_path):
+        (tmp_path / "durations.json").write_text("[1, 2")
+        history = DurationHistory(tmp_path / "durations.json")
+        assert history.estimate("PYBV11", "stm32") == DEFAULT_PORT_DURATION["stm32"]
+
+    def test_in_cache_dir(self, _isolated_cache_dir):
+        assert DurationHistory().path == _isolated_cache_dir / "durations.json"
@@ -25,6 +25,12 @@ def _clear_caches():
     board_database.cache_clear()
 
 
+@pytest.fixture(autouse=True)
+def _images_present(monkeypatch):
+    """Builds find their image present; docker isn't asked."""
+    monkeypatch.setattr("mpbuild.interactive.ensure_images", lambda *_args, **_kwargs: None)
+
+
 @pytest.fixture
 def populated_mpy_root(mpy_root, make_board, monkeypatch):
     """An mpy_root with two ports / three boards, plus monkeypatched cwd so the
@@ -243,7 +249,7 @@ class FakeProc:
 
     def _iter_lines(self):
         for line in self._lines:
-            if self._terminate_event.is_set():
+            if self._terminated:
                 return
             yield line
         # No more input lines; simulate "still running" by blocking on the event
@@ -353,34 +359,130 @@ async def test_log_header_names_running_build(populated_mpy_root, monkeypatch):
         await pilot.pause(0.1)
 
 
-async def test_rebuild_runs_clean_then_build(populated_mpy_root, monkeypatch):
-    """Pressing `r` spawns two docker invocations in order: clean then build."""
-    cmds_seen: list[str] = []
+async def test_missing_image_pulled_before_build(populated_mpy_root, monkeypatch):
+    """The build image is checked, and pulled if missing, before the build starts."""
+    calls: list[str] = []
+
+    def fake_ensure(targets, console, **_kwargs):
+        calls.append(f"images {[(board.name, variant) for board, variant in targets]}")
+        console.print("pulled micropython/build-micropython-arm")
 
-    def fake_spawn(cmd: str):
-        cmds_seen.append(cmd)
-        # complete_with=0 so the first phase exits cleanly and the worker
-        # proceeds to the second phase without us having to call .terminate().
+    def fake_spawn(_spec):
+        calls.append("spawn")
         return FakeProc(lines=[], complete_with=0)
 
+    monkeypatch.setattr("mpbuild.interactive.ensure_images", fake_ensure)
     monkeypatch.setattr("mpbuild.interactive._spawn", fake_spawn)
     app = MpBuildApp()
     async with app.run_test() as pilot:
         await _select_pybv11(app, pilot)
+        await pilot.press("b")
+        await pilot.pause(0.3)
+
+        assert calls == ["images [('PYBV11', None)]", "spawn"]
+        log = app.query_one("#build-log", RichLog)
+        rendered = "\n".join(str(line.text) for line in log.lines)
+        assert "pulled micropython/build-micropython-arm" in rendered
+
+
+async def test_failed_pull_does_not_build(populated_mpy_root, monkeypatch):
+    """A pull that fails is reported and nothing is spawned."""
+    from mpbuild.container_images import MpbuildImageException
+
+    def fake_ensure(*_args, **_kwargs):
+        raise MpbuildImageException("Failed to pull: micropython/build-micropython-arm")
+
+    spawned: list[object] = []
+    monkeypatch.setattr("mpbuild.interactive.ensure_images", fake_ensure)
+    monkeypatch.setattr("mpbuild.interactive._spawn", spawned.append)
+    app = MpBuildApp()
+    async with app.run_test() as pilot:
+        await _select_pybv11(app, pilot)
+        await pilot.press("b")
+        await pilot.pause(0.3)
+
+        assert spawned == []
+        log = app.query_one("#build-log", RichLog)
+        rendered = "\n".join(str(line.text) for line in log.lines)
+        assert "Failed to pull" in rendered
+
+
+async def test_rebuild_cleans_on_host_then_builds(populated_mpy_root, monkeypatch):
+    """Pressing `r` removes the build directory on the host, as the CLI
+    does, then runs the build."""
+    from mpbuild.build import build_directory
+
+    specs = []
+
+    def fake_spawn(spec):
+        specs.append(spec)
+        return FakeProc(lines=["compiling foo.c"], complete_with=0)
+
+    monkeypatch.setattr("mpbuild.interactive._spawn", fake_spawn)
+    app = MpBuildApp()
+    async with app.run_test() as pilot:
+        await _select_pybv11(app, pilot)
+        board = app._selected_board
+        assert board is not None
+        directory = build_directory(board, None)
+        (directory / "obj").mkdir(parents=True)
         await pilot.press("r")
-        # Both phases run sequentially in the worker thread; give it time.
         await pilot.pause(0.3)
 
-        assert len(cmds_seen) == 2, f"expected 2 spawns, got {cmds_seen}"
-        # First phase is clean — docker_build_cmd skips mpy-cross + submodules.
-        assert "make -C mpy-cross" not in cmds_seen[0]
-        assert "BOARD=PYBV11" in cmds_seen[0]
-        # Second phase is build — full make path is present.
-        assert "make -C mpy-cross" in cmds_seen[1]
-        assert "BOARD=PYBV11" in cmds_seen[1]
+        assert not directory.exists()
+        assert len(specs) == 1, f"expected 1 spawn, got {specs}"
+        assert "BOARD=PYBV11 clean" not in specs[0].script
+        assert "make -C mpy-cross" in specs[0].script
 
-        # Log should contain both phase headers.
         log = app.query_one("#build-log", RichLog)
         rendered = "\n".join(str(line.text) for line in log.lines)
-        assert "Cleaning PYBV11" in rendered
-        assert "Building PYBV11" in rendered
+        assert "Rebuilding PYBV11" in rendered
+        assert "Removed ports/stm32/build-PYBV11" in rendered
+        assert "clean: ok" in rendered
+        assert "build: ok" in rendered
+
+
+async def test_rebuild_falls_back_to_container_clean(populated_mpy_root, monkeypatch):
+    """A build directory this user can't remove is cleaned in a container,
+    as root; if that fails the build doesn't run."""
+    specs = []
+
+    def fake_spawn(spec):
+        specs.append(spec)
+        return FakeProc(lines=[], complete_with=2)
+
+    monkeypatch.setattr("mpbuild.interactive.remove_build_directory", lambda _target: False)
+    monkeypatch.setattr("mpbuild.interactive._spawn", fake_spawn)
+    app = MpBuildApp()
+    async with app.run_test() as pilot:
+        await _select_pybv11(app, pilot)
+        await pilot.press("r")
+        await pilot.pause(0.3)
+
+        (spec,) = specs
+        assert spec.script.endswith("BOARD=PYBV11 clean")
+        assert spec.uid == 0
+        log = app.query_one("#build-log", RichLog)
+        rendered = "\n".join(str(line.text) for line in log.lines)
+        assert "cleaning in a container" in rendered
+        assert "clean: exit 2" in rendered
+        assert "Build skipped because clean failed." in rendered
+
+
+async def test_trace_written_after_each_build(populated_mpy_root, monkeypatch, tmp_path):
+    """With MPBUILD_TRACE set, a rebuild's phases end up in the trace."""
+    import json
+
+    path = tmp_path / "trace.json"
+    monkeypatch.setenv("MPBUILD_TRACE", str(path))
+    fake = FakeProc(lines=["compiling foo.c"], complete_with=0)
+    monkeypatch.setattr("mpbuild.interactive._spawn", lambda _spec: fake)
+    app = MpBuildApp()
+    async with app.run_test() as pilot:
+        await _select_pybv11(app, pilot)
+        await pilot.press("r")
+        await pilot.pause(0.3)
+
+    events = json.loads(path.read_text())["traceEvents"]
+    spans = [e["name"] for e in events if e["ph"] == "X"]
+    assert spans == ["PYBV11", "clean", "build"]
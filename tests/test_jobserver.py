@@ -0,0 +1,229 @@
+"""Tests for jobserver — the make jobserver shared between builds."""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from mpbuild.board_database import Database
+from mpbuild.build import BuildContext, docker_build_spec
+from mpbuild.jobserver import (
+    JOBSERVER_MOUNT,
+    Jobserver,
+    _cgroup_cpu_limit,
+    _cgroup_quota,
+    available_cpus,
+    jobserver_tokens,
+    shared_jobserver,
+)
+
+
+def _tokens_in(jobserver: Jobserver) -> int:
+    """Drains the FIFO without blocking and puts the tokens back."""
+    fd = os.open(jobserver.path, os.O_RDWR | os.O_NONBLOCK)
+    try:
+        try:
+            tokens = os.read(fd, 4096)
+        except BlockingIOError:
+            tokens = b""
+        os.write(fd, tokens)
+        return len(tokens)
+    finally:
+        os.close(fd)
+
+
+@pytest.fixture
+def jobserver(tmp_path):
+    jobserver = Jobserver(tmp_path / "cache", 4)
+    jobserver.open()
+    yield jobserver
+    jobserver.close()
+
+
+# ===================================================================
+# CPU limits
+# ===================================================================
+class TestCgroupLimits:
+    @pytest.mark.parametrize(
+        ("files", "expected"),
+        [
+            ({"cpu.max": "150000 100000\n"}, 1.5),
+            ({"cpu.max": "max 100000\n"}, None),
+            ({"cpu.cfs_quota_us": "200000\n", "cpu.cfs_period_us": "100000\n"}, 2.0),
+            ({"cpu.cfs_quota_us": "-1\n", "cpu.cfs_period_us": "100000\n"}, None),
+            ({}, None),
+        ],
+    )
+    def test_quota(self, tmp_path, files, expected):
+        for name, text in files.items():
+            (tmp_path / name).write_text(text)
+        assert _cgroup_quota(tmp_path) == expected
+
+    def test_tightest_parent_v2(self, tmp_path):
+        root = tmp_path / "cgroup"
+        (root / "ci/job").mkdir(parents=True)
+        (root / "ci/cpu.max").write_text("300000 100000\n")
+        (root / "ci/job/cpu.max").write_text("max 100000\n")
+        membership = tmp_path / "membership"
+        membership.write_text("0::/ci/job\n")
+        assert _cgroup_cpu_limit(root, membership) == 3.0
+
+    def test_v1_cpu_controller(self, tmp_path):
+        root = tmp_path / "cgroup"
+        (root / "cpu,cpuacct/docker/abc").mkdir(parents=True)
+        (root / "cpu,cpuacct/docker/abc/cpu.cfs_quota_us").write_text("50000\n")
+        (root / "cpu,cpuacct/docker/abc/cpu.cfs_period_us").write_text("100000\n")
+        membership = tmp_path / "membership"
+        membership.write_text("4:memory:/docker/abc\n3:cpu,cpuacct:/docker/abc\n")
+        assert _cgroup_cpu_limit(root, membership) == 0.5
+
+    def test_no_cgroups(self, tmp_path):
+        assert _cgroup_cpu_limit(tmp_path, tmp_path / "missing") is None
+
+    def test_available_cpus_capped(self, monkeypatch):
+        monkeypatch.setattr("mpbuild.jobserver.os.sched_getaffinity", lambda _pid: set(range(16)))
+        monkeypatch.setattr("mpbuild.jobserver._cgroup_cpu_limit", lambda: 2.5)
+        assert available_cpus() == 3
+        monkeypatch.setattr("mpbuild.jobserver._cgroup_cpu_limit", lambda: 0.2)
+        assert available_cpus() == 1
+        monkeypatch.setattr("mpbuild.jobserver._cgroup_cpu_limit", lambda: None)
+        assert available_cpus() == 16
+
+
+# ===================================================================
+# MPBUILD_JOBSERVER
+# ===================================================================
+class TestTokens:
+    def test_default_is_available_cpus(self, monkeypatch):
+        monkeypatch.delenv("MPBUILD_JOBSERVER")
+        monkeypatch.setattr("mpbuild.jobserver.available_cpus", lambda: 6)
+        assert jobserver_tokens() == 6
+
+    def test_explicit(self, monkeypatch):
+        monkeypatch.setenv("MPBUILD_JOBSERVER", " 12 ")
+        assert jobserver_tokens() == 12
+
+    def test_invalid(self, monkeypatch):
+        monkeypatch.setenv("MPBUILD_JOBSERVER", "lots")
+        with pytest.raises(ValueError, match="MPBUILD_JOBSERVER=lots"):
+            jobserver_tokens()
+
+    def test_off(self):
+        assert shared_jobserver() is None
+
+    def test_shared_once_per_process(self, monkeypatch, _isolated_cache_dir):
+        monkeypatch.setenv("MPBUILD_JOBSERVER", "3")
+        jobserver = shared_jobserver()
+        assert jobserver is not None
+        assert shared_jobserver() is jobserver
+        assert jobserver.path == _isolated_cache_dir / "jobserver"
+        assert _tokens_in(jobserver) == 2
+
+
+# ===================================================================
+# The FIFO
+# ===================================================================
+class TestJobserver:
+    def test_first_fills_tokens(self, jobserver):
+        assert jobserver.path.is_fifo()
+        assert _tokens_in(jobserver) == 3  # plus make's implicit job
+
+    def test_second_shares_without_refilling(self, jobserver):
+        taken = os.open(jobserver.path, os.O_RDWR)
+        os.read(taken, 1)  # a build is running with one token
+        other = Jobserver(jobserver.path.parent, 4)
+        other.open()
+        try:
+            assert _tokens_in(other) == 2
+        finally:
+            other.close()
+            os.close(taken)
+
+    def test_refilled_once_released(self, jobserver):
+        killed = os.open(jobserver.path, os.O_RDWR)
+        os.read(killed, 2)  # tokens a killed build never gave back
+        os.close(killed)
+        jobserver.close()
+        jobserver.open()
+        assert _tokens_in(jobserver) == 3
+
+    def test_replaces_stale_file(self, tmp_path):
+        (tmp_path / "jobserver").write_text("not a fifo")
+        jobserver = Jobserver(tmp_path, 2)
+        jobserver.open()
+        try:
+            assert jobserver.path.is_fifo()
+            assert _tokens_in(jobserver) == 1
+        finally:
+            jobserver.close()
+
+
+# ===================================================================
+# Builds using it
+# ===================================================================
+class TestBuildSpec:
+    @pytest.fixture
+    def pyb(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        return Database(mpy_root).boards["PYBV11"]
+
+    def test_mounted_in_container(self, pyb, mpy_root, jobserver):
+        context = BuildContext.create(mpy_root)
+        context.jobserver = jobserver
+        spec = docker_build_spec(pyb, context=context)
+        assert (str(jobserver.path), JOBSERVER_MOUNT) in spec.mounts
+        assert spec.script.startswith(
+            f'{{ exec 3<>{JOBSERVER_MOUNT} && export MAKEFLAGS="-j4 --jobserver-auth=3,3"; }}'
+        )
+        assert "make -C ports/stm32 BOARD=PYBV11" in spec.script
+        assert "make -j" not in spec.script
+
+    def test_not_for_clean(self, pyb, mpy_root, jobserver):
+        context = BuildContext.create(mpy_root)
+        context.jobserver = jobserver
+        spec = docker_build_spec(pyb, do_clean=True, context=context)
+        assert "jobserver" not in spec.script
+        assert not any(target == JOBSERVER_MOUNT for _, target in spec.mounts)
+
+    def test_without_jobserver(self, pyb, mpy_root):
+        spec = docker_build_spec(pyb, context=BuildContext.create(mpy_root, jobserver=True))
+        assert "MAKEFLAGS" not in spec.script
+        assert "make -j " in spec.script
+
+
+@pytest.mark.skipif(shutil.which("make") is None, reason="needs GNU make")
+class TestMakeConcurrency:
+    MAKEFILE = (
+        "all: " + " ".join(f"t{i}" for i in range(6)) + "\n"
+        "t%:\n\t@echo + >> $(LOG); sleep 0.2; echo - >> $(LOG)\n"
+    )
+
+    @staticmethod
+    def _most_at_once(log: Path) -> int:
+        running = most = 0
+        for line in log.read_text().split():
+            running += 1 if line == "+" else -1
+            most = max(most, running)
+        return most
+
+    def test_builds_share_tokens(self, tmp_path):
+        (tmp_path / "Makefile").write_text(self.MAKEFILE)
+        log = tmp_path / "log"
+        jobserver = Jobserver(tmp_path / "cache", 3)
+        jobserver.open()
+        try:
+            script = (
+                f'exec 3<>{jobserver.path} && export MAKEFLAGS="-j3 --jobserver-auth=3,3" && '
+                f"make -s -C {tmp_path} LOG={log}"
+            )
+            builds = [subprocess.Popen(["bash", "-c", script]) for _ in range(2)]
+            assert [b.wait(timeout=30) for b in builds] == [0, 0]
+            # 2 tokens plus one implicit job per build, rather than 2 x 3
+            assert self._most_at_once(log) <= 4
+            assert _tokens_in(jobserver) == 2
+        finally:
+            jobserver.close()
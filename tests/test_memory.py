@@ -0,0 +1,136 @@
+"""Tests for memory — the memory estimates and budget of batch builds."""
+
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from mpbuild.memory import (
+    DEFAULT_MEMORY,
+    GIB,
+    MEMORY_HISTORY,
+    MIB,
+    MemoryBudget,
+    MemoryModel,
+    default_memory_budget,
+    format_size,
+    memory_limit,
+    parse_size,
+)
+
+
+# ===================================================================
+# Sizes
+# ===================================================================
+class TestSizes:
+    @pytest.mark.parametrize(
+        ("text", "expected"),
+        [
+            ("1024", 1024),
+            ("512M", 512 * MIB),
+            ("12G", 12 * GIB),
+            ("1.5g", int(1.5 * GIB)),
+            ("2GiB", 2 * GIB),
+            (" 64 kb ", 64 * 1024),
+        ],
+    )
+    def test_parse(self, text, expected):
+        assert parse_size(text) == expected
+
+    @pytest.mark.parametrize("text", ["", "lots", "12X", "-1G"])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError, match="not a size"):
+            parse_size(text)
+
+    def test_format(self):
+        assert format_size(int(1.5 * GIB)) == "1.5G"
+        assert format_size(300 * MIB) == "300M"
+
+
+# ===================================================================
+# Budget and limits
+# ===================================================================
+class TestBudget:
+    def test_default_from_physical_memory(self, monkeypatch):
+        monkeypatch.setattr("mpbuild.memory.physical_memory", lambda: 16 * GIB)
+        assert default_memory_budget() == int(16 * GIB * 0.85)
+
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("MPBUILD_MEMORY_BUDGET", "12G")
+        assert default_memory_budget() == 12 * GIB
+
+    def test_off(self, monkeypatch):
+        monkeypatch.setenv("MPBUILD_MEMORY_BUDGET", "0")
+        assert default_memory_budget() is None
+
+    def test_limit(self):
+        assert memory_limit(GIB, None) == 2 * GIB
+        assert memory_limit(GIB, 8 * GIB) == 2 * GIB
+        assert memory_limit(4 * GIB, 6 * GIB) == 6 * GIB
+
+    def test_admits_what_fits(self):
+        budget = MemoryBudget(3 * GIB)
+        with budget.reserve(GIB), budget.reserve(2 * GIB):
+            assert budget.reserved == 3 * GIB
+        assert budget.reserved == 0
+
+    def test_waits_for_memory(self):
+        budget = MemoryBudget(3 * GIB)
+        started = threading.Event()
+
+        def second():
+            with budget.reserve(2 * GIB):
+                started.set()
+
+        with budget.reserve(2 * GIB):
+            thread = threading.Thread(target=second)
+            thread.start()
+            time.sleep(0.05)
+            assert not started.is_set()
+        thread.join(timeout=5)
+        assert started.is_set()
+
+    def test_too_big_runs_alone(self):
+        budget = MemoryBudget(GIB)
+        with budget.reserve(4 * GIB):
+            assert budget.reserved == 4 * GIB
+
+
+# ===================================================================
+# Estimates
+# ===================================================================
+class TestModel:
+    def test_defaults(self, tmp_path):
+        model = MemoryModel(tmp_path / "memory.json")
+        assert model.estimate("esp32") == 4 * GIB
+        assert model.estimate("unix") == DEFAULT_MEMORY
+
+    def test_measured_peaks(self, tmp_path):
+        model = MemoryModel(tmp_path / "memory.json")
+        model.record("esp32", 3 * GIB)
+        model.record("esp32", 2 * GIB)
+        assert model.estimate("esp32") == 3 * GIB
+        assert MemoryModel(tmp_path / "memory.json").estimate("esp32") == 3 * GIB
+
+    def test_old_peaks_age_out(self, tmp_path):
+        model = MemoryModel(tmp_path / "memory.json")
+        model.record("stm32", 5 * GIB)
+        for _ in range(MEMORY_HISTORY):
+            model.record("stm32", GIB)
+        assert model.estimate("stm32") == GIB
+
+    def test_merges_other_processes(self, tmp_path):
+        first = MemoryModel(tmp_path / "memory.json")
+        second = MemoryModel(tmp_path / "memory.json")
+        first.record("rp2", GIB)
+        second.record("stm32", GIB)
+        assert MemoryModel(tmp_path / "memory.json").estimate("rp2") == GIB
+
+    def test_corrupt_file(self, tmp_path):
+        (tmp_path / "memory.json").write_text("{")
+        assert MemoryModel(tmp_path / "memory.json").estimate("rp2") == 2 * GIB
+
+    def test_in_cache_dir(self, _isolated_cache_dir):
+        assert MemoryModel().path == _isolated_cache_dir / "memory.json"
@@ -0,0 +1,173 @@
+"""Tests for plan — the dry-run build plan."""
+
+from __future__ import annotations
+
+import json
+import subprocess
+
+import pytest
+
+from mpbuild import Runtime
+from mpbuild.batch import select_targets
+from mpbuild.board_database import Database
+from mpbuild.build import build_directory
+from mpbuild.find_boards import find_mpy_root
+from mpbuild.history import DurationHistory
+from mpbuild.plan import build_plan, print_plan
+from mpbuild.results import store
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches(monkeypatch):
+    from mpbuild import board_database
+
+    monkeypatch.setattr("mpbuild.build.host_device_flags", lambda: "")
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+    yield
+    find_mpy_root.cache_clear()
+    board_database.cache_clear()
+
+
+@pytest.fixture
+def db(mpy_root, make_board, make_lockfile):
+    make_board("stm32", "PYBV11", mcu="stm32f4", variants={"DP": "Double"})
+    make_board("stm32", "NUCLEO_F401RE", mcu="stm32f4")
+    make_board("rp2", "RPI_PICO", mcu="rp2040")
+    make_board("esp32", "ESP32_GENERIC", mcu="esp32")
+    make_lockfile(
+        "esp32", "dependencies:\n  idf:\n    source:\n      type: idf\n    version: 5.5.1\n"
+    )
+    return Database(mpy_root)
+
+
+def _plan(db, *names, **kwargs):
+    targets = select_targets(db, names)
+    return build_plan(targets, db.mpy_root_directory, **kwargs)
+
+
+class TestBuildPlan:
+    def test_target_shape(self, db, mpy_root):
+        plan = _plan(db, "PYBV11:DP")
+        assert plan["images"] == ["micropython/build-micropython-arm"]
+        (target,) = plan["targets"]
+        assert target["target"] == "PYBV11:DP"
+        assert target["variant"] == "DP"
+        assert target["idf_version"] is None
+        assert target["argv"][:3] == ["docker", "run", "--rm"]
+        assert "-it" not in target["argv"]
+        assert target["argv"][-2] == "-c"
+        assert "BOARD=PYBV11 BOARD_VARIANT=DP" in target["argv"][-1]
+        assert {"source": str(mpy_root), "target": str(mpy_root)} in target["mounts"]
+        assert target["phases"] == ["mpy-cross", "submodules", "build"]
+        assert target["build_dir"] == str(build_directory(db.boards["PYBV11"], "DP"))
+
+    def test_esp32_idf_version(self, db):
+        (target,) = _plan(db, "ESP32_GENERIC")["targets"]
+        assert target["image"] == "espressif/idf:v5.5.1"
+        assert target["idf_version"] == "v5.5.1"
+        # cmake ports build mpy-cross themselves
+        assert target["cache"]["mpy_cross"] is None
+        assert "mpy-cross" not in target["phases"]
+
+    def test_cache_dir_untouched(self, db, _isolated_cache_dir):
+        before = sorted(_isolated_cache_dir.rglob("*"))
+        (target,) = _plan(db, "PYBV11", ccache=True)["targets"]
+        assert any(m["target"] == "/ccache" for m in target["mounts"])
+        assert sorted(_isolated_cache_dir.rglob("*")) == before
+
+    def test_images_distinct(self, db):
+        plan = _plan(db, "PYBV11", "NUCLEO_F401RE", "RPI_PICO")
+        assert plan["images"] == [
+            "micropython/build-micropython-arm",
+            "micropython/build-micropython-arm:bookworm",
+        ]
+
+    def test_ignores_reuse_container(self, db, monkeypatch):
+        monkeypatch.setenv("MPBUILD_REUSE_CONTAINER", "1")
+        (target,) = _plan(db, "PYBV11")["targets"]
+        assert target["argv"][:2] == ["docker", "run"]
+
+    def test_result_cache_hit(self, db, monkeypatch):
+        monkeypatch.setattr("mpbuild.plan.source_state", lambda _: {"tree": "t", "dirty": {}})
+        (target,) = _plan(db, "PYBV11")["targets"]
+        assert target["cache"]["result"] is False
+
+        build_dir = build_directory(db.boards["PYBV11"])
+        build_dir.mkdir()
+        (build_dir / "firmware.dfu").write_bytes(b"fw")
+        assert store(target["result_key"], db.boards["PYBV11"])
+        (target,) = _plan(db, "PYBV11")["targets"]
+        assert target["cache"]["result"] is True
+
+    def test_not_a_git_checkout_has_no_result_key(self, db):
+        (target,) = _plan(db, "PYBV11")["targets"]
+        assert target["result_key"] is None
+        assert target["cache"]["result"] is False
+
+    def test_native(self, db, monkeypatch):
+        monkeypatch.setattr("mpbuild.build.shutil.which", lambda name: f"/usr/bin/{name}")
+        plan = _plan(db, "PYBV11", "RPI_PICO", runtime=Runtime.native)
+        assert plan["runtime"] == "native"
+        assert plan["images"] == ["native"]
+        assert all(t["argv"][:2] == ["bash", "-c"] for t in plan["targets"])
+
+    def test_native_toolchain_missing(self, db, mpy_root, monkeypatch, capsys):
+        monkeypatch.setattr("mpbuild.build.shutil.which", lambda _name: None)
+        with pytest.raises(SystemExit):
+            print_plan(["PYBV11"], mpy_dir=mpy_root, runtime=Runtime.native)
+        assert "arm-none-eabi-gcc is not on PATH" in capsys.readouterr().out
+
+    def test_subprocesses_independent_of_target_count(self, db, monkeypatch):
+        calls = []
+        run = subprocess.run
+
+        def counting_run(*args, **kwargs):
+            calls.append(args[0])
+            return run(*args, **kwargs)
+
+        monkeypatch.setattr(subprocess, "run", counting_run)
+        _plan(db, "PYBV11")
+        one = len(calls)
+        calls.clear()
+        _plan(db, "PYBV11", "PYBV11:DP", "NUCLEO_F401RE", "RPI_PICO", "ESP32_GENERIC")
+        assert len(calls) == one
+
+    def test_expected_duration(self, db):
+        DurationHistory().record("PYBV11", "stm32", 42)
+        plan = _plan(db, "PYBV11", "RPI_PICO")
+        assert [t["expected_duration"] for t in plan["targets"]] == [42.0, 150.0]
+        assert plan["expected_duration"] == 192.0
+        assert plan["shard"] is None
+
+    def test_shard(self, db):
+        assert _plan(db, "PYBV11", shard=(2, 3))["shard"] == "2/3"
+
+
+class TestPrintPlan:
+    def test_json(self, db, mpy_root, capsys):
+        plan = print_plan(["PYBV11"], as_json=True, mpy_dir=mpy_root)
+        assert json.loads(capsys.readouterr().out) == plan
+
+    def test_table(self, db, mpy_root, capsys):
+        print_plan(port="stm32", mpy_dir=mpy_root)
+        out = capsys.readouterr().out
+        assert "PYBV11" in out
+        assert "NUCLEO_F401RE" in out
+
+    def test_empty_selection(self, db, mpy_root, capsys):
+        with pytest.raises(SystemExit):
+            print_plan(mpy_dir=mpy_root)
+        assert "Nothing to plan" in capsys.readouterr().out
+
+    def test_shard(self, db, mpy_root, tmp_path):
+        durations = tmp_path / "durations.json"
+        shards = [
+            print_plan(
+                port="stm32", as_json=True, mpy_dir=mpy_root, shard=f"{i}/2", durations=durations
+            )
+            for i in (1, 2)
+        ]
+        assert [p["shard"] for p in shards] == ["1/2", "2/2"]
+        planned = [t["target"] for p in shards for t in p["targets"]]
+        assert sorted(planned) == ["NUCLEO_F401RE", "PYBV11"]
@@ -0,0 +1,217 @@
+"""Tests for results — the firmware result cache keyed on build inputs."""
+
+from __future__ import annotations
+
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from mpbuild.board_database import Database
+from mpbuild.build import NATIVE_IMAGE
+from mpbuild.results import cache_key, restore, source_state, store
+
+
+def _git(cwd: Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def repo(mpy_root, make_board):
+    """The synthetic MicroPython tree, committed, with build dirs ignored."""
+    make_board("rp2", "RPI_PICO", mcu="rp2040")
+    (mpy_root / ".gitignore").write_text("build-*/\n")
+    (mpy_root / "py.c").write_text("int x;\n")
+    _git(mpy_root, "init", "-q")
+    _git(mpy_root, "add", ".")
+    _git(mpy_root, "commit", "-q", "-m", "initial")
+    return mpy_root
+
+
+@pytest.fixture
+def pico(repo):
+    return Database(repo).boards["RPI_PICO"]
+
+
+def _key(repo, board, variant=None, extra_args=(), image="img"):
+    state = source_state(repo)
+    assert state is not None
+    return cache_key(state, board, variant, list(extra_args), image)
+
+
+# ===================================================================
+# source_state / cache_key
+# ===================================================================
+class TestCacheKey:
+    def test_not_a_git_checkout(self, mpy_root):
+        assert source_state(mpy_root) is None
+
+    def test_stable_for_unchanged_tree(self, repo, pico):
+        assert _key(repo, pico) == _key(repo, pico)
+
+    def test_build_output_ignored(self, repo, pico):
+        before = _key(repo, pico)
+        build_dir = repo / "ports" / "rp2" / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        assert _key(repo, pico) == before
+
+    def test_dirty_file_contents_count(self, repo, pico):
+        clean = _key(repo, pico)
+        (repo / "py.c").write_text("int y;\n")
+        dirty = _key(repo, pico)
+        (repo / "py.c").write_text("int z;\n")
+        assert len({clean, dirty, _key(repo, pico)}) == 3
+
+    def test_untracked_and_deleted_files_count(self, repo, pico):
+        clean = _key(repo, pico)
+        (repo / "new.c").write_text("")
+        untracked = _key(repo, pico)
+        (repo / "new.c").unlink()
+        (repo / "py.c").unlink()
+        assert len({clean, untracked, _key(repo, pico)}) == 3
+
+    def test_commit_changes_key(self, repo, pico):
+        (repo / "py.c").write_text("int y;\n")
+        dirty = _key(repo, pico)
+        _git(repo, "commit", "-q", "-am", "change")
+        assert _key(repo, pico) != dirty
+
+    @pytest.mark.parametrize(
+        "change",
+        [dict(variant="RISCV"), dict(extra_args=["DEBUG=1"]), dict(image="other")],
+    )
+    def test_build_inputs_change_key(self, repo, pico, change):
+        assert _key(repo, pico, **change) != _key(repo, pico)
+
+    @pytest.mark.parametrize("args", [["deploy"], ["clean"], ["DEBUG=1", "erase"], ["-B"]])
+    def test_make_goals_not_cached(self, repo, pico, args):
+        assert _key(repo, pico, extra_args=args) is None
+
+    def test_named_files_count(self, repo, pico):
+        manifest = repo / "build-manifest.py"  # git-ignored
+        manifest.write_text("freeze('a')\n")
+        args = ["FROZEN_MANIFEST=../../build-manifest.py"]
+        before = _key(repo, pico, extra_args=args)
+        manifest.write_text("freeze('b')\n")
+        assert _key(repo, pico, extra_args=args) not in {before, None}
+
+    def test_named_directories_count(self, repo, pico):
+        module = repo / "build-modules" / "example"
+        module.mkdir(parents=True)
+        (module / "example.c").write_text("int a;\n")
+        args = [f"USER_C_MODULES={repo / 'build-modules'}"]
+        before = _key(repo, pico, extra_args=args)
+        (module / "example.c").write_text("int b;\n")
+        assert _key(repo, pico, extra_args=args) not in {before, None}
+
+    def test_files_outside_tree_not_cached(self, repo, pico, tmp_path_factory):
+        manifest = tmp_path_factory.mktemp("elsewhere") / "manifest.py"
+        manifest.write_text("")
+        assert _key(repo, pico, extra_args=[f"FROZEN_MANIFEST={manifest}"]) is None
+
+    def test_native_keyed_on_toolchain_version(self, repo, pico, tmp_path_factory, monkeypatch):
+        bin_dir = tmp_path_factory.mktemp("bin")
+        gcc = bin_dir / "arm-none-eabi-gcc"
+        gcc.write_text("#!/bin/sh\necho 'arm-none-eabi-gcc 13.2.1'\n")
+        gcc.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        before = _key(repo, pico, image=NATIVE_IMAGE)
+        gcc.write_text("#!/bin/sh\necho 'arm-none-eabi-gcc 14.2.1'\n")
+        assert _key(repo, pico, image=NATIVE_IMAGE) not in {before, None}
+
+    def test_native_without_toolchain_not_cached(self, repo, pico, monkeypatch):
+        monkeypatch.setattr("mpbuild.build.shutil.which", lambda name: None)
+        assert _key(repo, pico, image=NATIVE_IMAGE) is None
+
+
+# ===================================================================
+# store / restore
+# ===================================================================
+class TestStoreRestore:
+    def test_round_trip(self, repo, pico, _isolated_cache_dir):
+        build_dir = repo / "ports" / "rp2" / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        (build_dir / "firmware.elf").write_bytes(b"elf")
+        (build_dir / "firmware.elf").chmod(0o755)
+        key = _key(repo, pico)
+        assert store(key, pico)
+
+        for f in build_dir.iterdir():
+            f.unlink()
+        restored = restore(key, pico)
+
+        assert restored == [build_dir / "firmware.uf2", build_dir / "firmware.elf"]
+        assert (build_dir / "firmware.uf2").read_bytes() == b"uf2"
+        assert (build_dir / "firmware.elf").stat().st_mode & 0o777 == 0o755
+        objects = list((_isolated_cache_dir / "results" / "objects").rglob("*"))
+        assert len([o for o in objects if o.is_file()]) == 2
+
+    def test_restores_only_recorded_files(self, repo, pico):
+        build_dir = repo / "ports" / "rp2" / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        key = _key(repo, pico)
+        assert store(key, pico)
+
+        # Left over from another build, and not part of this result.
+        (build_dir / "firmware.elf").write_bytes(b"stale")
+        assert restore(key, pico) == [build_dir / "firmware.uf2"]
+
+    def test_miss(self, repo, pico):
+        assert restore(_key(repo, pico), pico) is None
+
+    def test_nothing_to_store(self, repo, pico):
+        assert not store(_key(repo, pico), pico)
+
+    def test_missing_object_is_a_miss(self, repo, pico, _isolated_cache_dir):
+        build_dir = repo / "ports" / "rp2" / "build-RPI_PICO"
+        build_dir.mkdir()
+        (build_dir / "firmware.uf2").write_bytes(b"uf2")
+        key = _key(repo, pico)
+        store(key, pico)
+        for o in (_isolated_cache_dir / "results" / "objects").rglob("*"):
+            if o.is_file():
+                o.unlink()
+        assert restore(key, pico) is None
+
+
+# ===================================================================
+# build_board
+# ===================================================================
+class TestBuildBoard:
+    def test_deploy_always_runs(self, repo, pico, monkeypatch, _isolated_cache_dir):
+        from mpbuild.build import build_board
+
+        spawned = []
+
+        class Proc:
+            returncode = 0
+
+            def __init__(self, spec, **_kwargs):
+                spawned.append(spec)
+
+            def wait(self):
+                return 0
+
+        def restore_anything(key, board, variant=None):
+            raise AssertionError(f"restored {key}")
+
+        monkeypatch.setattr("mpbuild.build.host_device_flags", lambda: "")
+        monkeypatch.setattr("mpbuild.build.glob.glob", lambda _pattern: [])
+        monkeypatch.setattr("mpbuild.runtimes.spawn", Proc)
+        monkeypatch.setattr("mpbuild.container_images.ensure_images", lambda *_a, **_kw: None)
+        monkeypatch.setattr("mpbuild.build.record_submodules", lambda *_: None)
+        monkeypatch.setattr("mpbuild.results.restore", restore_anything)
+
+        build_board("RPI_PICO", extra_args=["deploy"], mpy_dir=repo)
+        build_board("RPI_PICO", extra_args=["deploy"], mpy_dir=repo)
+        assert len(spawned) == 2
+        assert all("deploy" in spec.script for spec in spawned)
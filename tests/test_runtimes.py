@@ -0,0 +1,69 @@
+"""Tests for runtimes — starting a build with docker, podman or natively."""
+
+from __future__ import annotations
+
+import subprocess
+
+import pytest
+
+from mpbuild import Runtime
+from mpbuild.build import ContainerSpec
+from mpbuild.runtimes import spawn
+
+
+@pytest.fixture
+def spec(tmp_path):
+    return ContainerSpec(
+        image="micropython/build-micropython-arm",
+        script="pwd; echo building >&2; exit 3",
+        workdir=str(tmp_path),
+        uid=1000,
+        gid=1000,
+        mounts=[(str(tmp_path), str(tmp_path))],
+        interactive=False,
+    )
+
+
+@pytest.fixture
+def no_engine(monkeypatch):
+    """Fails the test if the Docker Engine API is consulted."""
+
+    def engine_from_env():
+        raise AssertionError("the Docker Engine API was used")
+
+    monkeypatch.setattr("mpbuild.runtimes.engine_from_env", engine_from_env)
+
+
+@pytest.fixture
+def popen(monkeypatch):
+    calls = []
+
+    def fake(argv, **kwargs):
+        calls.append((argv, kwargs))
+
+    monkeypatch.setattr("mpbuild.runtimes.subprocess.Popen", fake)
+    return calls
+
+
+class TestSpawn:
+    def test_native_runs_in_workdir(self, spec, tmp_path, no_engine):
+        spec.runtime = Runtime.native
+        proc = spawn(spec, stdout=subprocess.PIPE, text=True)
+        assert isinstance(proc, subprocess.Popen)
+        out, _ = proc.communicate(timeout=5)
+        assert proc.returncode == 3
+        assert out.splitlines() == [str(tmp_path), "building"]
+
+    def test_podman_uses_cli(self, spec, no_engine, popen):
+        spec.runtime = Runtime.podman
+        spawn(spec)
+        ((argv, kwargs),) = popen
+        assert argv == spec.argv()
+        assert argv[:2] == ["podman", "run"]
+        assert kwargs["cwd"] is None
+
+    def test_docker_without_engine_uses_cli(self, spec, popen, monkeypatch):
+        monkeypatch.setattr("mpbuild.runtimes.engine_from_env", lambda: None)
+        spawn(spec)
+        ((argv, _),) = popen
+        assert argv[:2] == ["docker", "run"]
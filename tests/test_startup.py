@@ -0,0 +1,122 @@
+"""Startup-cost regression tests.
+
+mpbuild is embedded as a library and runs on every shell TAB press, so
+`import mpbuild` and `mpbuild --version` must not drag in the CLI, docker
+helpers or their dependencies. Each check runs in a fresh interpreter so the
+result doesn't depend on what other tests have already imported.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import subprocess
+import sys
+
+import pytest
+
+import mpbuild
+
+# Modules that must only be loaded on first use.
+HEAVY_MODULES = [
+    "typer",
+    "click",
+    "rich",
+    "textual",
+    "urllib.request",
+    "importlib.metadata",
+    "dataclasses",
+    "mpbuild.board_database",
+    "mpbuild.build",
+    "mpbuild.check_images",
+    "mpbuild.cli",
+    "mpbuild.interactive",
+    "mpbuild.list_boards",
+]
+
+# Generous: the package import itself is ~1-2 ms. This catches a heavy
+# dependency sneaking back in, not small fluctuations.
+IMPORT_BUDGET_US = 50_000
+
+
+def _run(code: str, *args: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _loaded(modules: list[str]) -> list[str]:
+    return [m for m in HEAVY_MODULES if m in modules]
+
+
+class TestImportMpbuild:
+    def test_no_heavy_modules(self):
+        """`import mpbuild` loads only the package itself."""
+        proc = _run("import json, sys, mpbuild; print(json.dumps(sorted(sys.modules)))")
+        modules = json.loads(proc.stdout)
+        assert _loaded(modules) == []
+        assert [m for m in modules if m.startswith("mpbuild")] == ["mpbuild"]
+
+    def test_import_time(self):
+        """Cumulative import time of the package stays within budget."""
+        proc = _run("import mpbuild", "-X", "importtime")
+        match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| mpbuild$", proc.stderr, re.M)
+        assert match, proc.stderr
+        assert int(match.group(1)) < IMPORT_BUDGET_US
+
+    def test_version_entry_point(self):
+        """`mpbuild --version` answers without loading typer."""
+        code = (
+            "import json, sys\n"
+            "sys.argv = ['mpbuild', '--version']\n"
+            "from mpbuild.__main__ import main\n"
+            "main()\n"
+            "print(json.dumps(sorted(sys.modules)), file=sys.stderr)\n"
+        )
+        proc = _run(code)
+        assert proc.stdout == f"mpbuild v{mpbuild.__version__}\n"
+        assert _loaded(json.loads(proc.stderr)) == ["importlib.metadata"]
+
+    def test_cli_import_defers_commands(self):
+        """Importing the CLI doesn't import the command implementations."""
+        proc = _run("import json, sys, mpbuild.cli; print(json.dumps(sorted(sys.modules)))")
+        loaded = _loaded(json.loads(proc.stdout))
+        assert "mpbuild.build" not in loaded
+        assert "mpbuild.check_images" not in loaded
+        assert "urllib.request" not in loaded
+        assert "textual" not in loaded
+
+
+class TestLazyAttributes:
+    def test_database(self):
+        from mpbuild.board_database import Database
+
+        assert mpbuild.Database is Database
+
+    def test_find_mpy_root(self):
+        from mpbuild.find_boards import find_mpy_root
+
+        assert mpbuild.find_mpy_root is find_mpy_root
+
+    def test_version(self):
+        assert isinstance(mpbuild.__version__, str)
+
+    def test_unknown_attribute(self):
+        with pytest.raises(AttributeError, match="no_such_thing"):
+            _ = mpbuild.no_such_thing
+
+    def test_dir_lists_lazy_attributes(self):
+        assert {"Database", "find_mpy_root", "__version__"} <= set(dir(mpbuild))
+
+    def test_board_database_stays_the_factory(self):
+        """Importing the board_database submodule must not replace the
+        `mpbuild.board_database()` factory of the same name."""
+        code = (
+            "import mpbuild, mpbuild.board_database\n"
+            "from mpbuild import board_database\n"
+            "print(callable(board_database) and hasattr(board_database, 'cache_clear'))\n"
+        )
+        assert _run(code).stdout == "True\n"
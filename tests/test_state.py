@@ -0,0 +1,52 @@
+"""Tests for state — the persistent state directory and its JSON helpers."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from mpbuild.state import cache_dir, read_json, write_json
+
+
+class TestCacheDir:
+    def test_env_override(self, monkeypatch, tmp_path):
+        """MPBUILD_CACHE_DIR wins over everything else."""
+        monkeypatch.setenv("MPBUILD_CACHE_DIR", str(tmp_path))
+        assert cache_dir() == tmp_path
+
+    def test_xdg_cache_home(self, monkeypatch, tmp_path):
+        """Without an override, $XDG_CACHE_HOME/mpbuild is used."""
+        monkeypatch.delenv("MPBUILD_CACHE_DIR")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+        assert cache_dir() == tmp_path / "mpbuild"
+
+    def test_home_fallback(self, monkeypatch):
+        """Falls back to ~/.cache/mpbuild."""
+        monkeypatch.delenv("MPBUILD_CACHE_DIR")
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        assert cache_dir() == Path.home() / ".cache" / "mpbuild"
+
+
+class TestJson:
+    def test_round_trip(self, tmp_path):
+        """write_json creates parent directories and read_json decodes it."""
+        path = tmp_path / "a" / "b.json"
+        assert write_json(path, {"x": [1, 2]}) is True
+        assert read_json(path) == {"x": [1, 2]}
+
+    def test_missing_returns_default(self, tmp_path):
+        assert read_json(tmp_path / "nope.json", default={}) == {}
+
+    def test_corrupt_returns_default(self, tmp_path):
+        path = tmp_path / "bad.json"
+        path.write_text("{")
+        assert read_json(path, default=[]) == []
+
+    def test_unwritable_returns_false(self, tmp_path):
+        """A cache that cannot be written is reported, not raised."""
+        blocker = tmp_path / "file"
+        blocker.write_text("")
+        assert write_json(blocker / "sub" / "x.json", {}) is False
+
+    def test_no_temp_files_left_behind(self, tmp_path):
+        write_json(tmp_path / "x.json", {})
+        assert [p.name for p in tmp_path.iterdir()] == ["x.json"]
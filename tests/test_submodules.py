@@ -0,0 +1,128 @@
+"""Tests for submodules — skipping `make submodules` when nothing changed."""
+
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from mpbuild.board_database import Database
+from mpbuild.build import docker_build_cmd, docker_build_spec
+from mpbuild.state import cache_dir
+from mpbuild.submodules import record_submodules, submodule_state, submodules_current
+
+
+def _git(cwd: Path, *args: str) -> None:
+    subprocess.run(
+        [
+            "git",
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@example.com",
+            "-c",
+            "protocol.file.allow=always",
+            *args,
+        ],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def lib(tmp_path_factory):
+    """A repository to use as a submodule, with two commits."""
+    path = tmp_path_factory.mktemp("lib")
+    _git(path, "init", "-q")
+    (path / "lib.c").write_text("1")
+    _git(path, "add", ".")
+    _git(path, "commit", "-q", "-m", "one")
+    (path / "lib.c").write_text("2")
+    _git(path, "commit", "-q", "-am", "two")
+    return path
+
+
+@pytest.fixture
+def repo(mpy_root, make_board, lib):
+    make_board("stm32", "PYBV11", mcu="stm32f4")
+    _git(mpy_root, "init", "-q")
+    _git(mpy_root, "submodule", "add", "-q", str(lib), "lib/x")
+    _git(mpy_root, "add", ".")
+    _git(mpy_root, "commit", "-q", "-m", "initial")
+    return mpy_root
+
+
+@pytest.fixture
+def pyb(repo):
+    return Database(repo).boards["PYBV11"]
+
+
+@pytest.fixture(autouse=True)
+def _stub_host_devices(monkeypatch):
+    monkeypatch.setattr("mpbuild.build.glob.glob", lambda _pattern: [])
+
+
+class TestSubmoduleState:
+    def test_not_a_git_checkout(self, mpy_root, make_board):
+        make_board("stm32", "PYBV11", mcu="stm32f4")
+        board = Database(mpy_root).boards["PYBV11"]
+        assert submodule_state(mpy_root) is None
+        record_submodules(board)
+        assert not submodules_current(board)
+
+    def test_stable(self, repo):
+        assert submodule_state(repo) == submodule_state(repo)
+
+    def test_checked_out_commit_counts(self, repo):
+        before = submodule_state(repo)
+        _git(repo / "lib" / "x", "checkout", "-q", "HEAD~1")
+        assert submodule_state(repo) != before
+
+    def test_uninitialised_counts(self, repo):
+        before = submodule_state(repo)
+        _git(repo, "submodule", "deinit", "-q", "lib/x")
+        assert submodule_state(repo) != before
+
+
+class TestSkipStep:
+    def test_current_after_record(self, pyb):
+        assert not submodules_current(pyb)
+        record_submodules(pyb)
+        assert submodules_current(pyb)
+
+    def test_stamp_per_variant(self, pyb):
+        record_submodules(pyb)
+        assert not submodules_current(pyb, "DP")
+
+    def test_change_invalidates(self, repo, pyb):
+        record_submodules(pyb)
+        _git(repo / "lib" / "x", "checkout", "-q", "HEAD~1")
+        assert not submodules_current(pyb)
+
+    def test_build_command_skips_step(self, pyb):
+        assert "BOARD=PYBV11 submodules && " in docker_build_cmd(pyb)
+        assert "submodule.fetchJobs" in docker_build_cmd(pyb)
+        record_submodules(pyb)
+        cmd = docker_build_cmd(pyb)
+        assert "submodules" not in cmd
+        assert "make -j" in cmd
+
+    def test_left_out_without_submodules(self, pyb):
+        assert "submodules" not in docker_build_spec(pyb, submodules=False).script
+
+    def test_submodules_only(self, pyb):
+        script = docker_build_spec(pyb, submodules_only=True).script
+        assert script.endswith("make -C ports/stm32 BOARD=PYBV11 submodules")
+        assert "make -j" not in script
+        assert "mpy-cross" not in script
+        record_submodules(pyb)
+        assert docker_build_spec(pyb, submodules_only=True).script == "true"
+
+    def test_stamp_replaced_whole(self, pyb):
+        record_submodules(pyb)
+        record_submodules(pyb)
+        assert submodules_current(pyb)
+        stamps = [p.name for p in (cache_dir() / "submodules").rglob("*") if p.is_file()]
+        assert stamps == ["stm32-PYBV11"]
@@ -0,0 +1,447 @@
+"""Tests for timings — how long each step of a build took."""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import subprocess
+import time
+
+import pytest
+
+from mpbuild import Runtime
+from mpbuild.board_database import Database
+from mpbuild.build import (
+    NATIVE_IMAGE,
+    OOM_EXIT_CODE,
+    PROFILE_MOUNT,
+    TIMINGS_MOUNT,
+    BuildContext,
+    CompileResult,
+    PhaseResult,
+    build_board,
+    docker_build_spec,
+    mpy_cross_build_dir,
+    parse_compile,
+    parse_phase,
+    prepare_profiler,
+)
+from mpbuild.timings import (
+    BuildTimings,
+    compiles_file,
+    format_slowest,
+    format_timings,
+    host_phase,
+    phase_totals,
+    phases_file,
+    read_compiles,
+    read_phases,
+    slowest_compiles,
+    write_timings_json,
+)
+
+FAKE_MAKE = """#!/bin/sh
+echo "make $*"
+case "$*" in *submodules) exit "${FAKE_MAKE_SUBMODULES_STATUS:-0}" ;; esac
+"""
+
+
+@pytest.fixture(autouse=True)
+def _stub_host_devices(monkeypatch):
+    monkeypatch.setattr("mpbuild.build.host_device_flags", lambda: "")
+    monkeypatch.setattr("mpbuild.build.glob.glob", lambda _pattern: [])
+
+
+FAKE_GCC = """#!/bin/sh
+echo "gcc $*"
+exit "${FAKE_GCC_STATUS:-0}"
+"""
+
+
+@pytest.fixture
+def pyb(mpy_root, make_board):
+    make_board("stm32", "PYBV11", mcu="stm32f4")
+    return Database(mpy_root).boards["PYBV11"]
+
+
+# ===================================================================
+# Phase lines
+# ===================================================================
+class TestParse:
+    def test_with_start(self):
+        assert parse_phase(
+            "mpbuild-phase: make exited 0 after 41.250000s at 1760000000.500000"
+        ) == PhaseResult("make", 0, 41.25, 1760000000.5)
+
+    def test_without_start(self):
+        phase = parse_phase("mpbuild-phase: clean exited 2 after 1.0s")
+        assert phase is not None
+        assert phase.start is None
+
+
+# ===================================================================
+# The build steps
+# ===================================================================
+class TestBuildSpec:
+    def test_steps_timed(self, pyb, _isolated_cache_dir):
+        with phases_file() as path:
+            spec = docker_build_spec(pyb, timings_file=path)
+        assert (str(path.parent), TIMINGS_MOUNT) in spec.mounts
+        assert spec.timings_file == f"{TIMINGS_MOUNT}/{path.name}"
+        script = spec.shell_script()
+        assert script.startswith(f"MPBUILD_PHASES={TIMINGS_MOUNT}/{path.name}; _mpbuild_phase()")
+        steps = ["safe-directory", "mpy-cross", "submodules", "make"]
+        positions = [script.index(f"_mpbuild_phase {step} ") for step in steps]
+        assert positions == sorted(positions)
+        assert "_mpbuild_phase ci-setup" not in script
+
+    def test_untimed(self, pyb):
+        spec = docker_build_spec(pyb)
+        assert spec.timings_file is None
+        assert "_mpbuild_phase" not in spec.shell_script()
+
+    def test_reused_container_keeps_one_pool(self, pyb, _isolated_cache_dir):
+        with phases_file() as first, phases_file() as second:
+            specs = [
+                docker_build_spec(pyb, reuse_container=True, timings_file=path)
+                for path in (first, second)
+            ]
+        assert specs[0].pool_name == specs[1].pool_name
+        assert "_mpbuild_phase safe-directory" not in specs[0].shell_script()
+
+    @pytest.mark.parametrize("submodules_status", [0, 2])
+    def test_native_build_records_steps(
+        self, pyb, mpy_root, tmp_path, monkeypatch, submodules_status
+    ):
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "make").write_text(FAKE_MAKE)
+        (bin_dir / "make").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("FAKE_MAKE_SUBMODULES_STATUS", str(submodules_status))
+        monkeypatch.setattr("mpbuild.build.shutil.which", lambda name: f"/usr/bin/{name}")
+        mpy_cross_build_dir(mpy_root, NATIVE_IMAGE).mkdir(parents=True)
+        context = BuildContext.create(mpy_root, runtime=Runtime.native)
+
+        with phases_file() as path:
+            spec = docker_build_spec(pyb, context=context, timings_file=path)
+            spawned = time.time()
+            proc = subprocess.run(spec.argv(), cwd=mpy_root, capture_output=True, text=True)
+            phases = read_phases(path, spawned)
+            assert path.read_text() == ""
+
+        assert "mpbuild-phase" not in proc.stdout
+        assert proc.returncode == submodules_status
+        steps = [(p.name, p.returncode) for p in phases]
+        if submodules_status:
+            assert steps == [("start", 0), ("mpy-cross", 0), ("submodules", 2)]
+        else:
+            assert steps == [("start", 0), ("mpy-cross", 0), ("submodules", 0), ("make", 0)]
+        for p in phases:
+            assert p.start is not None
+            assert 0 <= p.duration < 10
+            assert spawned <= p.start < spawned + 10
+
+
+# ===================================================================
+# Records
+# ===================================================================
+class TestRecords:
+    def test_phases_file_removed(self, _isolated_cache_dir):
+        with phases_file() as path:
+            assert path.parent == _isolated_cache_dir / "timings"
+            assert path.read_text() == ""
+        assert not path.exists()
+
+    def test_host_phase(self):
+        phases: list[PhaseResult] = []
+        with host_phase(phases, "deploy"):
+            pass
+        with pytest.raises(SystemExit), host_phase(phases, "images"):
+            raise SystemExit(3)
+        assert [(p.name, p.returncode) for p in phases] == [("deploy", 0), ("images", 3)]
+        assert all(p.start is not None for p in phases)
+
+    def test_format(self):
+        phases = [PhaseResult("images", 0, 0.12), PhaseResult("make", 2, 41.3)]
+        assert format_timings(phases) == "images 0.1s, make 41.3s (exit 2)"
+
+    def test_totals(self):
+        builds = [
+            BuildTimings(
+                "PYBV11", "stm32", 0, [PhaseResult("start", 0, 1), PhaseResult("make", 0, 2)]
+            ),
+            BuildTimings("RPI_PICO", "rp2", 2, [PhaseResult("make", 2, 3)]),
+        ]
+        assert phase_totals(builds) == [PhaseResult("start", 0, 1), PhaseResult("make", 2, 5)]
+
+    def test_json(self, tmp_path):
+        path = tmp_path / "timings.json"
+        build = BuildTimings("PYBV11", "stm32", 0, [PhaseResult("make", 0, 2.5, 100.0)])
+        write_timings_json(path, [build], [PhaseResult("images", 0, 0.5, 99.0)])
+        assert json.loads(path.read_text()) == {
+            "version": 1,
+            "phases": [{"name": "images", "start": 99.0, "duration": 0.5, "returncode": 0}],
+            "builds": [
+                {
+                    "target": "PYBV11",
+                    "port": "stm32",
+                    "returncode": 0,
+                    "phases": [{"name": "make", "start": 100.0, "duration": 2.5, "returncode": 0}],
+                }
+            ],
+        }
+
+
+# ===================================================================
+# build_board
+# ===================================================================
+class TestBuildBoard:
+    @pytest.fixture
+    def spawned(self, pyb, mpy_root, monkeypatch, _isolated_cache_dir):
+        """
+        Each build reports a make step, what its container used (and,
+        profiled, a compile) and exits with the next of ``returncodes``.
+        """
+        returncodes = []
+
+        class Proc:
+            def __init__(self, spec, **_kwargs):
+                self.returncode = returncodes.pop(0)
+                name = spec.timings_file.removeprefix(f"{TIMINGS_MOUNT}/")
+                with (_isolated_cache_dir / "timings" / name).open("a") as f:
+                    f.write(
+                        f"mpbuild-phase: make exited {self.returncode} "
+                        f"after 2.500000s at {time.time():.6f}\n"
+                    )
+                    if spec.report_memory:
+                        f.write("mpbuild-cpu-usec: 30000000\nmpbuild-memory-peak: 1073741824\n")
+                records = re.search(rf"{PROFILE_MOUNT}/(records/\S+)", spec.script)
+                if records:
+                    with (_isolated_cache_dir / "profile" / records[1]).open("a") as f:
+                        f.write(
+                            "mpbuild-compile: compile exited 0 after 1.500000s "
+                            f"peak - {mpy_root}/ports/stm32/main.c\n"
+                        )
+
+            def wait(self):
+                return self.returncode
+
+        monkeypatch.setattr("mpbuild.runtimes.spawn", Proc)
+        monkeypatch.setattr("mpbuild.container_images.ensure_images", lambda *_a, **_kw: None)
+        monkeypatch.setattr("mpbuild.build.record_submodules", lambda *_: None)
+        monkeypatch.setattr("mpbuild.build.nprocs", 8)
+        return returncodes
+
+    def test_footer_and_json(self, spawned, mpy_root, tmp_path, capsys):
+        spawned.append(0)
+        path = tmp_path / "timings.json"
+        build_board("PYBV11", mpy_dir=mpy_root, timings_json=path)
+        footer = capsys.readouterr().out.splitlines()[-2]
+        assert footer.startswith("Timings: cache ")
+        assert ", images " in footer
+        assert "make 2.5s, deploy " in footer
+        data = json.loads(path.read_text())
+        assert [p["name"] for p in data["phases"]] == ["images"]
+        (build,) = data["builds"]
+        assert build["target"] == "PYBV11"
+        assert [p["name"] for p in build["phases"]] == ["cache", "start", "make", "deploy"]
+
+    def test_failure_reported(self, spawned, mpy_root, tmp_path, capsys):
+        spawned.append(2)
+        path = tmp_path / "timings.json"
+        with pytest.raises(SystemExit):
+            build_board("PYBV11", mpy_dir=mpy_root, timings_json=path)
+        assert "make 2.5s (exit 2)" in capsys.readouterr().out
+        assert json.loads(path.read_text())["builds"][0]["returncode"] == 2
+
+    def test_every_attempt(self, spawned, mpy_root, tmp_path):
+        spawned += [OOM_EXIT_CODE, 0]
+        path = tmp_path / "timings.json"
+        build_board("PYBV11", mpy_dir=mpy_root, timings_json=path)
+        (build,) = json.loads(path.read_text())["builds"]
+        assert [(p["name"], p["returncode"]) for p in build["phases"]] == [
+            ("cache", 0),
+            ("start", 0),
+            ("make", OOM_EXIT_CODE),
+            ("start", 0),
+            ("make", 0),
+            ("deploy", 0),
+        ]
+
+    def test_usage(self, spawned, mpy_root, tmp_path, capsys):
+        spawned += [OOM_EXIT_CODE, 0]
+        path = tmp_path / "timings.json"
+        build_board("PYBV11", mpy_dir=mpy_root, timings_json=path)
+        assert "Container usage: 60.0s CPU, 1.0G peak memory\n" in capsys.readouterr().out
+        (build,) = json.loads(path.read_text())["builds"]
+        assert build["resources"] == {
+            "cpu_seconds": 60.0,
+            "peak_memory": 1024**3,
+            "read_bytes": None,
+            "written_bytes": None,
+        }
+
+    def test_profile_compiles(self, spawned, mpy_root, tmp_path, capsys):
+        spawned.append(0)
+        path = tmp_path / "timings.json"
+        build_board("PYBV11", mpy_dir=mpy_root, timings_json=path, profile_compiles=True)
+        out = capsys.readouterr().out
+        assert "Slowest compiles:\n    1.5s      ?  compile     ports/stm32/main.c\n" in out
+        (build,) = json.loads(path.read_text())["builds"]
+        assert build["compiles"] == [
+            {
+                "file": "ports/stm32/main.c",
+                "kind": "compile",
+                "duration": 1.5,
+                "peak_memory": None,
+                "returncode": 0,
+            }
+        ]
+
+    def test_not_profiled(self, spawned, mpy_root, tmp_path, capsys):
+        spawned.append(0)
+        path = tmp_path / "timings.json"
+        build_board("PYBV11", mpy_dir=mpy_root, timings_json=path)
+        assert "Slowest compiles" not in capsys.readouterr().out
+        assert "compiles" not in json.loads(path.read_text())["builds"][0]
+
+
+# ===================================================================
+# Compile profiling
+# ===================================================================
+class TestProfile:
+    def test_parse(self):
+        assert parse_compile(
+            "mpbuild-compile: preprocess exited 0 after 1.250000s peak 2048K /mpy/py/obj.c"
+        ) == CompileResult("/mpy/py/obj.c", "preprocess", 0, 1.25, 2 * 1024 * 1024)
+        assert parse_compile("mpbuild-compile: link exited 1 after 0.5s peak - a b.elf") == (
+            CompileResult("a b.elf", "link", 1, 0.5)
+        )
+        assert parse_compile("gcc -c py/obj.c") is None
+
+    def test_build_spec(self, pyb, _isolated_cache_dir):
+        with compiles_file() as path:
+            spec = docker_build_spec(pyb, compiles_file=path)
+        profile_dir = _isolated_cache_dir / "profile"
+        assert (str(profile_dir), PROFILE_MOUNT) in spec.mounts
+        records = f"{PROFILE_MOUNT}/records/{path.name}"
+        assert f"{PROFILE_MOUNT}/run {records} make " in spec.script
+        assert (profile_dir / "bin" / "arm-none-eabi-gcc").is_file()
+
+    def test_after_ccache(self, pyb, _isolated_cache_dir):
+        with compiles_file() as path:
+            spec = docker_build_spec(pyb, ccache=True, compiles_file=path)
+        assert f"/ccache/run {PROFILE_MOUNT}/run " in spec.script
+
+    def test_not_for_cmake_ports(self, mpy_root, make_board, _isolated_cache_dir):
+        make_board("rp2", "RPI_PICO")
+        pico = Database(mpy_root).boards["RPI_PICO"]
+        with compiles_file() as path:
+            spec = docker_build_spec(pico, compiles_file=path)
+        assert PROFILE_MOUNT not in spec.script
+
+    @pytest.mark.parametrize(
+        ("args", "kind", "file"),
+        [
+            (["-c", "../../py/obj.c", "-o", "build/py/obj.o"], "compile", "py/obj.c"),
+            (["-E", "-c", "main.c"], "preprocess", "ports/stm32/main.c"),
+            (
+                ["-o", "build/firmware.elf", "build/main.o"],
+                "link",
+                "ports/stm32/build/firmware.elf",
+            ),
+        ],
+    )
+    def test_wrapper(self, mpy_root, tmp_path, monkeypatch, _isolated_cache_dir, args, kind, file):
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "gcc").write_text(FAKE_GCC)
+        (bin_dir / "gcc").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("FAKE_GCC_STATUS", "3")
+        profile_dir = prepare_profiler()
+        cwd = mpy_root / "ports" / "stm32"
+        cwd.mkdir(parents=True, exist_ok=True)
+
+        with compiles_file() as path:
+            proc = subprocess.run(
+                [profile_dir / "run", path, "gcc", *args], cwd=cwd, capture_output=True, text=True
+            )
+            (run,) = read_compiles(path, mpy_root)
+
+        assert proc.stdout == f"gcc {' '.join(args)}\n"
+        assert proc.returncode == 3
+        assert (run.file, run.kind, run.returncode) == (file, kind, 3)
+        assert 0 <= run.duration < 10
+
+    def test_wrapper_without_epochrealtime(
+        self, mpy_root, tmp_path, monkeypatch, _isolated_cache_dir
+    ):
+        """Before bash 5 there's no EPOCHREALTIME; the wrapper times with date."""
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "gcc").write_text(FAKE_GCC)
+        (bin_dir / "gcc").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        profile_dir = prepare_profiler()
+        # Source the wrapper, as itself, in a shell without EPOCHREALTIME.
+        bash4 = ["bash", "-c", 'unset EPOCHREALTIME; . "$0" "$@"', profile_dir / "bin" / "gcc"]
+
+        with compiles_file() as path:
+            proc = subprocess.run(
+                [profile_dir / "run", path, *bash4, "-c", "main.c", "-o", "main.o"],
+                cwd=mpy_root,
+                capture_output=True,
+                text=True,
+            )
+            (run,) = read_compiles(path, mpy_root)
+
+        assert proc.returncode == 0, proc.stderr
+        assert (run.file, run.kind) == ("main.c", "compile")
+        assert 0 <= run.duration < 10
+
+    def test_untracked_runs_pass_through(self, tmp_path, monkeypatch, _isolated_cache_dir):
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "gcc").write_text(FAKE_GCC)
+        (bin_dir / "gcc").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        profile_dir = prepare_profiler()
+        with compiles_file() as path:
+            proc = subprocess.run(
+                [profile_dir / "run", path, "gcc", "--version"], capture_output=True, text=True
+            )
+            assert path.read_text() == ""
+        assert proc.stdout == "gcc --version\n"
+
+    def test_read_outside_repository(self, mpy_root, tmp_path):
+        path = tmp_path / "records"
+        path.write_text(
+            "mpbuild-compile: compile exited 0 after 1.0s peak - /usr/include/x.c\nother output\n"
+        )
+        assert [c.file for c in read_compiles(path, mpy_root)] == ["/usr/include/x.c"]
+        assert path.read_text() == ""
+
+    def test_slowest(self):
+        builds = [
+            BuildTimings(
+                "PYBV11",
+                "stm32",
+                compiles=[
+                    CompileResult("py/obj.c", "compile", 0, 1.0),
+                    CompileResult("py/vm.c", "compile", 1, 3.0, 512 * 1024 * 1024),
+                ],
+            ),
+            BuildTimings("RPI_PICO", "rp2", compiles=[CompileResult("py/gc.c", "compile", 0, 2.0)]),
+        ]
+        slowest = slowest_compiles(builds, count=2)
+        assert [(t, c.file) for t, c in slowest] == [("PYBV11", "py/vm.c"), ("RPI_PICO", "py/gc.c")]
+        assert format_slowest(slowest) == [
+            "    3.0s   512M  compile     py/vm.c (exit 1)  PYBV11",
+            "    2.0s      ?  compile     py/gc.c  RPI_PICO",
+        ]
+        assert format_slowest(slowest[:1], targets=False) == [
+            "    3.0s   512M  compile     py/vm.c (exit 1)"
+        ]
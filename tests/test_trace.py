@@ -0,0 +1,85 @@
+"""Tests for trace — build sessions as Perfetto / chrome://tracing traces."""
+
+from __future__ import annotations
+
+import json
+
+from mpbuild.build import PhaseResult
+from mpbuild.timings import BuildTimings
+from mpbuild.trace import trace_events, trace_path, write_trace
+
+
+def _spans(events: list[dict]) -> list[tuple[int, str, int, int]]:
+    return [(e["tid"], e["name"], e["ts"], e["dur"]) for e in events if e["ph"] == "X"]
+
+
+def _tracks(events: list[dict]) -> dict[int, str]:
+    return {e["tid"]: e["args"]["name"] for e in events if e["name"] == "thread_name"}
+
+
+# ===================================================================
+# Events
+# ===================================================================
+class TestEvents:
+    def test_build_spans_per_slot(self):
+        builds = [
+            BuildTimings(
+                "PYBV11",
+                "stm32",
+                0,
+                [PhaseResult("start", 0, 0.5, 100.0), PhaseResult("make", 0, 2.0, 100.5)],
+                slot=0,
+            ),
+            BuildTimings("RPI_PICO", "rp2", 2, [PhaseResult("make", 2, 1.0, 101.0)], slot=1),
+        ]
+        events = trace_events(builds, [PhaseResult("images", 0, 1.0, 99.0)])
+        assert _spans(events) == [
+            (1, "images", 0, 1_000_000),
+            (1000, "PYBV11", 1_000_000, 2_500_000),
+            (1000, "start", 1_000_000, 500_000),
+            (1000, "make", 1_500_000, 2_000_000),
+            (1001, "RPI_PICO", 2_000_000, 1_000_000),
+            (1001, "make", 2_000_000, 1_000_000),
+        ]
+        assert _tracks(events) == {1: "session", 1000: "slot 1", 1001: "slot 2"}
+        (pico,) = [e for e in events if e["name"] == "RPI_PICO"]
+        assert pico["args"] == {"port": "rp2", "returncode": 2}
+
+    def test_concurrent_pulls_get_lanes(self):
+        pulls = [
+            PhaseResult("arm", 0, 10.0, 0.0),
+            PhaseResult("esp32", 0, 5.0, 1.0),
+            PhaseResult("rp2", 0, 1.0, 8.0),
+        ]
+        events = trace_events([], pulls=pulls)
+        assert [(tid, name) for tid, name, _, _ in _spans(events)] == [
+            (100, "arm"),
+            (101, "esp32"),
+            (101, "rp2"),
+        ]
+        assert _tracks(events) == {100: "image pull 1", 101: "image pull 2"}
+
+    def test_untimed_left_out(self):
+        assert trace_events([BuildTimings("PYBV11", "stm32", 0, [PhaseResult("make", 0, 1)])]) == []
+
+
+# ===================================================================
+# Files
+# ===================================================================
+class TestFile:
+    def test_write(self, tmp_path):
+        path = tmp_path / "trace.json"
+        build = BuildTimings("PYBV11", "stm32", 0, [PhaseResult("make", 0, 1.0, 5.0)])
+        write_trace(path, [build])
+        data = json.loads(path.read_text())
+        assert data["displayTimeUnit"] == "ms"
+        assert _spans(data["traceEvents"]) == [
+            (1000, "PYBV11", 0, 1_000_000),
+            (1000, "make", 0, 1_000_000),
+        ]
+
+    def test_path_from_env(self, monkeypatch, tmp_path):
+        monkeypatch.delenv("MPBUILD_TRACE", raising=False)
+        assert trace_path() is None
+        monkeypatch.setenv("MPBUILD_TRACE", str(tmp_path / "trace.json"))
+        assert trace_path() == tmp_path / "trace.json"